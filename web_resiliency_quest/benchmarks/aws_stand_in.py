@@ -0,0 +1,249 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Stand-ins of the team AWS accounts for the benchmarks: CloudFront, WAFv2, CloudWatch and STS answer from an in-memory
+# model of every team account, with a configurable latency and throttling rate. Calls to other services (the DynamoDB
+# QUEST_TEAM_STATUS_TABLE, served by moto) get the latency of --dynamodb-latency-ms and go through.
+# Calls are intercepted at botocore's BaseClient._make_api_call, so the handlers run unmodified. The stubbed calls emit
+# the before-call, response-received and after-call events of botocore, for the hooks registered on the clients.
+import datetime
+import random
+import threading
+import time
+from collections import Counter
+import botocore.client
+from botocore.exceptions import ClientError
+
+STUBBED_SERVICES = ('cloudfront', 'wafv2', 'cloudwatch', 'sts')
+TASK5_ADDRESS = '52.23.186.156/32'
+TASK5_WEB_ACL_NAME = 'waf-web-acl'
+# AWS-verified tasks in the order the teams complete them: 2, 3, 5 and 6
+AWS_STEPS = 4
+
+
+# Resources of one team account. The account holds `ip_sets` and `alarms` unrelated resources besides the ones the
+# team creates for the quest, and completes one more AWS task every time advance() is called. Changes are timestamped
+# with clock.time()
+class TeamAccount:
+
+    def __init__(self, team_id, index, ip_sets, alarms, clock=time):
+        self.team_id = team_id
+        self.clock = clock
+        self.access_key = f"ASIA{index:016d}"
+        self.account_id = f"{100000000000 + index}"
+        self.distribution_id = f"E{index:012d}"
+        self.elb_dns_name = f"elb-{team_id}.example.com"
+        self.steps = 0
+        self.etag = 1
+        self.last_modified_time = self._now()
+        self.origin = 'www.amazon.com'
+        self.logging = False
+        self.web_acl_id = ''
+        self.ip_sets = [self._ip_set(f"other-{index}", [f"10.{index // 250}.{index % 250}.0/24"]) for index in range(ip_sets)]
+        self.web_acls = []
+        self.alarms = [{
+            'AlarmName': f"other-{index}",
+            'Namespace': 'AWS/EC2',
+            'MetricName': 'CPUUtilization',
+            'Dimensions': [{'Name': 'InstanceId', 'Value': f"i-{index:017d}"}]
+        } for index in range(alarms)]
+        self.lock = threading.Lock()
+
+    def advance(self):
+        with self.lock:
+            if self.steps == AWS_STEPS:
+                return
+            self.steps += 1
+            if self.steps < AWS_STEPS:
+                self.last_modified_time = self._now()
+            if self.steps == 1:
+                self.origin = self.elb_dns_name
+                self.etag += 1
+            elif self.steps == 2:
+                self.logging = True
+                self.etag += 1
+            elif self.steps == 3:
+                ip_set = self._ip_set('blocked-ips', [TASK5_ADDRESS])
+                self.ip_sets.append(ip_set)
+                web_acl_arn = f"arn:aws:wafv2:us-east-1:{self.account_id}:global/webacl/{TASK5_WEB_ACL_NAME}/acl-{self.team_id}"
+                self.web_acls.append({
+                    'Name': TASK5_WEB_ACL_NAME, 'Id': f"acl-{self.team_id}", 'ARN': web_acl_arn, 'LockToken': 'token-1',
+                    'Rules': [{'Name': 'block', 'Statement': {'IPSetReferenceStatement': {'ARN': ip_set['ARN']}}}]
+                })
+                self.web_acl_id = web_acl_arn
+                self.etag += 1
+            else:
+                self.alarms.append({
+                    'AlarmName': 'cloudfront-requests',
+                    'Namespace': 'AWS/CloudFront',
+                    'MetricName': 'Requests',
+                    'Dimensions': [{'Name': 'DistributionId', 'Value': self.distribution_id}, {'Name': 'Region', 'Value': 'Global'}],
+                    'AlarmConfigurationUpdatedTimestamp': self._now()
+                })
+
+    def _now(self):
+        return datetime.datetime.fromtimestamp(self.clock.time(), datetime.timezone.utc)
+
+    def _ip_set(self, name, addresses):
+        return {
+            'Name': name, 'Id': f"{name}-{self.team_id}", 'LockToken': 'token-1', 'Addresses': addresses,
+            'ARN': f"arn:aws:wafv2:us-east-1:{self.account_id}:global/ipset/{name}/{name}-{self.team_id}"
+        }
+
+    # The answer of the team account to an API call, as returned by botocore
+    def call(self, operation_name, params):
+        with self.lock:
+            if operation_name == 'GetCallerIdentity':
+                return {'Account': self.account_id, 'Arn': f"arn:aws:sts::{self.account_id}:assumed-role/OpsRole/stand-in"}
+            if operation_name == 'GetDistributionConfig':
+                return {'ETag': f"ETAG{self.etag}", 'DistributionConfig': {
+                    'Origins': {'Quantity': 1, 'Items': [{'Id': 'origin', 'DomainName': self.origin}]},
+                    'Logging': {'Enabled': self.logging, 'IncludeCookies': False, 'Bucket': '', 'Prefix': ''},
+                    'WebACLId': self.web_acl_id
+                }}
+            if operation_name == 'GetDistribution':
+                return {'ETag': f"ETAG{self.etag}", 'Distribution': {
+                    'Id': self.distribution_id, 'LastModifiedTime': self.last_modified_time,
+                    'DomainName': f"{self.distribution_id.lower()}.cloudfront.net"
+                }}
+            if operation_name == 'ListIPSets':
+                return _page(self.ip_sets, 'IPSets', params, ('Name', 'Id', 'ARN', 'LockToken'))
+            if operation_name == 'ListWebACLs':
+                return _page(self.web_acls, 'WebACLs', params, ('Name', 'Id', 'ARN', 'LockToken'))
+            if operation_name == 'GetWebACL':
+                web_acl = next(web_acl for web_acl in self.web_acls if web_acl['Id'] == params['Id'])
+                return {'WebACL': dict(web_acl), 'LockToken': web_acl['LockToken']}
+            if operation_name == 'GetIPSet':
+                ip_set = next(ip_set for ip_set in self.ip_sets if ip_set['Id'] == params['Id'])
+                return {'IPSet': dict(ip_set), 'LockToken': ip_set['LockToken']}
+            if operation_name == 'DescribeAlarmsForMetric':
+                return {'MetricAlarms': [alarm for alarm in self.alarms if alarm['Namespace'] == params['Namespace']
+                                         and alarm['MetricName'] == params['MetricName']
+                                         and alarm['Dimensions'] == params['Dimensions']]}
+            if operation_name == 'DescribeAlarms':
+                start = int(params.get('NextToken', 0))
+                end = start + params.get('MaxRecords', 50)
+                response = {'MetricAlarms': self.alarms[start:end]}
+                if end < len(self.alarms):
+                    response['NextToken'] = str(end)
+                return response
+        raise NotImplementedError(f"{operation_name} is not part of the team account stand-in")
+
+
+# The HTTP response passed to the after-call hooks
+class HttpResponse:
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def _page(items, items_key, params, fields):
+    start = int(params.get('NextMarker', 0))
+    end = start + params.get('Limit', 100)
+    return {items_key: [{field: item[field] for field in fields} for item in items[start:end]], 'NextMarker': str(end)}
+
+
+# Routes the botocore calls of the handlers: the stubbed services to the team accounts, identified by the access key of
+# the calling client, everything else to the original implementation
+class AwsStandIn:
+
+    def __init__(self, latency_ms=40, throttle_rate=0.0, max_attempts=5, dynamodb_latency_ms=5, seed=42, clock=time):
+        self.latency_ms = latency_ms
+        self.clock = clock
+        self.throttle_rate = throttle_rate
+        self.max_attempts = max_attempts
+        self.dynamodb_latency_ms = dynamodb_latency_ms
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.accounts = {}
+        self.accounts_by_key = {}
+        self.calls = Counter()
+        self.throttles = Counter()
+        self.stats_lock = threading.Lock()
+        self.original_make_api_call = None
+
+    def add_account(self, team_id, ip_sets=5, alarms=10):
+        account = TeamAccount(team_id, len(self.accounts), ip_sets, alarms, self.clock)
+        self.accounts[team_id] = account
+        self.accounts_by_key[account.access_key] = account
+        return account
+
+    # STS AssumeRole of the team's Ops role, made by the Quests API stand-in for assume_team_ops_role
+    def assume_role(self, team_id):
+        self._call_with_throttling('sts', 'AssumeRole', self.latency_ms)
+        return {'AccessKeyId': self.accounts[team_id].access_key, 'SecretAccessKey': 'stand-in', 'SessionToken': 'stand-in'}
+
+    def install(self):
+        self.original_make_api_call = botocore.client.BaseClient._make_api_call
+        stand_in = self
+
+        def make_api_call(client, operation_name, params):
+            return stand_in.make_api_call(client, operation_name, params)
+        botocore.client.BaseClient._make_api_call = make_api_call
+
+    def uninstall(self):
+        botocore.client.BaseClient._make_api_call = self.original_make_api_call
+
+    def make_api_call(self, client, operation_name, params):
+        service_name = client.meta.service_model.service_name
+        if service_name not in STUBBED_SERVICES:
+            self._sleep(self.dynamodb_latency_ms if service_name == 'dynamodb' else 0)
+            with self.stats_lock:
+                self.calls[service_name] += 1
+            return self.original_make_api_call(client, operation_name, params)
+        account = self.accounts_by_key[client._request_signer._credentials.access_key]
+        operation_model = client.meta.service_model.operation_model(operation_name)
+        event_suffix = f"{client.meta.service_model.service_id.hyphenize()}.{operation_name}"
+        request_context = {}
+        client.meta.events.emit(f"before-call.{event_suffix}", model=operation_model, params=params,
+                                request_signer=client._request_signer, context=request_context)
+        try:
+            retries = self._call_with_throttling(
+                service_name, operation_name, self.latency_ms,
+                on_throttled=lambda error_response: client.meta.events.emit(
+                    f"response-received.{event_suffix}", exception=None, response_dict=None,
+                    parsed_response=error_response, context=request_context))
+        except ClientError as err:
+            client.meta.events.emit(f"after-call.{event_suffix}", http_response=HttpResponse(400), parsed=err.response,
+                                    model=operation_model, context=request_context)
+            raise
+        response = account.call(operation_name, params)
+        response['ResponseMetadata'] = {'HTTPStatusCode': 200, 'RetryAttempts': retries}
+        client.meta.events.emit(f"after-call.{event_suffix}", http_response=HttpResponse(200), parsed=response,
+                                model=operation_model, context=request_context)
+        return response
+
+    def reset_stats(self):
+        with self.stats_lock:
+            calls, throttles = self.calls, self.throttles
+            self.calls, self.throttles = Counter(), Counter()
+        return calls, throttles
+
+    # One call as the botocore retry handler sees it: every attempt takes the service latency, a throttled attempt is
+    # retried after an exponential backoff with full jitter, until max_attempts is reached. on_throttled gets the error
+    # response of every throttled attempt. :returns: the number of retries
+    def _call_with_throttling(self, service_name, operation_name, latency_ms, on_throttled=None):
+        error_response = {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'},
+                          'ResponseMetadata': {'HTTPStatusCode': 400, 'RetryAttempts': self.max_attempts - 1}}
+        for attempt in range(self.max_attempts):
+            self._sleep(latency_ms)
+            with self.rng_lock:
+                throttled = self.rng.random() < self.throttle_rate
+                backoff = self.rng.uniform(0, 0.05 * 2 ** attempt)
+            with self.stats_lock:
+                self.calls[service_name] += 1
+                if throttled:
+                    self.throttles[service_name] += 1
+            if not throttled:
+                return attempt
+            if on_throttled is not None:
+                on_throttled(error_response)
+            if attempt + 1 < self.max_attempts:
+                time.sleep(backoff)
+        raise ClientError(error_response, operation_name)
+
+    def _sleep(self, latency_ms):
+        if latency_ms:
+            with self.rng_lock:
+                latency = latency_ms * self.rng.lognormvariate(0, 0.4) / 1000
+            time.sleep(latency)
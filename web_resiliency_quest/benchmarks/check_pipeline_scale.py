@@ -0,0 +1,361 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Scale benchmark of the cron_lambda -> check_team_lambda pipeline. The real handlers run in-process against local
+# stand-ins: the Quests API over local HTTP (quests_api_stand_in.py), QUEST_TEAM_STATUS_TABLE in moto's DynamoDB, and
+# the CloudFront, WAFv2, CloudWatch and STS APIs of every team account (aws_stand_in.py). Needs the packages of
+# central_lambda_source/requirements.txt and moto.
+#
+#    python3 benchmarks/check_pipeline_scale.py [--teams 50 500 2000] [--mixes idle=0.3,working=0.5,done=0.2]
+#        [--minutes 5] [--dispatch TEAM|BATCH] [--aws-latency-ms 40] [--throttle-rate 0.0] ...
+#
+# Every run simulates --minutes cron cycles for one team count and progress mix. The teams of a mix are
+#  - idle: never change anything in their account, they are checked and backed off
+#  - working: have answered the input tasks, and complete their next AWS task with probability --progress-rate
+#    every minute
+#  - done: have completed the quest, they are not in the pending checks index
+# Time is simulated: every cycle starts 60 seconds after the previous one, however long it took, so the adaptive
+# schedule of schedule_utils.py sees the minutes pass. Async CHECK_TEAM_LAMBDA invocations run on a pool of
+# --lambda-concurrency threads, each standing for a Lambda container. The containers share one process, hence one
+# Quests API read cache, connection pool and cross-account session cache: a real fleet opens more connections and
+# assumes the team roles once per container.
+#
+# Per minute it reports the due teams, the invocations, the cycle time (from the start of cron_lambda to the end of
+# the last check), the p50/p99 of the check time of a team, and the calls made to every service. With --trace, the spans
+# of the handlers are kept in memory (trace_utils.InMemoryExporter) and the timeline of the slowest check of the last
+# minute is printed at the end of the run.
+import argparse
+import contextlib
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+QUEST_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(QUEST_ROOT_DIR, 'central_lambda_source'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import boto3
+from moto import mock_aws
+import aws_stand_in
+import quests_api_stand_in
+
+QUEST_ID = 'benchmark'
+TABLE_NAME = 'benchmark-team-status'
+SERVICES = ['quests-api', 'sts', 'cloudfront', 'wafv2', 'cloudwatch', 'dynamodb']
+PROGRESS_KINDS = ['idle', 'working', 'done']
+# AWS-verified tasks whose detection latency check_team_lambda records
+DETECTED_TASKS = ['task2', 'task3', 'task5', 'task6']
+
+
+# Stands in for the lambda client of cron_lambda: every async invocation runs check_team_lambda on the executor
+class LambdaStandIn:
+
+    def __init__(self, executor, handler):
+        self.executor = executor
+        self.handler = handler
+        self.futures = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.futures.append(self.executor.submit(self.handler, json.loads(Payload), None))
+        return {'StatusCode': 202}
+
+    # Waits for the invocations of the cycle. :returns: the number of failed invocations
+    def wait(self):
+        futures, self.futures = self.futures, []
+        failed = 0
+        for future in futures:
+            if future.exception() is not None:
+                failed += 1
+        return failed
+
+
+# Replaces the time module of the handlers. Durations are real, but each cycle starts 60 seconds after the previous one
+class SimulatedClock:
+
+    def __init__(self):
+        self.offset = 0
+
+    def start_minute(self, start_time, minute):
+        self.offset = start_time + 60 * minute - time.time()
+
+    def time(self):
+        return time.time() + self.offset
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def parse_mix(mix):
+    weights = {kind: 0.0 for kind in PROGRESS_KINDS}
+    for part in mix.split(','):
+        kind, weight = part.split('=')
+        if kind not in weights:
+            raise argparse.ArgumentTypeError(f"Unknown team progress '{kind}', expected one of {PROGRESS_KINDS}")
+        weights[kind] = float(weight)
+    return weights
+
+
+def create_table():
+    dynamodb = boto3.client('dynamodb')
+    if TABLE_NAME in dynamodb.list_tables()['TableNames']:
+        dynamodb.delete_table(TableName=TABLE_NAME)
+    dynamodb.create_table(
+        TableName=TABLE_NAME,
+        AttributeDefinitions=[
+            {'AttributeName': 'team-id', 'AttributeType': 'S'},
+            {'AttributeName': 'aws-account-id', 'AttributeType': 'S'},
+            {'AttributeName': 'pending-quest-id', 'AttributeType': 'S'},
+            {'AttributeName': 'next-check-at', 'AttributeType': 'N'}
+        ],
+        KeySchema=[{'AttributeName': 'team-id', 'KeyType': 'HASH'}],
+        BillingMode='PAY_PER_REQUEST',
+        GlobalSecondaryIndexes=[
+            {'IndexName': 'aws-account-id-index',
+             'KeySchema': [{'AttributeName': 'aws-account-id', 'KeyType': 'HASH'}],
+             'Projection': {'ProjectionType': 'KEYS_ONLY'}},
+            {'IndexName': 'pending-checks-index',
+             'KeySchema': [{'AttributeName': 'pending-quest-id', 'KeyType': 'HASH'},
+                           {'AttributeName': 'next-check-at', 'KeyType': 'RANGE'}],
+             'Projection': {'ProjectionType': 'KEYS_ONLY'}}
+        ])
+
+
+# Creates the teams of a run, the way init_lambda.create_team does, with the tasks of their progress completed and
+# their dashboard already published. :returns: the team accounts of the working teams
+def create_teams(run_id, team_count, weights, aws, quests_api, start_time, rng):
+    import dashboard_utils
+    import dynamodb_utils
+    import evaluation_utils
+    import quest_const
+    import schedule_utils
+
+    create_table()
+    table = boto3.resource('dynamodb').Table(TABLE_NAME)
+    working_accounts = []
+    kinds = rng.choices(PROGRESS_KINDS, weights=[weights[kind] for kind in PROGRESS_KINDS], k=team_count)
+    with table.batch_writer() as batch:
+        for index, kind in enumerate(kinds):
+            team_id = f"{run_id}-team-{index}"
+            account = aws.add_account(team_id)
+            quests_api.add_team(team_id, int(time.time()) - 1800)
+            item = {
+                'team-id': team_id,
+                'quest-start-time': int(time.time()) - 1800,
+                'aws-account-id': account.account_id,
+                'cloudfront-distribution-id': account.distribution_id,
+                'cloudfront-domain-name': f"{account.distribution_id.lower()}.cloudfront.net",
+                'elb-dns-name': account.elb_dns_name,
+                'waf_acl_id': 'ERROR',
+                'quest-completed': False,
+                'next-check-at': int(start_time),
+                'activity-score': schedule_utils.ACTIVITY_SCORE_MAX,
+                'pending-quest-id': QUEST_ID
+            }
+            if kind == 'working':
+                item[dynamodb_utils.COMPLETED_TASKS_KEY] = set(quest_const.INPUT_TASK_FLAGS)
+                working_accounts.append(account)
+            elif kind == 'done':
+                for _ in range(aws_stand_in.AWS_STEPS):
+                    account.advance()
+                item[dynamodb_utils.COMPLETED_TASKS_KEY] = set(dynamodb_utils.TASK_FLAGS)
+                item['quest-completed'] = True
+                del item['pending-quest-id']
+            team_data = dynamodb_utils.load_team_data(item)
+            item['dashboard-state'] = {
+                entry_id: evaluation_utils.compute_digest(fields.items())
+                for entry_id, (kind, fields) in dashboard_utils.render_dashboard(team_data, lambda image_name: image_name).items()
+            }
+            batch.put_item(Item=item)
+    return working_accounts, Counter(kinds)
+
+
+def percentile(values, fraction):
+    return int(values[min(len(values) - 1, int(len(values) * fraction))]) if values else 0
+
+
+# Prints the p50/p99/max of the detection latency of every AWS task, as stored on the team items by check_team_lambda
+def print_detection_latencies():
+    table = boto3.resource('dynamodb').Table(TABLE_NAME)
+    items = []
+    scan_params = {}
+    while True:
+        response = table.scan(**scan_params)
+        items += response['Items']
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    for task in DETECTED_TASKS:
+        latencies = sorted(int(item[f"{task}-detection-seconds"]) for item in items if f"{task}-detection-seconds" in item)
+        if latencies:
+            print(f"{task} detection_s p50={percentile(latencies, 0.5)} p99={percentile(latencies, 0.99)} " +
+                  f"max={latencies[-1]} (teams={len(latencies)})", file=sys.__stdout__)
+
+
+# Prints the spans of the slowest check of the last cron cycle, with their offset from the start of the check
+def print_slowest_check(exporter):
+    cron_spans = [span for span in exporter.spans if span['name'] == 'cron_lambda']
+    if not cron_spans:
+        return
+    trace_id = max(cron_spans, key=lambda span: span['start'])['trace-id']
+    check_spans = [span for span in exporter.spans
+                   if span['trace-id'] == trace_id and span['name'] in ('check_team_lambda', 'check_team')]
+    if not check_spans:
+        return
+    slowest = max(check_spans, key=lambda span: span['duration-ms'])
+    print(f"Slowest check of the last minute, trace {trace_id}:", file=sys.__stdout__)
+    print(f"{'offset_ms':>9} {'duration_ms':>11} span", file=sys.__stdout__)
+    for span in exporter.get_timeline(trace_id, slowest['span-id']):
+        attributes = ' '.join(f"{key}={value}" for key, value in span['attributes'].items())
+        print(f"{span['offset-ms']:>9} {span['duration-ms']:>11} {'  ' * span['depth']}{span['name']} {attributes}",
+              file=sys.__stdout__)
+
+
+def run(run_id, team_count, mix, args, aws, quests_api, lambda_stand_in, clock, check_times, exporter):
+    import cron_lambda
+
+    rng = random.Random(args.seed)
+    start_time = time.time()
+    working_accounts, kinds = create_teams(run_id, team_count, parse_mix(mix), aws, quests_api, start_time, rng)
+    print(f"\n{team_count} teams, mix {mix} ({', '.join(f'{kind}={kinds[kind]}' for kind in PROGRESS_KINDS)}), " +
+          f"dispatch {args.dispatch}", file=sys.__stdout__)
+    print(f"{'minute':>6} {'due':>6} {'invoked':>7} {'failed':>6} {'cycle_ms':>9} {'check_p50':>9} {'check_p99':>9} " +
+          ' '.join(f"{service:>10}" for service in SERVICES) + f" {'throttled':>9}", file=sys.__stdout__)
+
+    due_counts = []
+    original_get_due_teams = cron_lambda.get_due_teams
+    cron_lambda.get_due_teams = lambda now: due_counts.append(original_get_due_teams(now)) or due_counts[-1]
+    cycle_times = []
+    try:
+        for minute in range(args.minutes):
+            clock.start_minute(start_time, minute)
+            for account in working_accounts:
+                if rng.random() < args.progress_rate:
+                    account.advance()
+            aws.reset_stats()
+            quests_api.reset_stats()
+            check_times.clear()
+            if exporter is not None:
+                exporter.spans.clear()
+
+            cycle_start = time.time()
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                cron_lambda.lambda_handler({}, None)
+                invocations = len(lambda_stand_in.futures)
+                failed = lambda_stand_in.wait()
+            cycle_ms = (time.time() - cycle_start) * 1000
+            cycle_times.append(cycle_ms)
+
+            calls, throttles = aws.reset_stats()
+            calls['quests-api'] = sum(quests_api.reset_stats().values())
+            times = sorted(check_times)
+            print(f"{minute + 1:>6} {len(due_counts[-1]):>6} {invocations:>7} {failed:>6} {int(cycle_ms):>9} " +
+                  f"{percentile(times, 0.5):>9} {percentile(times, 0.99):>9} " +
+                  ' '.join(f"{calls[service]:>10}" for service in SERVICES) +
+                  f" {sum(throttles.values()):>9}", file=sys.__stdout__)
+    finally:
+        cron_lambda.get_due_teams = original_get_due_teams
+    print(f"cycle_ms p50={int(statistics.median(cycle_times))} max={int(max(cycle_times))}", file=sys.__stdout__)
+    print_detection_latencies()
+    if exporter is not None:
+        print_slowest_check(exporter)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scale benchmark of the cron_lambda -> check_team_lambda pipeline')
+    parser.add_argument('--teams', type=int, nargs='+', default=[50, 500, 2000])
+    parser.add_argument('--mixes', nargs='+', default=['idle=0.3,working=0.5,done=0.2'],
+                        help='Share of idle, working and done teams, e.g. idle=0.1,working=0.9')
+    parser.add_argument('--minutes', type=int, default=5)
+    parser.add_argument('--progress-rate', type=float, default=0.3,
+                        help='Probability that a working team completes its next AWS task in a given minute')
+    parser.add_argument('--dispatch', choices=['TEAM', 'BATCH'], default='TEAM', help='CHECK_DISPATCH_MODE')
+    parser.add_argument('--batch-size', type=int, default=25, help='CHECK_BATCH_SIZE')
+    parser.add_argument('--lambda-concurrency', type=int, default=100,
+                        help='Number of CHECK_TEAM_LAMBDA invocations running at the same time')
+    parser.add_argument('--api-latency-ms', type=float, default=30, help='Latency of the Quests API')
+    parser.add_argument('--aws-latency-ms', type=float, default=40, help='Latency of CloudFront, WAFv2, CloudWatch and STS')
+    parser.add_argument('--dynamodb-latency-ms', type=float, default=5)
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='Share of the team account calls answered with a ThrottlingException')
+    parser.add_argument('--ip-sets', type=int, default=5, help='Unrelated IP sets in every team account')
+    parser.add_argument('--alarms', type=int, default=10, help='Unrelated alarms in every team account')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--trace', action='store_true', help='Print the timeline of the slowest check of every run')
+    args = parser.parse_args()
+    for mix in args.mixes:
+        parse_mix(mix)
+
+    clock = SimulatedClock()
+    aws = aws_stand_in.AwsStandIn(args.aws_latency_ms, args.throttle_rate, dynamodb_latency_ms=args.dynamodb_latency_ms,
+                                  seed=args.seed, clock=clock)
+    aws.add_account = lambda team_id, add_account=aws.add_account: add_account(team_id, args.ip_sets, args.alarms)
+    quests_api = quests_api_stand_in.QuestsApiStandIn(aws, args.api_latency_ms, seed=args.seed)
+    quests_api_stand_in.install()
+
+    # Environment variables the handler modules read at import time, see central_cfn.yaml
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'QUEST_ID': QUEST_ID,
+        'QUEST_API_BASE': quests_api.start(),
+        'QUEST_API_TOKEN': 'benchmark',
+        'GAMEDAY_REGION': 'us-east-1',
+        'ASSETS_BUCKET': 'benchmark',
+        'ASSETS_BUCKET_PREFIX': 'benchmark/',
+        'QUEST_TEAM_STATUS_TABLE': TABLE_NAME,
+        'CHAOS_TIMER_MINUTES': '10',
+        'CHECK_TEAM_LAMBDA': 'benchmark',
+        'CHECK_DISPATCH_MODE': args.dispatch,
+        'CHECK_BATCH_SIZE': str(args.batch_size),
+        'QUESTS_API_POOL_SIZE': str(args.lambda_concurrency)
+    })
+
+    with mock_aws():
+        aws.install()
+        import client_utils
+        import check_team_lambda
+        import cron_lambda
+        import trace_utils
+
+        # Every worker thread stands for a Lambda container, which owns its DynamoDB resource
+        client_utils.get_table = client_utils.get_thread_table
+        cron_lambda.time = clock
+        check_team_lambda.time = clock
+        exporter = trace_utils.InMemoryExporter() if args.trace else None
+        if exporter is not None:
+            trace_utils.set_exporter(exporter)
+
+        check_times = []
+        check_times_lock = threading.Lock()
+        original_check_team = check_team_lambda.check_team
+
+        def timed_check_team(*check_args, **check_kwargs):
+            check_start = time.time()
+            try:
+                return original_check_team(*check_args, **check_kwargs)
+            finally:
+                with check_times_lock:
+                    check_times.append((time.time() - check_start) * 1000)
+        check_team_lambda.check_team = timed_check_team
+
+        with ThreadPoolExecutor(max_workers=args.lambda_concurrency) as executor:
+            lambda_stand_in = LambdaStandIn(executor, check_team_lambda.lambda_handler)
+            client_utils.clients['lambda'] = lambda_stand_in
+            run_number = 0
+            for team_count in args.teams:
+                for mix in args.mixes:
+                    run_number += 1
+                    run(f"run{run_number}", team_count, mix, args, aws, quests_api, lambda_stand_in, clock, check_times,
+                        exporter)
+        aws.uninstall()
+    quests_api.stop()
+
+
+if __name__ == '__main__':
+    main()
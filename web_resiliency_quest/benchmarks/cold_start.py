@@ -0,0 +1,123 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Cold start benchmark for the central Lambda handlers.
+# Every handler module is imported in a fresh Python process, the way a new Lambda execution environment
+# does it, and the import time and peak RSS of the process are reported against cold_start_budget.json.
+# Run it from an environment where central_lambda_source/requirements.txt is installed:
+#
+#    python3 benchmarks/cold_start.py [--runs 5] [--source-dir central_lambda_source] [--output results.json]
+#
+# To compare before/after a change, run it once per checkout (e.g. against a `git worktree` of the base commit)
+# with --output, and compare the two result files. Handlers missing from --source-dir (e.g. sqs_lambda in a checkout
+# older than it) are skipped.
+#
+# The budget of each handler is its measured import time and peak RSS plus BUDGET_MARGIN. After a change that is
+# meant to move them, measure again and rewrite the budget with --update-budget.
+import argparse
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+
+QUEST_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SOURCE_DIR = os.path.join(QUEST_ROOT_DIR, 'central_lambda_source')
+DEFAULT_BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cold_start_budget.json')
+
+# Headroom of the budget over the measured numbers. The median import time of a handler varies by up to a third
+# between runs on the same machine, the peak RSS by less than 1 MB
+BUDGET_MARGIN = {'import_ms': 0.5, 'peak_rss_mb': 0.1}
+
+HANDLERS = ['sns_lambda', 'sqs_lambda', 'init_lambda', 'update_lambda', 'cron_lambda', 'check_team_lambda', 'event_router_lambda']
+
+# Environment variables the handler modules read at import time, see central_cfn.yaml
+HANDLER_ENVIRONMENT = {
+    'QUEST_ID': 'benchmark',
+    'QUEST_API_BASE': 'https://localhost',
+    'QUEST_API_TOKEN': 'benchmark',
+    'GAMEDAY_REGION': 'us-east-1',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'ASSETS_BUCKET': 'benchmark',
+    'ASSETS_BUCKET_PREFIX': 'benchmark/',
+    'QUEST_TEAM_STATUS_TABLE': 'benchmark',
+    'CHAOS_TIMER_MINUTES': '10',
+    'CHECK_TEAM_LAMBDA': 'benchmark',
+    'INIT_LAMBDA': 'benchmark',
+    'UPDATE_LAMBDA': 'benchmark',
+    'EVENT_RULE_CRON': 'benchmark'
+}
+
+# Runs in the child process: import the handler module and report the import time and the peak RSS
+CHILD_SCRIPT = """
+import importlib, json, resource, sys, time
+sys.path.insert(0, sys.argv[1])
+start = time.perf_counter()
+importlib.import_module(sys.argv[2])
+import_ms = (time.perf_counter() - start) * 1000
+peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({'import_ms': import_ms, 'peak_rss_mb': peak_rss_mb}))
+"""
+
+
+def measure_handler(source_dir, handler, runs):
+    environment = dict(os.environ, **HANDLER_ENVIRONMENT)
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD_SCRIPT, source_dir, handler],
+            env=environment, check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        'import_ms': round(statistics.median(sample['import_ms'] for sample in samples), 1),
+        'peak_rss_mb': round(max(sample['peak_rss_mb'] for sample in samples), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the cold start of the central Lambda handlers')
+    parser.add_argument('--source-dir', default=DEFAULT_SOURCE_DIR)
+    parser.add_argument('--budget', default=DEFAULT_BUDGET_FILE)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help='Write the measurements to this JSON file')
+    parser.add_argument('--update-budget', action='store_true',
+                        help='Rewrite the budget file from the measurements plus BUDGET_MARGIN')
+    args = parser.parse_args()
+
+    with open(args.budget) as budget_file:
+        budget = json.load(budget_file)
+
+    results = {}
+    over_budget = []
+    print(f"{'handler':<20} {'import_ms':>10} {'budget':>8} {'peak_rss_mb':>12} {'budget':>8}")
+    for handler in HANDLERS:
+        if not os.path.exists(os.path.join(args.source_dir, f"{handler}.py")):
+            print(f"{handler:<20} not in {args.source_dir}, skipped")
+            continue
+        results[handler] = measure_handler(args.source_dir, handler, args.runs)
+        if args.update_budget:
+            budget[handler] = {metric: math.ceil(value * (1 + BUDGET_MARGIN[metric])) for metric, value in results[handler].items()}
+        handler_budget = budget[handler]
+        print(f"{handler:<20} {results[handler]['import_ms']:>10} {handler_budget['import_ms']:>8} " +
+              f"{results[handler]['peak_rss_mb']:>12} {handler_budget['peak_rss_mb']:>8}")
+        for metric in ('import_ms', 'peak_rss_mb'):
+            if results[handler][metric] > handler_budget[metric]:
+                over_budget.append(f"{handler} {metric}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.update_budget:
+        with open(args.budget, 'w') as budget_file:
+            budget_file.write('{\n' + ',\n'.join(f'  "{handler}": {json.dumps(budget[handler])}' for handler in budget) + '\n}\n')
+
+    if over_budget:
+        print(f"Over budget: {over_budget}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
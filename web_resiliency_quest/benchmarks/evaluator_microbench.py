@@ -0,0 +1,270 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Micro-benchmarks of the Task 5 and Task 6 evaluators of check_team_lambda against large team accounts.
+# evaluate_cloudfront_waf and evaluate_cloudwatch_alarm run in-process on in-memory clients answering synthetic
+# responses: 1,000 IP sets holding 10,000 addresses, and 5,000 alarms, half of them metric math alarms. Each case is
+# the worst case of its evaluator, where every resource is read and matched. Needs the packages of
+# central_lambda_source/requirements.txt, the Quests API client is the one of quests_api_stand_in.py.
+#
+#    python3 benchmarks/evaluator_microbench.py [--runs 20] [--output results.json] [--update-baseline]
+#
+# The time (fastest of --runs evaluations, the least disturbed by the rest of the machine) and the peak memory allocated
+# during an evaluation (traced with tracemalloc in a separate run, as tracing slows the evaluation down) are reported
+# against evaluator_baseline.json. The speed of a machine varies from one run to the next (CPU frequency scaling, other
+# tenants of the host) by more than the regressions looked for, so every evaluation is timed between two runs of a fixed
+# pure Python reference workload. The time compared to the baseline is relative_time, the median over the --runs
+# evaluations of the evaluation time divided by the mean of the reference runs around it. The script exits non-zero
+# when a case's relative_time is above its baseline by more than --time-tolerance, or the case allocates more than
+# --alloc-tolerance above it.
+# The baseline times still depend on the machine they were recorded on: record them again with --update-baseline on
+# the machine running the comparison, and after an intended change.
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+QUEST_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(QUEST_ROOT_DIR, 'central_lambda_source'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cold_start import HANDLER_ENVIRONMENT
+import quests_api_stand_in
+
+DEFAULT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'evaluator_baseline.json')
+
+# Differences below these are measurement noise rather than regressions, whatever the tolerance
+NOISE_FLOOR = {'relative_time': 0.1, 'alloc_peak_kb': 16}
+# Size of the reference workload, in the order of the work of an evaluation
+REFERENCE_ITEM_COUNT = 20000
+
+TEAM_ID = 'benchmark-team'
+DISTRIBUTION_ID = 'EBENCHMARK0001'
+TASK5_ADDRESS = '52.23.186.156/32'
+TASK5_WEB_ACL_NAME = 'waf-web-acl'
+
+
+# WAFv2 client of a team account holding ip_set_count IP sets of addresses_per_set addresses each, and the quest's
+# web ACL, whose rules reference every IP set. With address_in_last_set, the last IP set holds the Task 5 address
+class WafClient:
+
+    def __init__(self, ip_set_count, addresses_per_set, address_in_last_set):
+        self.ip_sets = []
+        for index in range(ip_set_count):
+            addresses = [f"10.{index // 250}.{index % 250}.{address}/32" for address in range(addresses_per_set)]
+            if address_in_last_set and index == ip_set_count - 1:
+                addresses[-1] = TASK5_ADDRESS
+            self.ip_sets.append({
+                'Name': f"ip-set-{index}", 'Id': f"ip-set-id-{index}", 'LockToken': f"token-{index}",
+                'ARN': f"arn:aws:wafv2:us-east-1:123456789012:global/ipset/ip-set-{index}/ip-set-id-{index}",
+                'Addresses': addresses
+            })
+        # One rule per 10 IP sets, each an OrStatement of IP set references, the last rule rate-based
+        rules = []
+        for start in range(0, ip_set_count, 10):
+            statement = {'OrStatement': {'Statements': [
+                {'IPSetReferenceStatement': {'ARN': ip_set['ARN']}} for ip_set in self.ip_sets[start:start + 10]
+            ]}}
+            rules.append({'Name': f"rule-{start}", 'Statement': statement})
+        rules[-1]['Statement'] = {'RateBasedStatement': {'Limit': 100, 'ScopeDownStatement': rules[-1]['Statement']}}
+        self.web_acl = {
+            'Name': TASK5_WEB_ACL_NAME, 'Id': 'web-acl-id', 'LockToken': 'token-acl',
+            'ARN': f"arn:aws:wafv2:us-east-1:123456789012:global/webacl/{TASK5_WEB_ACL_NAME}/web-acl-id",
+            'Rules': rules
+        }
+        self.ip_sets_by_id = {ip_set['Id']: ip_set for ip_set in self.ip_sets}
+
+    def list_ip_sets(self, Scope, Limit, NextMarker='0'):
+        return _page(self.ip_sets, 'IPSets', Limit, NextMarker)
+
+    def list_web_acls(self, Scope, Limit, NextMarker='0'):
+        return _page([self.web_acl], 'WebACLs', Limit, NextMarker)
+
+    def get_web_acl(self, Name, Scope, Id):
+        return {'WebACL': self.web_acl, 'LockToken': self.web_acl['LockToken']}
+
+    def get_ip_set(self, Id, Scope, Name):
+        ip_set = self.ip_sets_by_id[Id]
+        return {'IPSet': ip_set, 'LockToken': ip_set['LockToken']}
+
+
+def _page(items, items_key, limit, next_marker):
+    start = int(next_marker)
+    page = [{key: item[key] for key in ('Name', 'Id', 'ARN', 'LockToken')} for item in items[start:start + limit]]
+    return {items_key: page, 'NextMarker': str(start + limit)}
+
+
+# CloudWatch client of a team account holding alarm_count alarms on other metrics and distributions, every other one a
+# metric math alarm of 3 metrics. With alarm_is_last, the last alarm is a metric math alarm on the distribution's
+# Requests metric, which describe_alarms_for_metric doesn't return
+class CloudWatchClient:
+
+    def __init__(self, alarm_count, alarm_is_last):
+        self.alarms = []
+        for index in range(alarm_count):
+            dimensions = [{'Name': 'DistributionId', 'Value': f"EOTHER{index:08d}"}, {'Name': 'Region', 'Value': 'Global'}]
+            if index % 2:
+                self.alarms.append({'AlarmName': f"alarm-{index}", 'Metrics': [
+                    {'Id': f"m{metric}", 'MetricStat': {'Metric': {
+                        'Namespace': 'AWS/CloudFront', 'MetricName': 'Requests', 'Dimensions': dimensions
+                    }}} for metric in range(3)
+                ] + [{'Id': 'total', 'Expression': 'm0+m1+m2'}]})
+            else:
+                self.alarms.append({'AlarmName': f"alarm-{index}", 'Namespace': 'AWS/CloudFront',
+                                    'MetricName': '4xxErrorRate', 'Dimensions': dimensions})
+        if alarm_is_last:
+            self.alarms[-1]['Metrics'][0]['MetricStat']['Metric']['Dimensions'] = [
+                {'Name': 'Region', 'Value': 'Global'}, {'Name': 'DistributionId', 'Value': DISTRIBUTION_ID}
+            ]
+
+    def describe_alarms_for_metric(self, Namespace, MetricName, Dimensions):
+        return {'MetricAlarms': []}
+
+    def get_paginator(self, operation_name):
+        return self
+
+    def paginate(self, AlarmTypes, PaginationConfig):
+        page_size = PaginationConfig['PageSize']
+        for start in range(0, len(self.alarms), page_size):
+            yield {'MetricAlarms': self.alarms[start:start + page_size]}
+
+
+# Distribution snapshot whose config has the quest's web ACL attached
+class Distribution:
+
+    def __init__(self, web_acl_id):
+        self.config = {'WebACLId': web_acl_id}
+
+    def get_config(self):
+        return self.config
+
+    def get_etag(self):
+        return 'ETAG1'
+
+    def get_last_modified_time(self):
+        return datetime.datetime(2022, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class QuestsApiClient:
+
+    def post_score_event(self, **kwargs):
+        pass
+
+
+# Each case: (evaluator name, team account clients, task flag completed by the evaluation, or None)
+def build_cases():
+    waf_miss = WafClient(1000, 10, address_in_last_set=False)
+    waf_match = WafClient(1000, 10, address_in_last_set=True)
+    return {
+        'waf_1k_ip_sets_no_match': ('evaluate_cloudfront_waf', {'wafv2': waf_miss}, None),
+        'waf_1k_ip_sets_match_last': ('evaluate_cloudfront_waf', {'wafv2': waf_match}, 'is-cloudfront-waf-attached'),
+        'alarm_5k_alarms_no_match': ('evaluate_cloudwatch_alarm', {'cloudwatch': CloudWatchClient(5000, False)}, None),
+        'alarm_5k_alarms_match_last': ('evaluate_cloudwatch_alarm', {'cloudwatch': CloudWatchClient(5000, True)},
+                                       'is-cloudwatch-alarm-created')
+    }
+
+
+def new_team_data():
+    import dynamodb_utils
+    team_data = {'team-id': TEAM_ID, 'cloudfront-distribution-id': DISTRIBUTION_ID}
+    team_data.update({flag: False for flag in dynamodb_utils.TASK_FLAGS})
+    return team_data
+
+
+def evaluate(check_team_lambda, evaluator_name, clients, completed_flag):
+    distribution = Distribution(clients['wafv2'].web_acl['ARN'] if 'wafv2' in clients else '')
+    team_data = getattr(check_team_lambda, evaluator_name)(QuestsApiClient(), new_team_data(), distribution)
+    if completed_flag is not None and not team_data[completed_flag]:
+        raise RuntimeError(f"{evaluator_name} did not complete {completed_flag}")
+    if completed_flag is None and any(team_data[flag] for flag in ('is-cloudfront-waf-attached', 'is-cloudwatch-alarm-created')):
+        raise RuntimeError(f"{evaluator_name} completed a task it should not have")
+
+
+# Dictionary lookups and comparisons over a list of dictionaries, like the evaluators do with the responses
+def time_reference_workload(items):
+    start = time.perf_counter()
+    sum(1 for item in items if item.get('Namespace') == 'AWS/CloudFront' and item.get('MetricName') == 'Requests')
+    return (time.perf_counter() - start) * 1000
+
+
+def measure_case(check_team_lambda, case, runs, reference_items):
+    evaluate(check_team_lambda, *case)
+    times = []
+    reference_times = [time_reference_workload(reference_items)]
+    for _ in range(runs):
+        start = time.perf_counter()
+        evaluate(check_team_lambda, *case)
+        times.append((time.perf_counter() - start) * 1000)
+        reference_times.append(time_reference_workload(reference_items))
+    relative_times = [evaluation_time / ((reference_times[run] + reference_times[run + 1]) / 2)
+                      for run, evaluation_time in enumerate(times)]
+
+    tracemalloc.start()
+    evaluate(check_team_lambda, *case)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'time_ms': round(min(times), 2), 'relative_time': round(statistics.median(relative_times), 3),
+            'alloc_peak_kb': round(peak_bytes / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the Task 5 and Task 6 evaluators')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--time-tolerance', type=float, default=0.25,
+                        help='Allowed increase of relative_time against the baseline, as a fraction')
+    parser.add_argument('--alloc-tolerance', type=float, default=0.2,
+                        help='Allowed increase of the peak allocation against the baseline, as a fraction')
+    parser.add_argument('--output', help='Write the measurements to this JSON file')
+    parser.add_argument('--update-baseline', action='store_true', help='Write the measurements to the baseline file')
+    args = parser.parse_args()
+
+    os.environ.update(HANDLER_ENVIRONMENT)
+    quests_api_stand_in.install()
+    import session_utils
+    import check_team_lambda
+
+    cases = build_cases()
+    reference_items = [{'Namespace': 'AWS/CloudFront', 'MetricName': f"Metric{index % 7}"}
+                       for index in range(REFERENCE_ITEM_COUNT)]
+    session_utils.get_team_client = lambda quests_api_client, team_id, service_name: current_clients[service_name]
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    regressions = []
+    print(f"{'case':<28} {'time_ms':>9} {'relative_time':>14} {'baseline':>9} {'alloc_peak_kb':>14} {'baseline':>9}")
+    for name, case in cases.items():
+        current_clients = case[1]
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            results[name] = measure_case(check_team_lambda, case, args.runs, reference_items)
+        case_baseline = baseline.get(name, {})
+        print(f"{name:<28} {results[name]['time_ms']:>9} {results[name]['relative_time']:>14} " +
+              f"{case_baseline.get('relative_time', '-'):>9} " +
+              f"{results[name]['alloc_peak_kb']:>14} {case_baseline.get('alloc_peak_kb', '-'):>9}")
+        for metric, tolerance in (('relative_time', args.time_tolerance), ('alloc_peak_kb', args.alloc_tolerance)):
+            if metric in case_baseline and \
+                    results[name][metric] > case_baseline[metric] + max(case_baseline[metric] * tolerance, NOISE_FLOOR[metric]):
+                regressions.append(f"{name} {metric}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            baseline_file.write('{\n' + ',\n'.join(f'  "{name}": {json.dumps(result)}' for name, result in results.items()) + '\n}\n')
+
+    if regressions:
+        print(f"Regressions against the baseline: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
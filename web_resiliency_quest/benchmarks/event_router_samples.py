@@ -0,0 +1,107 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Routing check of the recorded events of sample_events/: every event goes through event_router_lambda.lambda_handler
+# against a moto QuestTeamStatusTable holding the team of the event's account and another team, with check_team
+# replaced by a recorder. Checks which evaluators each event selects and which team it is mapped to. Exits non-zero on
+# a mismatch, or when a sample has no expectation below. Needs moto on top of central_lambda_source/requirements.txt.
+#
+#    python3 benchmarks/event_router_samples.py
+import contextlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import check_pipeline_scale
+from check_pipeline_scale import QUEST_ID, TABLE_NAME
+import boto3
+from moto import mock_aws
+import quests_api_stand_in
+
+SAMPLE_EVENTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_events')
+SAMPLE_TEAM_ID = 'sample-team'
+SAMPLE_ACCOUNT_ID = '123456789012'
+OTHER_TEAM_ID = 'other-team'
+OTHER_ACCOUNT_ID = '210987654321'
+
+# Evaluators of check_team_lambda each sample must be routed to, None for the samples ignored by the router
+EXPECTED_EVALUATORS = {
+    'create_ip_set.json': ['evaluate_cloudfront_waf'],
+    'put_metric_alarm.json': ['evaluate_cloudwatch_alarm'],
+    'update_distribution.json': ['attach_cloudfront_origin', 'evaluate_cloudfront_logging', 'evaluate_cloudfront_waf'],
+    'update_distribution_failed.json': None,
+    'update_web_acl.json': ['evaluate_cloudfront_waf']
+}
+
+
+def check(failures, condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}", file=sys.__stdout__)
+    if not condition:
+        failures.append(message)
+
+
+# Runs the event through the handler, :returns: the (team ID, evaluator names) of the checks it made
+def route(event_router_lambda, event):
+    routed = []
+    event_router_lambda.check_team_lambda.check_team = lambda quests_api_client, team, table, evaluators: \
+        routed.append((team['team-id'], [evaluator.__name__ for evaluator in evaluators]))
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        event_router_lambda.lambda_handler(event, None)
+    return routed
+
+
+def main():
+    quests_api = quests_api_stand_in.QuestsApiStandIn(None, latency_ms=0)
+    quests_api_stand_in.install()
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'QUEST_ID': QUEST_ID,
+        'QUEST_API_BASE': quests_api.start(),
+        'QUEST_API_TOKEN': 'benchmark',
+        'GAMEDAY_REGION': 'us-east-1',
+        'ASSETS_BUCKET': 'benchmark',
+        'ASSETS_BUCKET_PREFIX': 'benchmark/',
+        'QUEST_TEAM_STATUS_TABLE': TABLE_NAME,
+        'CHAOS_TIMER_MINUTES': '10'
+    })
+
+    failures = []
+    with mock_aws():
+        import event_router_lambda
+
+        check_pipeline_scale.create_table()
+        table = boto3.resource('dynamodb').Table(TABLE_NAME)
+        for team_id, account_id in ((SAMPLE_TEAM_ID, SAMPLE_ACCOUNT_ID), (OTHER_TEAM_ID, OTHER_ACCOUNT_ID)):
+            table.put_item(Item={'team-id': team_id, 'aws-account-id': account_id, 'quest-completed': False})
+            quests_api.add_team(team_id, int(time.time()))
+
+        sample_names = sorted(name for name in os.listdir(SAMPLE_EVENTS_DIR) if name.endswith('.json'))
+        for name in sample_names:
+            check(failures, name in EXPECTED_EVALUATORS, f"{name}: has an expectation")
+            with open(os.path.join(SAMPLE_EVENTS_DIR, name)) as sample_file:
+                event = json.load(sample_file)
+            expected = EXPECTED_EVALUATORS.get(name)
+            selected = [evaluator.__name__ for evaluator in event_router_lambda.get_event_evaluators(event)]
+            if expected is not None:
+                check(failures, selected == expected, f"{name}: selects {selected}")
+            routed = route(event_router_lambda, event)
+            expected_routes = [(SAMPLE_TEAM_ID, expected)] if expected is not None else []
+            check(failures, routed == expected_routes, f"{name}: routed to {routed}")
+
+            # The same event from another team's account is routed to that team, and from an unknown account nowhere
+            for account_id, team_id in ((OTHER_ACCOUNT_ID, OTHER_TEAM_ID), ('999999999999', None)):
+                routed = route(event_router_lambda, dict(event, account=account_id))
+                expected_routes = [(team_id, expected)] if expected is not None and team_id is not None else []
+                check(failures, routed == expected_routes, f"{name} from account {account_id}: routed to {routed}")
+    quests_api.stop()
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Measures the per-team latency of init_lambda with the dashboard writes published one after another (the previous
+# behaviour, --concurrency 1) and concurrently by central_lambda_source/dashboard_utils.py.
+#
+#    python3 benchmarks/init_publish.py [--teams 50] [--latency-ms 150] [--failure-rate 0.02] [--concurrency 8]
+#
+# Latency model: every Quests API or AWS call takes a log-normally distributed time with the given median, and the
+# given fraction of the dashboard writes fails once before succeeding. The calls init_lambda makes around publishing stay
+# sequential in both runs: the DynamoDB get_item of the team, get_quest_for_team for the team stack outputs and the
+# put_item creating the team before, the update_item of the dashboard state after. Team stacks deployed before the
+# template output the AWS account ID and CloudFront domain name also need the Ops role, sts and get_distribution,
+# which isn't modelled.
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'central_lambda_source'))
+for name in ('QUEST_ID', 'ASSETS_BUCKET', 'ASSETS_BUCKET_PREFIX'):
+    os.environ.setdefault(name, 'benchmark')
+import dashboard_utils
+
+SEQUENTIAL_CALLS_BEFORE_PUBLISH = 3
+SEQUENTIAL_CALLS_AFTER_PUBLISH = 1
+# Welcome outputs and Tasks 1-6: 8 outputs, 2 inputs, 6 hints
+DASHBOARD_WRITES = [('post_output', 8), ('post_input', 2), ('post_hint', 6)]
+
+
+class SimulatedQuestsApiClient:
+
+    def __init__(self, rng, latency_ms, failure_rate):
+        self.rng = rng
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.failed_keys = set()
+        self.lock = threading.Lock()
+
+    def call(self, key=None):
+        with self.lock:
+            latency = self.latency_ms * self.rng.lognormvariate(0, 0.4) / 1000
+            fail = key is not None and key not in self.failed_keys and self.rng.random() < self.failure_rate
+            if fail:
+                self.failed_keys.add(key)
+        time.sleep(latency)
+        if fail:
+            raise ConnectionError(f"Simulated failure of {key}")
+
+    def __getattr__(self, name):
+        if name.startswith('post_'):
+            return lambda **kwargs: self.call(kwargs.get('key', kwargs.get('hint_key')))
+        raise AttributeError(name)
+
+
+def init_team(rng, args, concurrency):
+    client = SimulatedQuestsApiClient(rng, args.latency_ms, args.failure_rate)
+    start = time.time()
+    for _ in range(SEQUENTIAL_CALLS_BEFORE_PUBLISH):
+        client.call()
+    dashboard = dashboard_utils.DashboardPublisher(client, max_workers=concurrency)
+    for method, count in DASHBOARD_WRITES:
+        for index in range(count):
+            if method == 'post_hint':
+                getattr(dashboard, method)(team_id='t', hint_key=f"{method}-{index}")
+            else:
+                getattr(dashboard, method)(team_id='t', key=f"{method}-{index}")
+    errors = dashboard.publish()
+    for _ in range(SEQUENTIAL_CALLS_AFTER_PUBLISH):
+        client.call()
+    return (time.time() - start) * 1000, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sequential and concurrent init_lambda dashboard publishing')
+    parser.add_argument('--teams', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=150)
+    parser.add_argument('--failure-rate', type=float, default=0.02)
+    parser.add_argument('--concurrency', type=int, default=dashboard_utils.PUBLISH_CONCURRENCY)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'':<12} {'p50_ms':>8} {'p95_ms':>8} {'max_ms':>8} {'failed':>7}")
+    for name, concurrency in (('sequential', 1), ('concurrent', args.concurrency)):
+        rng = random.Random(args.seed)
+        results = [init_team(rng, args, concurrency) for _ in range(args.teams)]
+        latencies = sorted(latency for latency, _ in results)
+        print(f"{name:<12} {int(statistics.median(latencies)):>8} {int(latencies[int(len(latencies) * 0.95)]):>8} " +
+              f"{int(latencies[-1]):>8} {sum(failed for _, failed in results):>7}")
+
+
+if __name__ == '__main__':
+    main()
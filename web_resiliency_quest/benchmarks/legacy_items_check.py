@@ -0,0 +1,131 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Upgrade check of the team items created before the current central Lambdas: items in the format the original
+# init_lambda wrote (one boolean per task, no completed-tasks set, schedule, dashboard state, AWS account ID nor
+# CloudFront domain name) go through cron_lambda and check_team_lambda, on the same stand-ins as
+# check_pipeline_scale.py. Exits non-zero if a check fails or an item isn't upgraded. Needs moto on top of
+# central_lambda_source/requirements.txt.
+#
+#    python3 benchmarks/legacy_items_check.py
+import contextlib
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import check_pipeline_scale
+from check_pipeline_scale import QUEST_ID, TABLE_NAME
+import boto3
+from moto import mock_aws
+import aws_stand_in
+import quests_api_stand_in
+
+# Task flags completed by each legacy team, stored as booleans like the original init_lambda and check_team_lambda did
+LEGACY_TEAMS = {
+    'legacy-new': [],
+    'legacy-working': ['is-identified-origin', 'is-attach-cloudfront-origin-done'],
+    # Its first check finds Task 6 done, after which it only waits for the team's Task 4 answer
+    'legacy-last-aws-task': ['is-identified-origin', 'is-attach-cloudfront-origin-done', 'is-cloudfront-logs-enabled',
+                             'is-cloudfront-ip-set-created', 'is-cloudfront-waf-attached'],
+    'legacy-completed': ['is-identified-origin', 'is-attach-cloudfront-origin-done', 'is-cloudfront-logs-enabled',
+                         'is-answer-to-ip-address-correct', 'is-cloudfront-ip-set-created', 'is-cloudfront-waf-attached',
+                         'is-cloudwatch-alarm-created']
+}
+LEGACY_TASK_FLAGS = LEGACY_TEAMS['legacy-completed']
+
+
+# The item the original init_lambda created for the team, with the tasks completed since
+def legacy_item(team_id, account, completed_flags):
+    item = {
+        'team-id': team_id,
+        'quest-start-time': int(time.time()) - 1800,
+        'cloudfront-distribution-id': account.distribution_id,
+        'elb-dns-name': account.elb_dns_name,
+        'waf_acl_id': 'ERROR',
+        'quest-completed': len(completed_flags) == len(LEGACY_TASK_FLAGS),
+        'version': len(completed_flags)
+    }
+    item.update({flag: flag in completed_flags for flag in LEGACY_TASK_FLAGS})
+    return item
+
+
+def check(failures, condition, message):
+    print(f"{'ok  ' if condition else 'FAIL'} {message}", file=sys.__stdout__)
+    if not condition:
+        failures.append(message)
+
+
+def main():
+    aws = aws_stand_in.AwsStandIn(latency_ms=0, dynamodb_latency_ms=0)
+    quests_api = quests_api_stand_in.QuestsApiStandIn(aws, latency_ms=0)
+    quests_api_stand_in.install()
+    os.environ.update({
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'QUEST_ID': QUEST_ID,
+        'QUEST_API_BASE': quests_api.start(),
+        'QUEST_API_TOKEN': 'benchmark',
+        'GAMEDAY_REGION': 'us-east-1',
+        'ASSETS_BUCKET': 'benchmark',
+        'ASSETS_BUCKET_PREFIX': 'benchmark/',
+        'QUEST_TEAM_STATUS_TABLE': TABLE_NAME,
+        'CHAOS_TIMER_MINUTES': '10',
+        'CHECK_TEAM_LAMBDA': 'benchmark',
+        'CHECK_DISPATCH_MODE': 'TEAM'
+    })
+
+    failures = []
+    with mock_aws():
+        aws.install()
+        import client_utils
+        import check_team_lambda
+        import cron_lambda
+        import event_router_lambda
+
+        check_pipeline_scale.create_table()
+        table = boto3.resource('dynamodb').Table(TABLE_NAME)
+        accounts = {}
+        for team_id, completed_flags in LEGACY_TEAMS.items():
+            accounts[team_id] = aws.add_account(team_id)
+            # The completed team and the one left with Task 4 already did everything in their account
+            for _ in range(aws_stand_in.AWS_STEPS if team_id in ('legacy-last-aws-task', 'legacy-completed') else 0):
+                accounts[team_id].advance()
+            quests_api.add_team(team_id, int(time.time()) - 1800)
+            table.put_item(Item=legacy_item(team_id, accounts[team_id], completed_flags))
+
+        client_utils.get_table = client_utils.get_thread_table
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            lambda_stand_in = check_pipeline_scale.LambdaStandIn(executor, check_team_lambda.lambda_handler)
+            client_utils.clients['lambda'] = lambda_stand_in
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                cron_lambda.lambda_handler({}, None)
+                invocations = len(lambda_stand_in.futures)
+                failed = lambda_stand_in.wait()
+        check(failures, failed == 0, f"first cron cycle: {invocations} checks, {failed} failed")
+
+        for team_id, account in accounts.items():
+            item = table.get_item(Key={'team-id': team_id})['Item']
+            check(failures, item.get('aws-account-id') == account.account_id, f"{team_id}: AWS account ID backfilled")
+            check(failures, item.get('cloudfront-domain-name') == f"{account.distribution_id.lower()}.cloudfront.net",
+                  f"{team_id}: CloudFront domain name backfilled")
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                mapped_team_id = event_router_lambda.get_team_id_for_account(account.account_id)
+            check(failures, mapped_team_id == team_id, f"{team_id}: mapped from its AWS account by event_router_lambda")
+            # Teams left with inputs only, or done, are out of the pending checks index
+            if team_id in ('legacy-last-aws-task', 'legacy-completed'):
+                check(failures, 'pending-quest-id' not in item, f"{team_id}: out of the pending checks index")
+        last_aws_task_item = table.get_item(Key={'team-id': 'legacy-last-aws-task'})['Item']
+        check(failures, last_aws_task_item.get('completed-tasks') == {'is-cloudwatch-alarm-created'},
+              "legacy-last-aws-task: Task 6 added to the completed tasks set")
+        aws.uninstall()
+    quests_api.stop()
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Measures the latency of handler invocations calling a local stand-in of the Quests API, with a connection opened per
+# call (the requests module functions the QDK uses) and with the keep-alive PooledTransport of
+# central_lambda_source/quests_api_utils.py. Needs the packages of central_lambda_source/requirements.txt.
+#
+#    python3 benchmarks/quests_api_keepalive.py [--invocations 200] [--calls 4] [--latency-ms 20] [--handshake-ms 60]
+#
+# Latency model: the stand-in answers every call after --latency-ms, and waits --handshake-ms before reading the first
+# call of a new connection, the cost of the TCP and TLS handshakes with the real Quests API. It closes connections
+# idle for --server-idle-seconds; the last run pauses longer than that between invocations, so that every pooled
+# connection has gone stale and must be replaced.
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'central_lambda_source'))
+import quests_api_utils
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connection.settimeout(self.server.idle_seconds)
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.handshake_seconds)
+
+    def do_GET(self):
+        self.respond({'status': 'IN_PROGRESS'})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond({})
+
+    def respond(self, body):
+        time.sleep(self.server.latency_seconds)
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+# The calls of a check_team invocation: the event status and a few dashboard writes
+def invoke(http, base_url, calls):
+    start = time.time()
+    http.get(f"{base_url}/event-status", timeout=5).raise_for_status()
+    for index in range(calls - 1):
+        http.post(f"{base_url}/output", json={'key': f"output-{index}"}, timeout=5).raise_for_status()
+    return (time.time() - start) * 1000
+
+
+def run(server, http, args, pause_seconds=0):
+    with server.lock:
+        server.connections = 0
+    latencies = []
+    for _ in range(args.invocations):
+        latencies.append(invoke(http, f"http://127.0.0.1:{server.server_port}", args.calls))
+        time.sleep(pause_seconds)
+    latencies.sort()
+    return latencies, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-call and keep-alive connections to the Quests API')
+    parser.add_argument('--invocations', type=int, default=200)
+    parser.add_argument('--calls', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--handshake-ms', type=float, default=60)
+    parser.add_argument('--server-idle-seconds', type=float, default=0.5)
+    parser.add_argument('--stale-invocations', type=int, default=10)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.latency_seconds = args.latency_ms / 1000
+    server.handshake_seconds = args.handshake_ms / 1000
+    server.idle_seconds = args.server_idle_seconds
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    transport = quests_api_utils.PooledTransport()
+    stale_args = argparse.Namespace(**dict(vars(args), invocations=args.stale_invocations))
+    runs = [
+        ('per-call', run(server, requests, args)),
+        ('pooled', run(server, transport, args)),
+        ('pooled-stale', run(server, transport, stale_args, pause_seconds=args.server_idle_seconds * 2))
+    ]
+    server.shutdown()
+
+    print(f"{'':<14} {'p50_ms':>8} {'p95_ms':>8} {'max_ms':>8} {'connections':>12}")
+    for name, (latencies, connections) in runs:
+        print(f"{name:<14} {int(statistics.median(latencies)):>8} {int(latencies[int(len(latencies) * 0.95)]):>8} " +
+              f"{int(latencies[-1]):>8} {connections:>12}")
+    print(f"Pooled transport: {transport.get_stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Stand-in of the GameDay Quests API for the benchmarks: a local HTTP/1.1 server answering after a configurable latency,
+# and a GameDayQuestsApiClient calling it the way the QDK does, through the requests module functions. install()
+# registers this module as aws_gameday_quests.gdQuestsApi, so the handlers import the stand-in client, and
+# quests_api_utils puts its pooled transport in place of this module's requests.
+import json
+import random
+import sys
+import threading
+import time
+import types
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import boto3
+import requests
+
+
+class QuestsApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        self.respond(url.path.strip('/'), {key: values[0] for key, values in parse_qs(url.query).items()})
+
+    def do_POST(self):
+        self.respond(self.path.strip('/'), self.read_body())
+
+    def do_DELETE(self):
+        self.respond(self.path.strip('/'), self.read_body())
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def respond(self, method, arguments):
+        body = self.server.stand_in.handle(method, arguments)
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+# The Quests API state of the teams, served over HTTP by start()
+class QuestsApiStandIn:
+
+    def __init__(self, aws_stand_in, latency_ms=30, seed=42):
+        self.aws_stand_in = aws_stand_in
+        self.latency_ms = latency_ms
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.teams = {}
+        self.calls = Counter()
+        self.server = None
+
+    def add_team(self, team_id, quest_start_time):
+        self.teams[team_id] = {'team-id': team_id, 'quest-state': 'IN_PROGRESS', 'quest-start-time': quest_start_time}
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), QuestsApiHandler)
+        self.server.daemon_threads = True
+        self.server.stand_in = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def stop(self):
+        self.server.shutdown()
+
+    def handle(self, method, arguments):
+        with self.lock:
+            self.calls[method] += 1
+            latency = self.latency_ms * self.rng.lognormvariate(0, 0.4) / 1000
+        time.sleep(latency)
+        if method == 'get_event_status':
+            return {'status': 'IN_PROGRESS'}
+        if method == 'get_quest_for_team':
+            return self.teams[arguments['team_id']]
+        if method == 'get_teams_for_quest':
+            return list(self.teams.values())
+        if method == 'assume_team_ops_role':
+            return self.aws_stand_in.assume_role(arguments['team_id'])
+        return {}
+
+    def reset_stats(self):
+        with self.lock:
+            calls, self.calls = self.calls, Counter()
+        return calls
+
+
+# Calls the Quests API stand-in. Reads are GET /<method>?<arguments>, writes POST or DELETE /<method> with the
+# arguments as JSON body
+class GameDayQuestsApiClient:
+
+    def __init__(self, api_base, api_token):
+        self.api_base = api_base
+        self.api_token = api_token
+
+    def get_event_status(self):
+        return self._call('GET', 'get_event_status')
+
+    def get_quest_for_team(self, team_id, quest_id):
+        return self._call('GET', 'get_quest_for_team', team_id=team_id, quest_id=quest_id)
+
+    def get_teams_for_quest(self, quest_id):
+        return self._call('GET', 'get_teams_for_quest', quest_id=quest_id)
+
+    def assume_team_ops_role(self, team_id):
+        credentials = self._call('POST', 'assume_team_ops_role', team_id=team_id)
+        return boto3.session.Session(aws_access_key_id=credentials['AccessKeyId'],
+                                     aws_secret_access_key=credentials['SecretAccessKey'],
+                                     aws_session_token=credentials['SessionToken'],
+                                     region_name='us-east-1')
+
+    def __getattr__(self, name):
+        if name.startswith('post_'):
+            return lambda **kwargs: self._call('POST', name, **kwargs)
+        if name.startswith('delete_'):
+            return lambda **kwargs: self._call('DELETE', name, **kwargs)
+        raise AttributeError(name)
+
+    def _call(self, http_method, method, **kwargs):
+        url = f"{self.api_base}/{method}"
+        headers = {'Authorization': self.api_token}
+        if http_method == 'GET':
+            response = requests.get(url, params=kwargs, headers=headers, timeout=10)
+        elif http_method == 'POST':
+            response = requests.post(url, json=kwargs, headers=headers, timeout=10)
+        else:
+            response = requests.delete(url, json=kwargs, headers=headers, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+
+# Makes `from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient` import the stand-in
+def install():
+    package = types.ModuleType('aws_gameday_quests')
+    package.gdQuestsApi = sys.modules[__name__]
+    sys.modules['aws_gameday_quests'] = package
+    sys.modules['aws_gameday_quests.gdQuestsApi'] = sys.modules[__name__]
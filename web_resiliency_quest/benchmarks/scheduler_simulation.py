@@ -0,0 +1,148 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Simulates a GameDay event to compare the fixed 1 minute polling of every team with the adaptive scheduler of
+# central_lambda_source/schedule_utils.py, in number of checks, AWS API calls and task detection delay.
+#
+#    python3 benchmarks/scheduler_simulation.py [--teams 100] [--minutes 120] [--seed 42]
+#
+# The maximum check interval is read from CHECK_MAX_INTERVAL_SECONDS like in the Lambdas, set it to compare the API
+# calls saved with the detection delay they cost.
+#
+# Team behaviour model: every team works through the AWS-verified tasks (2, 3, 5, 6) one after the other, spending an
+# exponentially distributed time on each. While working on a task it changes its config a few times before getting it
+# right, and some teams get stuck and never finish. Input tasks (1 and 4) are answered at random times.
+import argparse
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'central_lambda_source'))
+import quest_const
+import schedule_utils
+
+CRON_PERIOD_SECONDS = 60
+MEAN_TASK_MINUTES = 12
+MAX_ATTEMPTS_PER_TASK = 3
+STUCK_PROBABILITY = 0.15
+
+# Team item flag(s) completed by each AWS-verified task, in the order the teams work through them
+AWS_TASKS = [
+    ['is-attach-cloudfront-origin-done'],
+    ['is-cloudfront-logs-enabled'],
+    ['is-cloudfront-ip-set-created', 'is-cloudfront-waf-attached'],
+    ['is-cloudwatch-alarm-created']
+]
+
+
+# AWS API calls made by one check, see check_team_lambda.check_team: GetItem, the distribution config shared by
+# Tasks 2, 3 and 5, ListIPSets + ListWebACLs for Task 5, DescribeAlarmsForMetric for Task 6, and one write
+def get_check_cost(team_data):
+    pending = [flags for flags in AWS_TASKS if not all(team_data[flag] for flag in flags)]
+    cost = 2
+    if any(flags in pending for flags in AWS_TASKS[:3]):
+        cost += 1
+    if AWS_TASKS[2] in pending:
+        cost += 2
+    if AWS_TASKS[3] in pending:
+        cost += 1
+    return cost
+
+
+def generate_team(rng, duration):
+    team = {'completions': [], 'changes': [], 'inputs': []}
+    now = 0
+    for flags in AWS_TASKS:
+        task_time = rng.expovariate(1 / (MEAN_TASK_MINUTES * 60))
+        attempts = rng.randint(0, MAX_ATTEMPTS_PER_TASK)
+        team['changes'] += sorted(now + rng.uniform(0, task_time) for _ in range(attempts))
+        now += task_time
+        if rng.random() < STUCK_PROBABILITY or now >= duration:
+            break
+        team['completions'].append((now, flags))
+    team['inputs'] = sorted(rng.uniform(0, duration) for _ in quest_const.INPUT_TASK_FLAGS)
+    return team
+
+
+def new_team_data():
+    team_data = {flag: False for flag in quest_const.AWS_TASK_FLAGS + quest_const.INPUT_TASK_FLAGS}
+    team_data.update({'quest-completed': False, 'next-check-at': 0, 'activity-score': schedule_utils.ACTIVITY_SCORE_MAX})
+    return team_data
+
+
+def simulate(teams, duration, adaptive):
+    checks = 0
+    api_calls = 0
+    delays = []
+    states = [{'team_data': new_team_data(), 'last_check': 0, 'inputs_done': 0} for _ in teams]
+    for now in range(0, duration, CRON_PERIOD_SECONDS):
+        # One BatchGetItem per 100 teams to read the schedules
+        if adaptive:
+            api_calls += (len(teams) + 99) // 100
+        for team, state in zip(teams, states):
+            team_data = state['team_data']
+            # update_lambda: inputs answered since the last cron cycle
+            while state['inputs_done'] < len(team['inputs']) and team['inputs'][state['inputs_done']] <= now:
+                team_data[quest_const.INPUT_TASK_FLAGS[state['inputs_done']]] = True
+                if adaptive:
+                    schedule_utils.mark_active(team_data, team['inputs'][state['inputs_done']])
+                state['inputs_done'] += 1
+
+            if adaptive and not schedule_utils.is_check_due(team_data, now):
+                continue
+            if not adaptive and team_data['quest-completed']:
+                continue
+
+            # check_team_lambda
+            checks += 1
+            api_calls += get_check_cost(team_data)
+            original_team_data = dict(team_data)
+            for completed_at, flags in team['completions']:
+                if completed_at <= now and not team_data[flags[0]]:
+                    for flag in flags:
+                        team_data[flag] = True
+                    delays.append(now - completed_at)
+            # A config change moves the change markers of evaluation_utils.is_unchanged
+            if any(state['last_check'] < changed_at <= now for changed_at in team['changes']):
+                team_data['change-marker'] = now
+            if all(team_data[flag] for flag in quest_const.AWS_TASK_FLAGS + quest_const.INPUT_TASK_FLAGS):
+                team_data['quest-completed'] = True
+            state['last_check'] = now
+            if adaptive:
+                schedule_utils.schedule_next_check(team_data, original_team_data, now)
+    return {
+        'checks': checks,
+        'api_calls': api_calls,
+        'detected_tasks': len(delays),
+        'mean_delay_s': round(statistics.mean(delays), 1) if delays else None,
+        'p99_delay_s': round(sorted(delays)[int(len(delays) * 0.99)], 1) if delays else None,
+        'max_delay_s': round(max(delays), 1) if delays else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fixed and adaptive team check scheduling')
+    parser.add_argument('--teams', type=int, default=100)
+    parser.add_argument('--minutes', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    duration = args.minutes * 60
+    teams = [generate_team(rng, duration) for _ in range(args.teams)]
+
+    fixed = simulate(teams, duration, adaptive=False)
+    adaptive = simulate(teams, duration, adaptive=True)
+    print(f"{'':<10} {'checks':>8} {'api_calls':>10} {'tasks':>6} {'mean_delay_s':>13} {'p99_delay_s':>12} {'max_delay_s':>12}")
+    for name, result in (('fixed', fixed), ('adaptive', adaptive)):
+        print(f"{name:<10} {result['checks']:>8} {result['api_calls']:>10} {result['detected_tasks']:>6} " +
+              f"{result['mean_delay_s']:>13} {result['p99_delay_s']:>12} {result['max_delay_s']:>12}")
+    print(f"API calls saved: {fixed['api_calls'] - adaptive['api_calls']} " +
+          f"({round(100 * (1 - adaptive['api_calls'] / fixed['api_calls']), 1)}%)")
+    print(f"Worst-case detection delay bound: {schedule_utils.CHECK_MAX_INTERVAL_SECONDS + CRON_PERIOD_SECONDS} s " +
+          "+ one check duration")
+
+
+if __name__ == '__main__':
+    main()
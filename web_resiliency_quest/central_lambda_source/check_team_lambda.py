@@ -2,18 +2,23 @@
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
 import os
 from datetime import datetime
-import boto3
 import json
+import client_utils
+import cloudfront_utils
+import cloudwatch_utils
+import dashboard_utils
 import dynamodb_utils
+import evaluation_utils
 import quest_const
-import output_const
-import input_const
-import hint_const
+import metrics_utils
+import quests_api_utils
+import schedule_utils
 import scoring_const
-import http.client
+import session_utils
 import time
-import ui_utils
-from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import waf_utils
+import trace_utils
 
 # Standard AWS GameDay Quests Environment Variables
 QUEST_ID = os.environ['QUEST_ID']
@@ -26,19 +31,28 @@ ASSETS_BUCKET_PREFIX = os.environ['ASSETS_BUCKET_PREFIX']
 # Quest Environment Variables
 QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
 CHAOS_TIMER_MINUTES = os.environ['CHAOS_TIMER_MINUTES']
-
-# Dynamo DB setup
-dynamodb = boto3.resource('dynamodb')
-quest_team_status_table = dynamodb.Table(QUEST_TEAM_STATUS_TABLE)
+CHECK_BATCH_CONCURRENCY = int(os.environ.get('CHECK_BATCH_CONCURRENCY', '10'))
+EVALUATOR_CONCURRENCY = int(os.environ.get('EVALUATOR_CONCURRENCY', '4'))
+
+# Points of the AWS-verified tasks, by task flag. They are awarded by the check that persisted the task completed, see
+# award_completed_tasks. Task 5 is awarded once the WebACL is attached
+TASK_SCORES = {
+    'is-attach-cloudfront-origin-done': (scoring_const.TASK2_COMPLETE_DESC, scoring_const.TASK2_COMPLETE_POINTS),
+    'is-cloudfront-logs-enabled': (scoring_const.TASK3_COMPLETE_DESC, scoring_const.TASK3_COMPLETE_POINTS),
+    'is-cloudfront-waf-attached': (scoring_const.TASK5_COMPLETE_DESC, scoring_const.TASK5_COMPLETE_POINTS),
+    'is-cloudwatch-alarm-created': (scoring_const.TASK6_COMPLETE_DESC, scoring_const.TASK6_COMPLETE_POINTS)
+}
 
 # This function is triggered by cron_lambda.py. It performs validation of team actions, such as assuming a role in their
 # AWS account to check resources or trigger chaos events, as well as updating progress, or posting a message to the team’s event UI.
-# Expected event payload is the QuestsAPI entry for this team
+# Expected event payload is the QuestsAPI entry for this team or, in batch dispatch mode, {'teams': [<QuestsAPI entry>, ...]}
+@metrics_utils.account_api_calls('check_team_lambda')
+@trace_utils.trace_invocation('check_team_lambda')
 def lambda_handler(event, context):
     print(f"check_team_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    # The Quest API Client of this container: pooled connections and cached reads, see quests_api_utils.py
+    quests_api_client = quests_api_utils.get_quests_api_client(QUEST_API_BASE, QUEST_API_TOKEN)
 
     # Check if event is running
     event_status = quests_api_client.get_event_status()
@@ -46,11 +60,69 @@ def lambda_handler(event, context):
         print(f"Event Status: {event_status}, aborting CHECK_TEAM_LAMBDA")
         return
 
+    # Batch dispatch mode - evaluate the whole shard of teams within this invocation
+    if 'teams' in event:
+        check_team_batch(event)
+    else:
+        check_start = time.time()
+        check_team(quests_api_client, event, client_utils.get_table(QUEST_TEAM_STATUS_TABLE))
+        report_cycle_time(event, check_start)
+
+    # Warm containers keep cross-account sessions across invocations, the hit rate shows how much STS traffic is saved
+    print(f"Cross-account session cache: {session_utils.get_cache_stats()}")
+    print(f"Quests API cache: {quests_api_utils.get_cache_stats()}")
+    print(f"Quests API connections: {quests_api_utils.get_transport_stats()}")
+
+
+# Batch worker - evaluates a shard of teams concurrently, each team in its own worker thread
+def check_team_batch(event):
+    teams = event['teams']
+    batch_start = time.time()
+    failed_teams = []
+
+    with ThreadPoolExecutor(max_workers=CHECK_BATCH_CONCURRENCY) as executor:
+        futures = {executor.submit(trace_utils.bind(check_team_in_worker), team): team for team in teams}
+        for future in as_completed(futures):
+            team = futures[future]
+            try:
+                future.result()
+            except Exception as err:
+                # One team failing must not prevent the rest of the shard from being evaluated
+                print(f"Error while checking team {team['team-id']}: {err}")
+                failed_teams.append(team['team-id'])
+
+    print(f"Batch check: teams={len(teams)}, failed={failed_teams}, elapsed_ms={int((time.time() - batch_start) * 1000)}")
+    report_cycle_time(event, batch_start)
+
+
+# Runs the check for one team of a batch. Every worker thread gets its own DynamoDB Table resource, over the shared
+# DynamoDB client of the container. The Quests API client is the container's, its connection pool is thread safe
+def check_team_in_worker(team):
+    check_start = time.time()
+    quests_api_client = quests_api_utils.get_quests_api_client(QUEST_API_BASE, QUEST_API_TOKEN)
+    with trace_utils.span('check_team', team_id=team['team-id']):
+        check_team(quests_api_client, team, client_utils.get_thread_table(QUEST_TEAM_STATUS_TABLE))
+    print(f"Checked team {team['team-id']} in {int((time.time() - check_start) * 1000)} ms")
+
+
+# Report the time from the start of the cron cycle that triggered this invocation, and the time spent checking
+def report_cycle_time(event, check_start):
+    now = time.time()
+    cycle_message = f"Check cycle: check_ms={int((now - check_start) * 1000)}"
+    if 'cycle-start-time' in event:
+        cycle_message += f", cycle_ms={int((now - float(event['cycle-start-time'])) * 1000)}"
+    print(cycle_message)
+
+
+# Evaluate all tasks for a single team and persist the outcome. event_router_lambda passes the subset of evaluators
+# affected by the team's API activity instead
+def check_team(quests_api_client, event, quest_team_status_table, evaluators=None):
     dynamodb_response = quest_team_status_table.get_item(Key={'team-id': event['team-id']})
     print(f"Retrieved quest team state for team {event['team-id']}: {json.dumps(dynamodb_response, default=str)}")
 
     # Make a copy of the original array to be able later on to do a comparison and validate whether a DynamoDB update is needed    
-    team_data = dynamodb_response['Item'].copy() # Check init_lambda for the format
+    original_team_data = dynamodb_utils.load_team_data(dynamodb_response['Item']) # Check init_lambda for the format
+    team_data = original_team_data.copy()
 
     # Task 0 to start continuous scoring
     # if is_within_quest_duration(team_data):
@@ -58,28 +130,61 @@ def lambda_handler(event, context):
 
     # Task 1 is check cr4loudfront origin
 
-    # Task 2 evaluation
-    team_data = attach_cloudfront_origin(quests_api_client, team_data)
-    
-    # Task 3 evaluation
-    team_data = evaluate_cloudfront_logging(quests_api_client, team_data)
-
     # Task 4 is Find needle in ocean
 
-    # Task 5 evaluation
-    team_data = evaluate_cloudfront_waf(quests_api_client, team_data)
+    # The CloudFront distribution is fetched once, on first use, and shared by the evaluators of Tasks 2, 3 and 5
+    distribution = cloudfront_utils.DistributionSnapshot(
+        quests_api_client, team_data['team-id'], team_data['cloudfront-distribution-id'])
+
+    # Tasks 2, 3, 5 and 6 only read the team's AWS account and don't depend on each other, so they are evaluated
+    # concurrently. Wall-clock time per team is the one of the slowest evaluator
+    if evaluators is None:
+        evaluators = [
+            attach_cloudfront_origin,       # Task 2
+            evaluate_cloudfront_logging,    # Task 3
+            evaluate_cloudfront_waf,        # Task 5
+            evaluate_cloudwatch_alarm,      # Task 6
+        ]
+    team_data, evaluation_errors = evaluation_utils.run_evaluators(
+        evaluators,
+        quests_api_client,
+        team_data,
+        EVALUATOR_CONCURRENCY,
+        distribution
+    )
+
+    # Back off the team if nothing changed, check it again soon otherwise
+    schedule_utils.schedule_next_check(team_data, original_team_data, time.time())
+    schedule_utils.sync_pending_checks(team_data, QUEST_ID)
+    print(f"Next check of team {team_data['team-id']} at {team_data['next-check-at']} " +
+          f"(activity score {team_data['activity-score']})")
+
+    # Compare initial DynamoDB item with its copy to check whether changes were made. Only the changed attributes are
+    # written, so a concurrent update_lambda or check of the same team is never overwritten
+    if original_team_data==team_data:
+        print("No changes throughout this run - no need to update the DynamoDB item")
+        completed_tasks = set()
+    else:
+        completed_tasks = dynamodb_utils.update_team_data(original_team_data, team_data, quest_team_status_table)
 
-    # Task 6 evaluation
-    team_data = evaluate_cloudwatch_alarm(quests_api_client, team_data)
+    # Award the tasks this run completed first, a concurrent check that found them done as well awards nothing
+    award_errors = award_completed_tasks(quests_api_client, team_data, completed_tasks, quest_team_status_table)
 
     # Complete quest if everything is done
-    team_data = check_and_complete_quest(quests_api_client, QUEST_ID, team_data)
+    team_data, quest_errors = check_and_complete_quest(quests_api_client, QUEST_ID, team_data, quest_team_status_table)
+
+    # Post the final message of the tasks completed throughout this run and remove their hints. This also retries the
+    # dashboard writes that failed in previous runs
+    dashboard_errors = dashboard_utils.sync_dashboard(quests_api_client, team_data, quest_team_status_table)
+
+    # Surface failed evaluators and awards only once the progress of the successful ones has been persisted
+    if award_errors or quest_errors:
+        raise RuntimeError(f"Awards failed for team {team_data['team-id']}: {award_errors + quest_errors}")
+    if evaluation_errors:
+        raise RuntimeError(f"Evaluators failed for team {team_data['team-id']}: {evaluation_errors}")
+    if dashboard_errors:
+        raise RuntimeError(f"Dashboard writes failed for team {team_data['team-id']}: {dashboard_errors}")
 
-    # Compare initial DynamoDB item with its copy to check whether changes were made. 
-    if dynamodb_response['Item']==team_data:
-        print("No changes throughout this run - no need to update the DynamoDB item")
-    else:
-        dynamodb_utils.save_team_data(team_data, quest_team_status_table)
 
 # Task 0 - Welcome (Continuous scoring)
 # def continuous_scoring(quests_api_client, team_data):
@@ -97,24 +202,22 @@ def lambda_handler(event, context):
 #     return team_data
 
 # Task 2 evaluation - CloudFront Distribution Origin
-def attach_cloudfront_origin(quests_api_client, team_data):
+def attach_cloudfront_origin(quests_api_client, team_data, distribution):
     print(f"Evaluating CloudFront Distribution Origin for team {team_data['team-id']}")
 
     # Check whether task was completed already
     if not team_data['is-attach-cloudfront-origin-done']:
 
-        # Establish cross-account session
-        print(f"Assuming Ops role for team {team_data['team-id']}")
-        xa_session = quests_api_client.assume_team_ops_role(team_data['team-id'])
+        # Skip the evaluation if the distribution config didn't change since the last evaluation
+        distribution_etag = distribution.get_etag()
+        if evaluation_utils.is_unchanged(team_data, 'task2-distribution-etag', distribution_etag):
+            return team_data
 
         # Lookup events in CloudFront
-        cloudfront_client = xa_session.client('cloudfront')
-        quest_start = datetime.fromtimestamp(team_data['quest-start-time'])
         # cloudfront_response = cloudfront_client.list_distributions()
         # origin_domain_name = cloudfront_response['DistributionList']['Items'][0]['Origins']['Items'][0]['DomainName']
-        cloudfront_response = cloudfront_client.get_distribution(Id=team_data['cloudfront-distribution-id'])
-        origin_domain_name = cloudfront_response['Distribution']['DistributionConfig']['Origins']['Items'][0]['DomainName']
-        print(f"CloudFront result for team {team_data['team-id']}: {cloudfront_response}")
+        origin_domain_name = distribution.get_config()['Origins']['Items'][0]['DomainName']
+        print(f"CloudFront result for team {team_data['team-id']}: {origin_domain_name}")
 
         # Complete task if CloudFront Origin was attached
         if origin_domain_name == team_data['elb-dns-name'].lower():
@@ -122,61 +225,32 @@ def attach_cloudfront_origin(quests_api_client, team_data):
             # Switch flag
             team_data['is-attach-cloudfront-origin-done'] = True
 
-            # Delete hint
-            quests_api_client.delete_hint(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                hint_key=hint_const.TASK2_HINT1_KEY,
-                detail=True
-            )
+            # The hint is replaced by the task final message by dashboard_utils.sync_dashboard
 
-            # Post task final message
-            # Get CloudFront Distribution url
-            xa_session = quests_api_client.assume_team_ops_role(team_data['team-id'])
-            cloudfront_client = xa_session.client('cloudfront')
-            cloudfront_response = cloudfront_client.get_distribution(Id=team_data['cloudfront-distribution-id'])
-            cfDomainName = cloudfront_response['Distribution']['DomainName']
-
-            image_url_task2 = ui_utils.generate_signed_or_open_url(ASSETS_BUCKET, f"{ASSETS_BUCKET_PREFIX}architecture_task2.png",signed_duration=86400)
-            
-            quests_api_client.post_output(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                key=output_const.TASK2_COMPLETE_KEY,
-                label=output_const.TASK2_COMPLETE_LABEL,
-                value=output_const.TASK2_COMPLETE_VALUE.format(cfDomainName, cfDomainName, image_url_task2), 
-                dashboard_index=output_const.TASK2_COMPLETE_INDEX,
-                markdown=output_const.TASK2_COMPLETE_MARKDOWN,
-            )
-
-            # Award final points
-            quests_api_client.post_score_event(
-                team_id=team_data["team-id"],
-                quest_id=QUEST_ID,
-                description=scoring_const.TASK2_COMPLETE_DESC,
-                points=scoring_const.TASK2_COMPLETE_POINTS
-            )
+            # The points are awarded by award_completed_tasks, once the completion is persisted
+            evaluation_utils.record_detection_latency(
+                team_data, 'task2', distribution.get_last_modified_time, 'LastModifiedTime', time.time())
 
         else:
             print(f"No matching CloudFront events found for team {team_data['team-id']}")
+            team_data['task2-distribution-etag'] = distribution_etag
 
     return team_data
 
 # Task 3 evaluation - CloudFront logs
-def evaluate_cloudfront_logging(quests_api_client, team_data):
+def evaluate_cloudfront_logging(quests_api_client, team_data, distribution):
     print(f"Evaluating CloudFront Logs task for team {team_data['team-id']}")
 
     # Check whether task was completed already
     if not team_data['is-cloudfront-logs-enabled']:
 
-        # Establish cross-account session
-        print(f"Assuming Ops role for team {team_data['team-id']}")
-        xa_session = quests_api_client.assume_team_ops_role(team_data['team-id'])
+        # Skip the evaluation if the distribution config didn't change since the last evaluation
+        distribution_etag = distribution.get_etag()
+        if evaluation_utils.is_unchanged(team_data, 'task3-distribution-etag', distribution_etag):
+            return team_data
 
         # Lookup events in CloudFront
-        cloudfront_client = xa_session.client('cloudfront')
-        cloudfront_response = cloudfront_client.get_distribution(Id=team_data['cloudfront-distribution-id'])
-        logging_flag = cloudfront_response['Distribution']['DistributionConfig']['Logging']['Enabled']
+        logging_flag = distribution.get_config()['Logging']['Enabled']
 
         print(f"CloudFront result for team {team_data['team-id']}: {logging_flag}")
 
@@ -186,37 +260,15 @@ def evaluate_cloudfront_logging(quests_api_client, team_data):
             # Switch flag
             team_data['is-cloudfront-logs-enabled'] = True
 
-            # Delete hint
-            quests_api_client.delete_hint(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                hint_key=hint_const.TASK3_HINT1_KEY,
-                detail=True
-            )
-
-            # Post task final message
-            image_url_task3 = ui_utils.generate_signed_or_open_url(ASSETS_BUCKET, f"{ASSETS_BUCKET_PREFIX}architecture_task3.png",signed_duration=86400)
+            # The hint is replaced by the task final message by dashboard_utils.sync_dashboard
 
-            quests_api_client.post_output(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                key=output_const.TASK3_COMPLETE_KEY,
-                label=output_const.TASK3_COMPLETE_LABEL,
-                value=output_const.TASK3_COMPLETE_VALUE.format(image_url_task3),
-                dashboard_index=output_const.TASK3_COMPLETE_INDEX,
-                markdown=output_const.TASK3_COMPLETE_MARKDOWN,
-            )
-
-            # Award final points
-            quests_api_client.post_score_event(
-                team_id=team_data["team-id"],
-                quest_id=QUEST_ID,
-                description=scoring_const.TASK3_COMPLETE_DESC,
-                points=scoring_const.TASK3_COMPLETE_POINTS
-            )
+            # The points are awarded by award_completed_tasks, once the completion is persisted
+            evaluation_utils.record_detection_latency(
+                team_data, 'task3', distribution.get_last_modified_time, 'LastModifiedTime', time.time())
 
         else:
             print(f"No matching CloudTrail events found for team {team_data['team-id']}")
+            team_data['task3-distribution-etag'] = distribution_etag
 
     return team_data
 
@@ -224,7 +276,7 @@ def evaluate_cloudfront_logging(quests_api_client, team_data):
 # Task 5 - WAF Rule
 # 'is-cloudfront-ip-set-created'
 # 'is-cloudfront-waf-attached'
-def evaluate_cloudfront_waf(quests_api_client, team_data):
+def evaluate_cloudfront_waf(quests_api_client, team_data, distribution):
     print(f"Evaluating CloudFront WAF task for team {team_data['team-id']}")
 
     # Check whether task was completed already
@@ -233,53 +285,42 @@ def evaluate_cloudfront_waf(quests_api_client, team_data):
 
         ip_address_from_task2b = "52.23.186.156" + "/32"
         created_web_acl_name = "waf-web-acl"
-        web_acl_id = ""
         web_acl_arn = ""
         ip_set_id = ""
-        ip_set_arn = ""
         waf_web_acl_flag = False
-        
-
-        # Establish cross-account session
-        print(f"Assuming Ops role for team {team_data['team-id']}")
-        xa_session = quests_api_client.assume_team_ops_role(team_data['team-id'])
-
-        # Lookup events in WAF IP Sets
-        waf_client = xa_session.client('wafv2')
-        waf_ip_set_response = waf_client.list_ip_sets(Scope="CLOUDFRONT")
-        ip_sets = waf_ip_set_response['IPSets']
-        for ip_set in ip_sets:
-            waf_ip_set_response = waf_client.get_ip_set(Id=ip_set['Id'], Scope="CLOUDFRONT", Name=ip_set['Name'])
-            ip_set_addresses = waf_ip_set_response['IPSet']['Addresses']
-            for ip_set_address in ip_set_addresses:
-                if ip_set_address == ip_address_from_task2b:
-                    ip_set_id = ip_set['Id']
-                    ip_set_arn = ip_set['ARN']
-                    break
-        
-        # Lookup events in WAF WebACL
-        waf_web_acls_response = waf_client.list_web_acls(Scope="CLOUDFRONT")
-        web_acls = waf_web_acls_response['WebACLs']
-        for web_acl in web_acls:
-            if web_acl['Name'] == created_web_acl_name:
-                web_acl_id = web_acl['Id']
-                web_acl_arn = web_acl['ARN']
-                break
-
-        waf_web_acl_response = waf_client.get_web_acl(Name=created_web_acl_name, Scope="CLOUDFRONT", Id=web_acl_id)
-        web_acl_rules = waf_web_acl_response['WebACL']['Rules']
-        for rule in web_acl_rules:
-            rule_ip_set = rule['Statement']['IPSetReferenceStatement']
-            if rule_ip_set['ARN'] == ip_set_arn:
+
+        # Lookup events in WAF IP Sets and WebACLs, through the cached cross-account session
+        waf_client = session_utils.get_team_client(quests_api_client, team_data['team-id'], 'wafv2')
+        ip_sets = waf_utils.list_ip_sets(waf_client)
+        web_acl = waf_utils.find_web_acl(waf_client, created_web_acl_name)
+
+        # Skip the evaluation if neither the WAF resources nor the distribution config changed since the last
+        # evaluation. The lock token of a WAF resource changes on every update of the resource
+        waf_digest = evaluation_utils.compute_digest(
+            [('ip-set', ip_set['Id'], ip_set['LockToken']) for ip_set in ip_sets] +
+            ([('web-acl', web_acl['Id'], web_acl['LockToken'])] if web_acl is not None else []) +
+            [('distribution', distribution.get_etag(), '')]
+        )
+        if evaluation_utils.is_unchanged(team_data, 'task5-waf-digest', waf_digest):
+            return team_data
+
+        if web_acl is not None:
+            web_acl_arn = web_acl['ARN']
+            waf_web_acl_response = waf_client.get_web_acl(Name=web_acl['Name'], Scope=waf_utils.WAF_SCOPE, Id=web_acl['Id'])
+
+            # Only the IP sets the WebACL rules reference can complete the task, so only those are fetched
+            referenced_ip_set_arns = waf_utils.get_referenced_ip_set_arns(waf_web_acl_response['WebACL']['Rules'])
+            ip_set = waf_utils.find_ip_set_with_address(waf_client, ip_sets, referenced_ip_set_arns, ip_address_from_task2b)
+            if ip_set is not None:
+                ip_set_id = ip_set['Id']
                 waf_web_acl_flag = True
-                break
-        
+        else:
+            print(f"No WebACL named {created_web_acl_name} found for team {team_data['team-id']}")
+
         if ip_set_id != "" and waf_web_acl_flag:
             team_data['is-cloudfront-ip-set-created'] = True
             # Lookup events in CloudFront
-            cloudfront_client = xa_session.client('cloudfront')
-            cloudfront_response = cloudfront_client.get_distribution(Id=team_data['cloudfront-distribution-id'])
-            cloudfront_web_acl_id = cloudfront_response['Distribution']['DistributionConfig']['WebACLId']
+            cloudfront_web_acl_id = distribution.get_config()['WebACLId']
 
             print(f"TASK 5 result for team {team_data['team-id']}: {cloudfront_web_acl_id}")
 
@@ -289,110 +330,54 @@ def evaluate_cloudfront_waf(quests_api_client, team_data):
                 # Switch flag
                 team_data['is-cloudfront-waf-attached'] = True
 
-                # Delete hint
-                quests_api_client.delete_hint(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    hint_key=hint_const.TASK5_HINT1_KEY,
-                    detail=True
-                )
-
-                # Post task final message
-                image_url_task5 = ui_utils.generate_signed_or_open_url(ASSETS_BUCKET, f"{ASSETS_BUCKET_PREFIX}architecture_task5.png",signed_duration=86400)
-                quests_api_client.post_output(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    key=output_const.TASK5_COMPLETE_KEY,
-                    label=output_const.TASK5_COMPLETE_LABEL,
-                    value=output_const.TASK5_COMPLETE_VALUE.format(image_url_task5),
-                    dashboard_index=output_const.TASK5_COMPLETE_INDEX,
-                    markdown=output_const.TASK5_COMPLETE_MARKDOWN,
-                )
-
-                # Award final points
-                quests_api_client.post_score_event(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID,
-                    description=scoring_const.TASK5_COMPLETE_DESC,
-                    points=scoring_const.TASK5_COMPLETE_POINTS
-                )
+                # The hint is replaced by the task final message by dashboard_utils.sync_dashboard
+
+                # The points are awarded by award_completed_tasks, once the completion is persisted
+                # WAF resources carry no change time. The task was completed by the last of the updates of the IP set,
+                # the WebACL and the distribution, which happened after the last evaluation that found it incomplete
+                evaluation_utils.record_detection_latency(
+                    team_data, 'task5', lambda: get_task5_change_time(team_data, distribution),
+                    'LastModifiedTime/last incomplete evaluation', time.time())
 
             else:
                 print(f"No matching CloudTrail events found for team {team_data['team-id']}")
 
+        # Task not complete yet, remember what was evaluated and when
+        if not team_data['is-cloudfront-waf-attached']:
+            team_data['task5-waf-digest'] = waf_digest
+            team_data['task5-evaluated-at'] = int(time.time())
+
     return team_data
 
+
+# Lower bound of the time the team completed Task 5: the distribution's LastModifiedTime, or the last evaluation that
+# found the task incomplete if it was later
+def get_task5_change_time(team_data, distribution):
+    return max(distribution.get_last_modified_time().timestamp(), float(team_data.get('task5-evaluated-at', 0)))
+
 # Task 6 - CloudWatch Metrics
-def evaluate_cloudwatch_alarm(quests_api_client, team_data):
+def evaluate_cloudwatch_alarm(quests_api_client, team_data, distribution):
 
     if not team_data['is-cloudwatch-alarm-created']:
         print("TASK 6 START")
-        
-        alarms_with_metrics = []
-        metrics_cloudfront = []
-        alarm_flag = False
-
-        # Establish cross-account session
-        print(f"Assuming Ops role for team {team_data['team-id']}")
-        xa_session = quests_api_client.assume_team_ops_role(team_data['team-id'])
-
-        # Lookup events in WAF IP Sets
-        cloudwatch_client = xa_session.client('cloudwatch')
-        cloudwatch_metrics_response = cloudwatch_client.describe_alarms()
-        cloudwatch_metric_alarms = cloudwatch_metrics_response['MetricAlarms']
-        
-        # find for alarms with metrics
-        for alarm in cloudwatch_metric_alarms:
-            if 'Metrics' in alarm:
-                alarms_with_metrics.append(alarm)
-        
-        # find for alarms with cloudfront metrics
-        for alarm in alarms_with_metrics:
-            for metric in alarm['Metrics']:
-                if 'MetricStat' in metric:
-                    if metric['MetricStat']['Metric']['Namespace'] == 'AWS/CloudFront' and metric['MetricStat']['Metric']['MetricName'] == 'Requests':
-                        metrics_cloudfront.append(metric)
-        
-        # find for metrics for cloudfront distribution
-        for metric in metrics_cloudfront:
-            for dimension in metric['MetricStat']['Metric']['Dimensions']:
-                if dimension['Name'] == 'DistributionId':
-                    if dimension['Value'] == team_data['cloudfront-distribution-id']:
-                        alarm_flag = True
-
-        
+
+        # Lookup alarms on the distribution Requests metric in CloudWatch, through the cached cross-account session
+        cloudwatch_client = session_utils.get_team_client(quests_api_client, team_data['team-id'], 'cloudwatch')
+        alarm = cloudwatch_utils.find_distribution_requests_alarm(cloudwatch_client, team_data['cloudfront-distribution-id'])
+        alarm_flag = alarm is not None
+
         # Complete task if WebACL was attached
         if alarm_flag:
 
             # Switch flag
             team_data['is-cloudwatch-alarm-created'] = True
 
-            # Delete hint
-            quests_api_client.delete_hint(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                hint_key=hint_const.TASK6_HINT1_KEY,
-                detail=True
-            )
+            # The hint is replaced by the task final message by dashboard_utils.sync_dashboard
 
-            # Post task final message
-            quests_api_client.post_output(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                key=output_const.TASK6_COMPLETE_KEY,
-                label=output_const.TASK6_COMPLETE_LABEL,
-                value=output_const.TASK6_COMPLETE_VALUE,
-                dashboard_index=output_const.TASK6_COMPLETE_INDEX,
-                markdown=output_const.TASK6_COMPLETE_MARKDOWN,
-            )
-
-            # Award final points
-            quests_api_client.post_score_event(
-                team_id=team_data["team-id"],
-                quest_id=QUEST_ID,
-                description=scoring_const.TASK6_COMPLETE_DESC,
-                points=scoring_const.TASK6_COMPLETE_POINTS
-            )
+            # The points are awarded by award_completed_tasks, once the completion is persisted
+            evaluation_utils.record_detection_latency(
+                team_data, 'task6', lambda: alarm.get('AlarmConfigurationUpdatedTimestamp'),
+                'AlarmConfigurationUpdatedTimestamp', time.time())
 
         else:
             print(f"No matching CloudTrail events found for team {team_data['team-id']}")
@@ -400,8 +385,31 @@ def evaluate_cloudwatch_alarm(quests_api_client, team_data):
     return team_data
 
 
-# Verify that all tasks have been successfully done and complete the quest if so
-def check_and_complete_quest(quests_api_client, quest_id, team_data):
+# Awards the points of the AWS-verified tasks in completed_tasks, the task flags update_team_data reported this run
+# completed. A task whose points could not be posted is handed back: the next check finds it complete again and awards
+# it then. Returns a list of (task flag, exception) for the tasks that were handed back
+def award_completed_tasks(quests_api_client, team_data, completed_tasks, quest_team_status_table):
+    errors = []
+    for flag in [flag for flag in TASK_SCORES if flag in completed_tasks]:
+        description, points = TASK_SCORES[flag]
+        try:
+            quests_api_client.post_score_event(
+                team_id=team_data["team-id"],
+                quest_id=QUEST_ID,
+                description=description,
+                points=points
+            )
+        except Exception as err:
+            print(f"Could not award {flag} to team {team_data['team-id']}, handing the task back: {err}")
+            dynamodb_utils.release_completed_task(team_data['team-id'], QUEST_ID, flag, quest_team_status_table)
+            team_data[flag] = False
+            errors.append((flag, err))
+    return errors
+
+
+# Verify that all tasks have been successfully done and complete the quest if so. Returns team_data and a list of
+# (award step, exception) when completing the quest failed
+def check_and_complete_quest(quests_api_client, quest_id, team_data, quest_team_status_table):
 
     # Check if everything is done
     if (team_data['is-identified-origin']                   # Task 1
@@ -412,46 +420,55 @@ def check_and_complete_quest(quests_api_client, quest_id, team_data):
         and team_data['is-cloudfront-waf-attached']         # Task 5
         and team_data['is-cloudwatch-alarm-created']):      # Task 6
 
-        # Award quest complete points
-        print(f"Team {team_data['team-id']} has completed this quest, posting output and awarding points")
-        team_data['quest-completed'] = True
-
-        quests_api_client.post_score_event(
-            team_id=team_data["team-id"],
-            quest_id=quest_id,
-            description=scoring_const.QUEST_COMPLETE_DESC,
-            points=scoring_const.QUEST_COMPLETE_POINTS
-        )
-
-        # Award quest complete bonus points
-        bonus_points = calculate_bonus_points(quests_api_client, quest_id, team_data)
-        
-        quests_api_client.post_score_event(
-            team_id=team_data["team-id"],
-            quest_id=quest_id,
-            description=scoring_const.QUEST_COMPLETE_BONUS_DESC,
-            points=bonus_points
-        )
-
-        # Post quest complete message
-        image_url_questcomplete = ui_utils.generate_signed_or_open_url(ASSETS_BUCKET, f"{ASSETS_BUCKET_PREFIX}architecture_final.png",signed_duration=86400)
-
-        quests_api_client.post_output(
-            team_id=team_data['team-id'],
-            quest_id=quest_id,
-            key=output_const.QUEST_COMPLETE_KEY,
-            label=output_const.QUEST_COMPLETE_LABEL,
-            value=output_const.QUEST_COMPLETE_VALUE.format(image_url_questcomplete),
-            dashboard_index=output_const.QUEST_COMPLETE_INDEX,
-            markdown=output_const.QUEST_COMPLETE_MARKDOWN,
-        )
+        # Claim the completion before awarding it, another check of the team may be completing the quest concurrently
+        if not dynamodb_utils.claim_quest_completion(team_data['team-id'], quest_team_status_table):
+            team_data['quest-completed'] = True
+            return team_data, []
 
-        # Complete quest
-        quests_api_client.post_quest_complete(team_id=team_data['team-id'], quest_id=quest_id)
+        # Award quest complete points
+        print(f"Team {team_data['team-id']} has completed this quest, awarding points")
 
-        return team_data
+        # Each step is recorded once done. If one fails, the claim is released and the next check resumes from the
+        # first step not recorded, so no step is done twice or skipped
+        award_steps = [
+            ('quest-complete-points', lambda: quests_api_client.post_score_event(
+                team_id=team_data["team-id"],
+                quest_id=quest_id,
+                description=scoring_const.QUEST_COMPLETE_DESC,
+                points=scoring_const.QUEST_COMPLETE_POINTS
+            )),
+            # Award quest complete bonus points
+            ('quest-complete-bonus', lambda: quests_api_client.post_score_event(
+                team_id=team_data["team-id"],
+                quest_id=quest_id,
+                description=scoring_const.QUEST_COMPLETE_BONUS_DESC,
+                points=calculate_bonus_points(quests_api_client, quest_id, team_data)
+            )),
+            # Complete quest
+            ('quest-complete', lambda: quests_api_client.post_quest_complete(
+                team_id=team_data['team-id'], quest_id=quest_id))
+        ]
+        quest_awards = set(team_data.get(dynamodb_utils.QUEST_AWARDS_KEY, set()))
+        for step, award in award_steps:
+            if step in quest_awards:
+                print(f"{step} was already awarded to team {team_data['team-id']}, skipping")
+                continue
+            try:
+                award()
+                dynamodb_utils.record_quest_award(team_data['team-id'], step, quest_team_status_table)
+            except Exception as err:
+                print(f"Could not award {step} to team {team_data['team-id']}, releasing the quest completion: {err}")
+                dynamodb_utils.release_quest_completion(team_data['team-id'], quest_id, quest_team_status_table)
+                team_data[dynamodb_utils.QUEST_AWARDS_KEY] = quest_awards
+                return team_data, [(step, err)]
+            quest_awards.add(step)
+
+        # The quest complete message is posted by dashboard_utils.sync_dashboard
+        team_data['quest-completed'] = True
+        team_data.pop('pending-quest-id', None)
+        team_data[dynamodb_utils.QUEST_AWARDS_KEY] = quest_awards
 
-    return team_data
+    return team_data, []
 
 
 # Calculate quest completion bonus points
@@ -482,7 +499,7 @@ def calculate_bonus_points(quests_api_client, quest_id, team_data):
 def is_within_quest_duration(team_data):
     time_limit = 45
 
-    start_time = datetime.fromtimestamp(team_data['quest-start-time'])
+    start_time = datetime.fromtimestamp(int(team_data['quest-start-time']))
 
     current_time = datetime.now()
 
@@ -0,0 +1,60 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import threading
+import boto3
+import metrics_utils
+
+# AWS clients and DynamoDB tables of the central account. They are built the first time a handler asks for
+# them rather than at import time, so a handler only pays for the clients it actually uses, and they are
+# reused by every later invocation of the execution environment
+clients = {}
+resources = {}
+tables = {}
+clients_lock = threading.Lock()
+thread_state = threading.local()
+
+
+# Returns the shared client for the service. Clients are thread-safe once built, but building them on the
+# default session is not, hence the lock
+def get_client(service_name):
+    with clients_lock:
+        if service_name not in clients:
+            clients[service_name] = metrics_utils.instrument_client(boto3.client(service_name))
+        return clients[service_name]
+
+
+# Builds a new client on the default session, e.g. for a team account with the team's credentials. All clients share
+# the session's botocore loader and its service models, a client of its own session would load them again
+def build_client(service_name, **client_args):
+    with clients_lock:
+        return metrics_utils.instrument_client(boto3.client(service_name, **client_args))
+
+
+# Returns the shared DynamoDB Table resource. Resources are not thread-safe, worker threads must use
+# get_thread_table instead
+def get_table(table_name):
+    with clients_lock:
+        if table_name not in tables:
+            tables[table_name] = _get_dynamodb_resource().Table(table_name)
+        return tables[table_name]
+
+
+# Returns a DynamoDB Table resource owned by the calling thread. The resources of all threads are built over the one
+# low-level DynamoDB client of the container, which is thread-safe, so a thread only pays for the resource object
+def get_thread_table(table_name):
+    if not hasattr(thread_state, 'tables'):
+        thread_state.tables = {}
+    if table_name not in thread_state.tables:
+        with clients_lock:
+            dynamodb_resource = _get_dynamodb_resource()
+            thread_state.tables[table_name] = type(dynamodb_resource)(client=dynamodb_resource.meta.client).Table(table_name)
+    return thread_state.tables[table_name]
+
+
+# Must be called while holding the clients lock. The DynamoDB resource registers the serialization of the Table
+# attributes on its client, the low-level client is therefore only used through Table resources
+def _get_dynamodb_resource():
+    if 'dynamodb' not in resources:
+        resources['dynamodb'] = boto3.resource('dynamodb')
+        metrics_utils.instrument_client(resources['dynamodb'].meta.client)
+    return resources['dynamodb']
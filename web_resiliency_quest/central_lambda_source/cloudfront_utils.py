@@ -0,0 +1,48 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import threading
+import session_utils
+
+
+# Snapshot of a team's CloudFront distribution, shared by all evaluators of a single check. The distribution is
+# fetched on first access only, at most once per check, so that no call is made when every CloudFront-backed task
+# is already done. Safe to use from concurrently running evaluators.
+# Evaluators only need the distribution config, which the lighter get_distribution_config call returns together with
+# the ETag used for change detection. The DomainName of the distribution is stored in the team item by init_lambda.
+# Only the evaluator that completes a task needs the LastModifiedTime of the distribution, which takes a get_distribution
+class DistributionSnapshot:
+
+    def __init__(self, quests_api_client, team_id, distribution_id):
+        self.quests_api_client = quests_api_client
+        self.team_id = team_id
+        self.distribution_id = distribution_id
+        self._config_response = None
+        self._last_modified_time = None
+        self._lock = threading.Lock()
+
+    # The 'DistributionConfig' element of the get_distribution_config response
+    def get_config(self):
+        return self._get_config_response()['DistributionConfig']
+
+    # The ETag changes whenever the distribution config is updated
+    def get_etag(self):
+        return self._get_config_response()['ETag']
+
+    # When the distribution was last updated, as a datetime
+    def get_last_modified_time(self):
+        with self._lock:
+            if self._last_modified_time is None:
+                cloudfront_response = self._get_client().get_distribution(Id=self.distribution_id)
+                self._last_modified_time = cloudfront_response['Distribution']['LastModifiedTime']
+            return self._last_modified_time
+
+    def _get_config_response(self):
+        with self._lock:
+            if self._config_response is None:
+                cloudfront_response = self._get_client().get_distribution_config(Id=self.distribution_id)
+                print(f"CloudFront distribution config for team {self.team_id}: {cloudfront_response}")
+                self._config_response = cloudfront_response
+            return self._config_response
+
+    def _get_client(self):
+        return session_utils.get_team_client(self.quests_api_client, self.team_id, 'cloudfront')
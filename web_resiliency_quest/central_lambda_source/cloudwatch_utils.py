@@ -0,0 +1,54 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+CLOUDFRONT_NAMESPACE = "AWS/CloudFront"
+CLOUDFRONT_REQUESTS_METRIC = "Requests"
+# Page size used when streaming through all the alarms of an account
+ALARMS_PAGE_SIZE = 100
+
+
+# Returns the first alarm watching the CloudFront Requests metric of the distribution, or None.
+# The targeted describe_alarms_for_metric lookup only sees alarms on that exact metric and dimensions, so
+# metric math alarms (and alarms with other dimension sets) are searched for by streaming all the alarms
+# of the account page by page, stopping at the first match. Until the team creates its alarm this scans all the
+# alarms: schedule_utils backs a team whose checks find no change off to one check every CHECK_MAX_INTERVAL_SECONDS
+def find_distribution_requests_alarm(cloudwatch_client, distribution_id):
+    # CloudFront publishes its metrics with both the DistributionId and the Region=Global dimensions
+    for dimensions in (
+        [{'Name': 'DistributionId', 'Value': distribution_id}, {'Name': 'Region', 'Value': 'Global'}],
+        [{'Name': 'DistributionId', 'Value': distribution_id}]
+    ):
+        response = cloudwatch_client.describe_alarms_for_metric(
+            Namespace=CLOUDFRONT_NAMESPACE,
+            MetricName=CLOUDFRONT_REQUESTS_METRIC,
+            Dimensions=dimensions
+        )
+        for alarm in response['MetricAlarms']:
+            if is_distribution_requests_alarm(alarm, distribution_id):
+                return alarm
+
+    paginator = cloudwatch_client.get_paginator('describe_alarms')
+    for page in paginator.paginate(AlarmTypes=['MetricAlarm'], PaginationConfig={'PageSize': ALARMS_PAGE_SIZE}):
+        for alarm in page['MetricAlarms']:
+            if is_distribution_requests_alarm(alarm, distribution_id):
+                return alarm
+    return None
+
+
+# Whether a simple or metric math alarm watches the CloudFront Requests metric of the distribution
+def is_distribution_requests_alarm(alarm, distribution_id):
+    if _is_distribution_requests_metric(alarm, distribution_id):
+        return True
+    for metric in alarm.get('Metrics', []):
+        if 'MetricStat' in metric and _is_distribution_requests_metric(metric['MetricStat']['Metric'], distribution_id):
+            return True
+    return False
+
+
+def _is_distribution_requests_metric(metric, distribution_id):
+    if metric.get('Namespace') != CLOUDFRONT_NAMESPACE or metric.get('MetricName') != CLOUDFRONT_REQUESTS_METRIC:
+        return False
+    for dimension in metric.get('Dimensions', []):
+        if dimension['Name'] == 'DistributionId' and dimension['Value'] == distribution_id:
+            return True
+    return False
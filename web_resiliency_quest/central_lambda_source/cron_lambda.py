@@ -1,10 +1,17 @@
 # Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
 import os
-import boto3
+import time
 import json
+from boto3.dynamodb.conditions import Attr, Key
+import client_utils
+import dynamodb_utils
+import metadata_utils
 import quest_const
-from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+import metrics_utils
+import quests_api_utils
+import schedule_utils
+import trace_utils
 
 # Standard AWS GameDay Quests Environment Variables
 QUEST_ID = os.environ['QUEST_ID']
@@ -13,35 +20,164 @@ QUEST_API_TOKEN = os.environ['QUEST_API_TOKEN']
 GAMEDAY_REGION = os.environ['GAMEDAY_REGION']
 
 # Quest Environment Variables
+QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
 CHECK_TEAM_LAMBDA = os.environ['CHECK_TEAM_LAMBDA']
+CHECK_DISPATCH_MODE = os.environ.get('CHECK_DISPATCH_MODE', quest_const.CHECK_DISPATCH_TEAM)
+CHECK_BATCH_SIZE = int(os.environ.get('CHECK_BATCH_SIZE', '25'))
 
-# Lambda Client Setup
-lambda_client = boto3.client('lambda')
+# Whether this container already put the items created before the pending checks index existed in it, see
+# backfill_pending_checks
+pending_checks_backfilled = False
+# Whether this container already looked up the metadata of the items created before init_lambda stored it, see
+# backfill_team_metadata
+team_metadata_backfilled = False
 
 
+@metrics_utils.account_api_calls('cron_lambda')
+@trace_utils.trace_invocation('cron_lambda')
 def lambda_handler(event, context):
     print(f"cron_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
+    cycle_start = time.time()
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    # The Quest API Client of this container: pooled connections and cached reads, see quests_api_utils.py
+    quests_api_client = quests_api_utils.get_quests_api_client(QUEST_API_BASE, QUEST_API_TOKEN)
     # Check if event is running
     event_status = quests_api_client.get_event_status()
     if event_status['status'] != quest_const.EVENT_IN_PROGRESS:
         print(f"Event Status: {event_status}, aborting CRON_LAMBDA")
         return
 
-    # Get all teams that are in any way engaging with this Quest
-    active_teams = quests_api_client.get_teams_for_quest(QUEST_ID)
-    print(f"Active teams to fan out checks: {active_teams}")
-
-    # Find IN_PROGRESS teams and evaluate them
-    for team in active_teams:
-        if team['quest-state'] == quest_const.TEAM_QUEST_IN_PROGRESS:
-            lambda_response = lambda_client.invoke(
-                FunctionName=CHECK_TEAM_LAMBDA,
-                InvocationType='Event',
-                Payload=json.dumps(team, default=str))
-            print(f"Fanned out check for team {team['team-id']}, " +
-                  f"async Lambda invocation response: {json.dumps(lambda_response, default=str)}")
-        else:
-            print(f"Skipping team {team['team-id']} with Quest status: {team['quest-state']}")
+    # Teams that left the quest keep their item, only those whose quest is still IN_PROGRESS are checked
+    in_progress_team_ids = get_in_progress_team_ids(quests_api_client)
+    backfill_team_metadata(quests_api_client, in_progress_team_ids)
+
+    # Only the teams with pending work whose next check is due are evaluated, see schedule_utils.py
+    backfill_pending_checks(cycle_start)
+    due_teams = get_due_teams(cycle_start)
+    skipped_teams = [team['team-id'] for team in due_teams if team['team-id'] not in in_progress_team_ids]
+    if skipped_teams:
+        print(f"Skipping teams whose quest is not in progress: {skipped_teams}")
+    due_teams = [team for team in due_teams if team['team-id'] in in_progress_team_ids]
+    print(f"Teams to fan out checks: {[team['team-id'] for team in due_teams]}")
+
+    if CHECK_DISPATCH_MODE == quest_const.CHECK_DISPATCH_BATCH:
+        invocations = fan_out_batches(due_teams, cycle_start)
+    else:
+        invocations = fan_out_teams(due_teams, cycle_start)
+
+    # Report how long it took to dispatch this minute's checks
+    print(f"Cron cycle: mode={CHECK_DISPATCH_MODE}, due={len(due_teams)}, invocations={invocations}, " +
+          f"dispatch_ms={int((time.time() - cycle_start) * 1000)}")
+    print(f"Quests API cache: {quests_api_utils.get_cache_stats()}")
+    print(f"Quests API connections: {quests_api_utils.get_transport_stats()}")
+
+
+# Queries the sparse pending checks index, which only holds the teams of this quest that still have work to be checked,
+# for the ones whose next check is due. Items are only created by init_lambda once the quest is IN_PROGRESS for the team
+# :returns: [{'team-id': team_id}, ...]
+def get_due_teams(now):
+    quest_team_status_table = client_utils.get_table(QUEST_TEAM_STATUS_TABLE)
+    query_params = {
+        'IndexName': quest_const.PENDING_CHECKS_INDEX,
+        'KeyConditionExpression': Key('pending-quest-id').eq(QUEST_ID) &
+                                  Key('next-check-at').lte(int(now + schedule_utils.CHECK_DUE_SLACK_SECONDS))
+    }
+    due_teams = []
+    while True:
+        dynamodb_response = quest_team_status_table.query(**query_params)
+        due_teams += [{'team-id': item['team-id']} for item in dynamodb_response['Items']]
+        if 'LastEvaluatedKey' not in dynamodb_response:
+            return due_teams
+        query_params['ExclusiveStartKey'] = dynamodb_response['LastEvaluatedKey']
+
+
+# The IDs of the teams whose quest is IN_PROGRESS, from a single Quests API call
+def get_in_progress_team_ids(quests_api_client):
+    return {str(team['team-id']) for team in quests_api_client.get_teams_for_quest(QUEST_ID)
+            if team['quest-state'] == quest_const.TEAM_QUEST_IN_PROGRESS}
+
+
+# Items created before the adaptive schedule existed have no next-check-at nor pending-quest-id, so the pending checks
+# index doesn't return them. The first cycle of every container scans for them and schedules them for a check now
+def backfill_pending_checks(now):
+    global pending_checks_backfilled
+    if pending_checks_backfilled:
+        return
+    quest_team_status_table = client_utils.get_table(QUEST_TEAM_STATUS_TABLE)
+    scan_params = {'FilterExpression': Attr('next-check-at').not_exists()}
+    backfilled = []
+    while True:
+        dynamodb_response = quest_team_status_table.scan(**scan_params)
+        for item in dynamodb_response['Items']:
+            team_data = dynamodb_utils.load_team_data(item)
+            schedule_utils.mark_active(team_data, now)
+            schedule_utils.sync_pending_checks(team_data, QUEST_ID)
+            schedule = {key: team_data[key] for key in schedule_utils.SCHEDULE_KEYS if key in team_data}
+            if dynamodb_utils.backfill_schedule(team_data['team-id'], schedule, quest_team_status_table):
+                backfilled.append(team_data['team-id'])
+        if 'LastEvaluatedKey' not in dynamodb_response:
+            break
+        scan_params['ExclusiveStartKey'] = dynamodb_response['LastEvaluatedKey']
+    print(f"Backfilled the pending checks index with teams: {backfilled}")
+    pending_checks_backfilled = True
+
+
+# Items created before init_lambda stored the team's AWS account ID and CloudFront domain name lack them, so
+# event_router_lambda can't map the API activity of the team to it. The first cycle of every container scans for them
+# and looks the metadata of the IN_PROGRESS teams up in their account, see metadata_utils.py
+def backfill_team_metadata(quests_api_client, in_progress_team_ids):
+    global team_metadata_backfilled
+    if team_metadata_backfilled:
+        return
+    quest_team_status_table = client_utils.get_table(QUEST_TEAM_STATUS_TABLE)
+    scan_params = {'FilterExpression': Attr(metadata_utils.AWS_ACCOUNT_ID_KEY).not_exists() |
+                                       Attr(metadata_utils.CLOUDFRONT_DOMAIN_NAME_KEY).not_exists()}
+    backfilled = []
+    while True:
+        dynamodb_response = quest_team_status_table.scan(**scan_params)
+        for item in dynamodb_response['Items']:
+            if item['team-id'] not in in_progress_team_ids:
+                continue
+            try:
+                metadata_utils.ensure_team_metadata(quests_api_client, dict(item), quest_team_status_table)
+                backfilled.append(item['team-id'])
+            except Exception as err:
+                # Retried by the next container, or by the next dashboard sync of the team
+                print(f"Looking up the metadata of team {item['team-id']} failed: {err}")
+        if 'LastEvaluatedKey' not in dynamodb_response:
+            break
+        scan_params['ExclusiveStartKey'] = dynamodb_response['LastEvaluatedKey']
+    print(f"Backfilled the metadata of teams: {backfilled}")
+    team_metadata_backfilled = True
+
+
+# One async CHECK_TEAM_LAMBDA invocation per team, the payload being {'team-id': team_id}
+def fan_out_teams(teams, cycle_start):
+    for team in teams:
+        payload = trace_utils.inject(dict(team, **{'cycle-start-time': cycle_start}))
+        lambda_response = client_utils.get_client('lambda').invoke(
+            FunctionName=CHECK_TEAM_LAMBDA,
+            InvocationType='Event',
+            Payload=json.dumps(payload, default=str))
+        print(f"Fanned out check for team {team['team-id']}, " +
+              f"async Lambda invocation response: {json.dumps(lambda_response, default=str)}")
+    return len(teams)
+
+
+# One async CHECK_TEAM_LAMBDA invocation per shard of CHECK_BATCH_SIZE teams. The worker evaluates the
+# teams of its shard concurrently, see check_team_lambda.check_team_batch
+def fan_out_batches(teams, cycle_start):
+    shards = [teams[i:i + CHECK_BATCH_SIZE] for i in range(0, len(teams), CHECK_BATCH_SIZE)]
+    for shard_number, shard in enumerate(shards):
+        payload = trace_utils.inject({
+            'teams': shard,
+            'cycle-start-time': cycle_start
+        })
+        lambda_response = client_utils.get_client('lambda').invoke(
+            FunctionName=CHECK_TEAM_LAMBDA,
+            InvocationType='Event',
+            Payload=json.dumps(payload, default=str))
+        print(f"Fanned out check for shard {shard_number + 1}/{len(shards)} " +
+              f"(teams {[team['team-id'] for team in shard]}), " +
+              f"async Lambda invocation response: {json.dumps(lambda_response, default=str)}")
+    return len(shards)
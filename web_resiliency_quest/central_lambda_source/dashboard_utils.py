@@ -0,0 +1,249 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import dynamodb_utils
+import evaluation_utils
+import hint_const
+import input_const
+import metadata_utils
+import output_const
+import trace_utils
+import ui_utils
+
+# Standard AWS GameDay Quests Environment Variables
+QUEST_ID = os.environ['QUEST_ID']
+ASSETS_BUCKET = os.environ['ASSETS_BUCKET']
+ASSETS_BUCKET_PREFIX = os.environ['ASSETS_BUCKET_PREFIX']
+
+# Upper bound of dashboard writes in flight for one team. The QDK has no HTTP session of its own, it calls the requests
+# module functions: the writes only reuse connections through the pooled transport of quests_api_utils.py. Kept below
+# its QUESTS_API_POOL_SIZE (default 10), so concurrent writes don't open connections the pool then discards
+PUBLISH_CONCURRENCY = int(os.environ.get('PUBLISH_CONCURRENCY', '8'))
+# A failed write is retried with exponential backoff and full jitter: PUBLISH_RETRY_BASE_SECONDS, twice that, ...
+PUBLISH_MAX_ATTEMPTS = int(os.environ.get('PUBLISH_MAX_ATTEMPTS', '3'))
+PUBLISH_RETRY_BASE_SECONDS = float(os.environ.get('PUBLISH_RETRY_BASE_SECONDS', '0.2'))
+
+
+# Collects the dashboard writes of a team (outputs, inputs, hints) and publishes them concurrently. The writes must be
+# independent of each other: the dashboard orders the items by dashboard_index, not by the order they were posted in.
+# Usage: call post_output/post_input/post_hint as on the Quests API client, then publish()
+class DashboardPublisher:
+
+    def __init__(self, quests_api_client, max_workers=PUBLISH_CONCURRENCY):
+        self.quests_api_client = quests_api_client
+        self.max_workers = max_workers
+        self.writes = []
+
+    def post_output(self, **kwargs):
+        self.writes.append(('post_output', kwargs))
+
+    def post_input(self, **kwargs):
+        self.writes.append(('post_input', kwargs))
+
+    def post_hint(self, **kwargs):
+        self.writes.append(('post_hint', kwargs))
+
+    def delete_output(self, **kwargs):
+        self.writes.append(('delete_output', kwargs))
+
+    def delete_input(self, **kwargs):
+        self.writes.append(('delete_input', kwargs))
+
+    def delete_hint(self, **kwargs):
+        self.writes.append(('delete_hint', kwargs))
+
+    # Sends the collected writes, with at most max_workers in flight. A write that still fails after
+    # PUBLISH_MAX_ATTEMPTS doesn't stop the others.
+    # :returns: a list of (method, key, exception) for the writes that failed
+    def publish(self):
+        writes, self.writes = self.writes, []
+        publish_start = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(writes)))) as executor:
+            futures = [executor.submit(trace_utils.bind(self._write), method, kwargs) for method, kwargs in writes]
+
+        errors = []
+        for (method, kwargs), future in zip(writes, futures):
+            try:
+                future.result()
+            except Exception as err:
+                key = kwargs.get('key', kwargs.get('hint_key'))
+                print(f"Dashboard write {method} {key} failed for team {kwargs.get('team_id')}: {err}")
+                errors.append((method, key, err))
+
+        print(f"Dashboard publish: writes={len(writes)}, failed={len(errors)}, concurrency={self.max_workers}, " +
+              f"publish_ms={int((time.time() - publish_start) * 1000)}")
+        return errors
+
+    def _write(self, method, kwargs):
+        for attempt in range(PUBLISH_MAX_ATTEMPTS):
+            try:
+                return getattr(self.quests_api_client, method)(**kwargs)
+            except Exception as err:
+                if attempt + 1 == PUBLISH_MAX_ATTEMPTS:
+                    raise err
+                delay = random.uniform(0, PUBLISH_RETRY_BASE_SECONDS * 2 ** attempt)
+                print(f"Dashboard write {method} failed ({err}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+
+def _always(team_data):
+    return True
+
+
+def _done(flag):
+    return lambda team_data: bool(team_data[flag])
+
+
+def _pending(flag):
+    return lambda team_data: not team_data[flag]
+
+
+def _answered_wrong(flag, marker_key):
+    return lambda team_data: not team_data[flag] and bool(team_data.get(marker_key))
+
+
+# The dashboard of a team: every output, input and hint of the quest and the task state in which it is shown.
+# Entry format: (kind, constant prefix in output_const/input_const/hint_const, shown(team_data), value format arguments).
+# The format arguments are a function (team_data, asset_url) -> list, or None for a value without placeholders
+DASHBOARD_MANIFEST = [
+    ('output', 'WELCOME_1', _always, lambda team_data, asset_url: [asset_url('robot_queue_image.png')]),
+    ('output', 'WELCOME_2', _always, lambda team_data, asset_url: [asset_url('architecture_task0.png')]),
+
+    # TASK 1
+    ('output', 'TASK1', _always, lambda team_data, asset_url: [team_data['cloudfront-domain-name']] * 2),
+    ('input', 'TASK1_ORIGIN', _pending('is-identified-origin'), None),
+    ('hint', 'TASK1_HINT1', _pending('is-identified-origin'), None),
+    ('output', 'TASK1_WRONG_ORIGIN', _answered_wrong('is-identified-origin', 'task1-wrong-answer'), None),
+    ('output', 'TASK1_CORRECT_ORIGIN', _done('is-identified-origin'), None),
+
+    # TASK 2
+    ('output', 'TASK2', _always, None),
+    ('hint', 'TASK2_HINT1', _pending('is-attach-cloudfront-origin-done'), None),
+    ('output', 'TASK2_COMPLETE', _done('is-attach-cloudfront-origin-done'),
+        lambda team_data, asset_url: [team_data['cloudfront-domain-name']] * 2 + [asset_url('architecture_task2.png')]),
+
+    # TASK 3
+    ('output', 'TASK3', _always, None),
+    ('hint', 'TASK3_HINT1', _pending('is-cloudfront-logs-enabled'), None),
+    ('output', 'TASK3_COMPLETE', _done('is-cloudfront-logs-enabled'),
+        lambda team_data, asset_url: [asset_url('architecture_task3.png')]),
+
+    # TASK 4
+    ('output', 'TASK4', _always, lambda team_data, asset_url: [team_data['cloudfront-domain-name']] * 6),
+    ('input', 'TASK4_ENDPOINT', _pending('is-answer-to-ip-address-correct'), None),
+    ('hint', 'TASK4_HINT1', _pending('is-answer-to-ip-address-correct'), None),
+    ('output', 'TASK4_IP_ADDRESS_WRONG', _answered_wrong('is-answer-to-ip-address-correct', 'task4-wrong-answer'), None),
+    ('output', 'TASK4_IP_ADDRESS_CORRECT', _done('is-answer-to-ip-address-correct'), None),
+
+    # TASK 5
+    ('output', 'TASK5', _always, lambda team_data, asset_url: [asset_url('waf_console.png')]),
+    ('hint', 'TASK5_HINT1', _pending('is-cloudfront-waf-attached'), None),
+    ('output', 'TASK5_COMPLETE', _done('is-cloudfront-waf-attached'),
+        lambda team_data, asset_url: [asset_url('architecture_task5.png')]),
+
+    # TASK 6
+    ('output', 'TASK6', _always,
+        lambda team_data, asset_url: [asset_url('cloudwatch_metrics.png')] + [team_data['cloudfront-domain-name']] * 2),
+    ('hint', 'TASK6_HINT1', _pending('is-cloudwatch-alarm-created'), None),
+    ('output', 'TASK6_COMPLETE', _done('is-cloudwatch-alarm-created'), None),
+
+    ('output', 'QUEST_COMPLETE', _done('quest-completed'), lambda team_data, asset_url: [asset_url('architecture_final.png')])
+]
+
+
+# Renders the dashboard entries shown for the team's task state.
+# :param asset_url: function returning the URL of an image of ASSETS_BUCKET_PREFIX
+# :returns: {entry id: (kind, arguments of the Quests API post call except team_id and quest_id)}
+def render_dashboard(team_data, asset_url):
+    entries = {}
+    for kind, name, shown, format_args in DASHBOARD_MANIFEST:
+        if not shown(team_data):
+            continue
+        if kind == 'output':
+            value = getattr(output_const, f"{name}_VALUE")
+            fields = {
+                'key': getattr(output_const, f"{name}_KEY"),
+                'label': getattr(output_const, f"{name}_LABEL"),
+                'value': value.format(*format_args(team_data, asset_url)) if format_args else value,
+                'dashboard_index': getattr(output_const, f"{name}_INDEX"),
+                'markdown': getattr(output_const, f"{name}_MARKDOWN")
+            }
+        elif kind == 'input':
+            fields = {
+                'key': getattr(input_const, f"{name}_KEY"),
+                'label': getattr(input_const, f"{name}_LABEL"),
+                'description': getattr(input_const, f"{name}_DESCRIPTION"),
+                'dashboard_index': getattr(input_const, f"{name}_INDEX")
+            }
+        else:
+            fields = {
+                'hint_key': getattr(hint_const, f"{name}_KEY"),
+                'label': getattr(hint_const, f"{name}_LABEL"),
+                'description': getattr(hint_const, f"{name}_DESCRIPTION"),
+                'value': getattr(hint_const, f"{name}_VALUE"),
+                'dashboard_index': getattr(hint_const, f"{name}_INDEX"),
+                'cost': getattr(hint_const, f"{name}_COST"),
+                'status': hint_const.STATUS_OFFERED
+            }
+        entries[f"{kind}:{fields.get('key', fields.get('hint_key'))}"] = (kind, fields)
+    return entries
+
+
+# Brings the team's dashboard in line with DASHBOARD_MANIFEST. team_data['dashboard-state'] records the digest of every
+# entry published so far: only new or changed entries are posted and only entries no longer shown are deleted, so
+# re-running it (Lambda retries, a re-init, a completion found twice) costs no Quests API call. Unchanged hints are
+# never re-posted, which would reset a hint the team already revealed.
+# The digests are computed with image names instead of signed URLs, which change with every signature.
+# :returns: a list of (method, key, exception) for the writes that failed, they are retried on the next sync
+def sync_dashboard(quests_api_client, team_data, quest_status_table):
+    # The outputs show the CloudFront domain name, which items created before the upgrade don't hold
+    metadata_utils.ensure_team_metadata(quests_api_client, team_data, quest_status_table)
+
+    desired_entries = render_dashboard(team_data, lambda image_name: image_name)
+    desired_state = {entry_id: evaluation_utils.compute_digest(fields.items())
+                     for entry_id, (kind, fields) in desired_entries.items()}
+    if dynamodb_utils.DASHBOARD_STATE_KEY in team_data:
+        seeded_state = {}
+    else:
+        # Team created before the dashboard state existed: the former init_lambda posted every hint, and the hint of a
+        # task was deleted when the task was completed. The hints shown are taken as published, so that the ones the
+        # team already revealed aren't reset. Outputs and inputs are posted again, which overwrites them as they are
+        seeded_state = {entry_id: digest for entry_id, digest in desired_state.items() if entry_id.startswith('hint:')}
+        print(f"Seeding the dashboard state of team {team_data['team-id']} with its hints: {sorted(seeded_state)}")
+    published_state = team_data.get(dynamodb_utils.DASHBOARD_STATE_KEY, seeded_state)
+
+    changed_ids = [entry_id for entry_id, digest in desired_state.items() if published_state.get(entry_id) != digest]
+    removed_ids = [entry_id for entry_id in published_state if entry_id not in desired_state]
+    if not changed_ids and not removed_ids:
+        print(f"Dashboard of team {team_data['team-id']} is up to date")
+        return []
+
+    # Only the images of the changed entries are signed, in one pass, and rendered in place of their names
+    changed_values = [desired_entries[entry_id][1].get('value', '') for entry_id in changed_ids]
+    image_names = [image_name for image_name in ui_utils.ASSET_IMAGE_NAMES
+                   if any(image_name in value for value in changed_values)]
+    asset_urls = ui_utils.generate_asset_image_urls(ASSETS_BUCKET, ASSETS_BUCKET_PREFIX, signed_duration=86400,
+                                                    image_names=image_names)
+    signed_entries = render_dashboard(team_data, asset_urls.get) if changed_ids else {}
+    publisher = DashboardPublisher(quests_api_client)
+    for entry_id in changed_ids:
+        kind, fields = signed_entries[entry_id]
+        getattr(publisher, f"post_{kind}")(team_id=team_data['team-id'], quest_id=QUEST_ID, **fields)
+    for entry_id in removed_ids:
+        kind, key = entry_id.split(':', 1)
+        if kind == 'hint':
+            publisher.delete_hint(team_id=team_data['team-id'], quest_id=QUEST_ID, hint_key=key, detail=True)
+        else:
+            getattr(publisher, f"delete_{kind}")(team_id=team_data['team-id'], quest_id=QUEST_ID, key=key)
+    errors = publisher.publish()
+
+    failed_ids = {f"{method.split('_', 1)[1]}:{key}" for method, key, _ in errors}
+    published = dict(seeded_state)
+    published.update({entry_id: desired_state[entry_id] for entry_id in changed_ids if entry_id not in failed_ids})
+    deleted = [entry_id for entry_id in removed_ids if entry_id not in failed_ids]
+    dynamodb_utils.update_dashboard_state(team_data, published, deleted, quest_status_table)
+    return errors
+
@@ -1,31 +1,284 @@
 # Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
 import json
-from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
+import quest_const
 
+# The task flags are stored as the 'completed-tasks' string set, which only ever grows through atomic ADD updates.
+# Concurrent functions completing different tasks therefore never conflict, so the item needs no version. Some
+# possible scenarios:
+# 1. Race condition between CHECK_TEAM_LAMBDA and UPDATE_LAMBDA
+# 2. Race condition between two executions of UPDATE_LAMBDA due to rapid button clicks
+# 3. Race condition between two executions of CHECK_TEAM_LAMBDA (overlapping cron cycles, event_router_lambda)
+TASK_FLAGS = quest_const.AWS_TASK_FLAGS + quest_const.INPUT_TASK_FLAGS
+COMPLETED_TASKS_KEY = 'completed-tasks'
+# Only written by claim_quest_completion
+QUEST_COMPLETED_KEY = 'quest-completed'
+# Only written by update_dashboard_state
+DASHBOARD_STATE_KEY = 'dashboard-state'
+# Only written by record_quest_award
+QUEST_AWARDS_KEY = 'quest-awards'
+# Attributes update_team_data never writes, the functions owning them update them one by one. The 'completed-tasks'
+# set is only changed through the task flags
+OWNED_KEYS = ('team-id', COMPLETED_TASKS_KEY, QUEST_COMPLETED_KEY, DASHBOARD_STATE_KEY, QUEST_AWARDS_KEY)
+# Suffix of the '<task>-detection-seconds' attributes of evaluation_utils.record_detection_latency. They keep the value
+# of the first detection: a concurrent check that found the task complete as well doesn't overwrite it
+DETECTION_SECONDS_SUFFIX = '-detection-seconds'
 
-def save_team_data(team_data, quest_status_table):
 
-    # Get the item's current version
-    current_version = team_data["version"]
+# Turns a QUEST_TEAM_STATUS_TABLE item into the team data used by the lambdas, with one boolean per task flag.
+# Items created before the 'completed-tasks' set existed store the flags as booleans, both are honoured. The set read
+# is kept as is, update_team_data conditions leaving the pending checks index on its size
+def load_team_data(item):
+    team_data = dict(item)
+    completed_tasks = team_data.get(COMPLETED_TASKS_KEY, set())
+    for flag in TASK_FLAGS:
+        team_data[flag] = flag in completed_tasks or team_data.get(flag) is True
+    return team_data
 
-    # Increase the version number
-    team_data["version"] += 1
 
-    # Try updating the item, but only if it hasn't been updated by another function. Some possible scenarios:
-    # 1. Race condition between CHECK_TEAM_LAMBDA and UPDATE_LAMBDA with the former going first
-    # 2. Race condition between CHECK_TEAM_LAMBDA and UPDATE_LAMBDA with the latter going first
-    # 3. Race condition between two executions of UPDATE_LAMBDA due to rapid button clicks
+# Writes the changes between original_team_data (as returned by load_team_data) and team_data with a single UpdateItem:
+# changed attributes are SET, dropped ones REMOVEd and newly completed tasks ADDed to the 'completed-tasks' set.
+# Returns the task flags this call completed, i.e. excluding those a concurrent function completed first
+def update_team_data(original_team_data, team_data, quest_status_table):
+    set_values = {}
+    remove_keys = []
+    added_tasks = set()
+    for key, value in team_data.items():
+        if key in TASK_FLAGS:
+            if value and not original_team_data.get(key):
+                added_tasks.add(key)
+        elif key not in OWNED_KEYS and (key not in original_team_data or original_team_data[key] != value):
+            set_values[key] = value
+    for key in original_team_data:
+        if key not in team_data and key not in TASK_FLAGS and key not in OWNED_KEYS:
+            remove_keys.append(key)
+
+    if not set_values and not remove_keys and not added_tasks:
+        return set()
+
+    # Leaving the pending checks index (see schedule_utils.sync_pending_checks) is decided on the completed tasks that
+    # were read. If a concurrent function completed another task since, the team may need a check after all: keep it.
+    # Only the members of the set are counted, the tasks a legacy item stores as booleans aren't in it
+    condition = None
+    if 'pending-quest-id' in remove_keys and not team_data[QUEST_COMPLETED_KEY]:
+        completed_count = len(original_team_data.get(COMPLETED_TASKS_KEY, set()))
+        condition = "size(#completed_tasks) = :completed_count" if completed_count else "attribute_not_exists(#completed_tasks)"
+        try:
+            old_attributes = _update_item(quest_status_table, team_data['team-id'], set_values, remove_keys,
+                                          added_tasks, condition, completed_count)
+        except ClientError as err:
+            if err.response["Error"]["Code"] != 'ConditionalCheckFailedException':
+                raise err
+            print(f"Team {team_data['team-id']} completed a task concurrently, keeping it in the pending checks index")
+            remove_keys.remove('pending-quest-id')
+            if not set_values and not remove_keys and not added_tasks:
+                return set()
+            old_attributes = _update_item(quest_status_table, team_data['team-id'], set_values, remove_keys, added_tasks)
+    else:
+        old_attributes = _update_item(quest_status_table, team_data['team-id'], set_values, remove_keys, added_tasks)
+
+    completed_tasks = added_tasks - old_attributes.get(COMPLETED_TASKS_KEY, set())
+    print(f"Persisted team data back to the quest team status table for team {team_data['team-id']}: " +
+          f"set={json.dumps(set_values, default=str)}, removed={remove_keys}, completed={sorted(completed_tasks)}")
+    return completed_tasks
+
+
+def _update_item(quest_status_table, team_id, set_values, remove_keys, added_tasks, condition=None, completed_count=0):
+    names = {}
+    values = {}
+    clauses = []
+    if set_values:
+        assignments = []
+        for index, (key, value) in enumerate(set_values.items()):
+            names[f"#s{index}"] = key
+            values[f":s{index}"] = value
+            if key.endswith(DETECTION_SECONDS_SUFFIX):
+                assignments.append(f"#s{index} = if_not_exists(#s{index}, :s{index})")
+            else:
+                assignments.append(f"#s{index} = :s{index}")
+        clauses.append("SET " + ", ".join(assignments))
+    if remove_keys:
+        for index, key in enumerate(remove_keys):
+            names[f"#r{index}"] = key
+        clauses.append("REMOVE " + ", ".join(f"#r{index}" for index in range(len(remove_keys))))
+    if added_tasks:
+        values[':added_tasks'] = added_tasks
+        clauses.append("ADD #completed_tasks :added_tasks")
+    if added_tasks or condition:
+        names["#completed_tasks"] = COMPLETED_TASKS_KEY
+
+    update_args = {
+        'Key': {'team-id': team_id},
+        'UpdateExpression': " ".join(clauses),
+        'ExpressionAttributeNames': names,
+        'ReturnValues': 'ALL_OLD'
+    }
+    if condition:
+        update_args['ConditionExpression'] = condition
+        if completed_count:
+            values[':completed_count'] = completed_count
+    if values:
+        update_args['ExpressionAttributeValues'] = values
+    return quest_status_table.update_item(**update_args).get('Attributes', {})
+
+
+# Marks the quest completed for the team, and takes it out of the pending checks index. Only one function wins the
+# transition, so the completion is awarded once even if several of them find every task done at the same time.
+# Returns whether this call completed the quest
+def claim_quest_completion(team_id, quest_status_table):
+    try:
+        quest_status_table.update_item(
+            Key={'team-id': team_id},
+            UpdateExpression="SET #quest_completed = :true REMOVE #pending_quest_id",
+            ConditionExpression="attribute_not_exists(#quest_completed) OR #quest_completed = :false",
+            ExpressionAttributeNames={
+                '#quest_completed': QUEST_COMPLETED_KEY,
+                '#pending_quest_id': 'pending-quest-id'
+            },
+            ExpressionAttributeValues={':true': True, ':false': False}
+        )
+    except ClientError as err:
+        if err.response["Error"]["Code"] == 'ConditionalCheckFailedException':
+            print(f"Quest was already completed for team {team_id}")
+            return False
+        raise err
+    print(f"Claimed quest completion for team {team_id}")
+    return True
+
+
+# Gives an item created before the adaptive check schedule existed its schedule attributes (see schedule_utils.py),
+# pending-quest-id included when the team needs checks. An item scheduled in the meantime is left as it is.
+# Returns whether the item was updated
+def backfill_schedule(team_id, schedule, quest_status_table):
+    names = {'#next_check_at': 'next-check-at'}
+    values = {}
+    assignments = []
+    for index, (key, value) in enumerate(schedule.items()):
+        names[f"#s{index}"] = key
+        values[f":s{index}"] = value
+        assignments.append(f"#s{index} = :s{index}")
+    try:
+        quest_status_table.update_item(
+            Key={'team-id': team_id},
+            UpdateExpression="SET " + ", ".join(assignments),
+            ConditionExpression="attribute_exists(#team_id) AND attribute_not_exists(#next_check_at)",
+            ExpressionAttributeNames=dict(names, **{'#team_id': 'team-id'}),
+            ExpressionAttributeValues=values
+        )
+    except ClientError as err:
+        if err.response["Error"]["Code"] == 'ConditionalCheckFailedException':
+            return False
+        raise err
+    print(f"Backfilled the check schedule of team {team_id}: {json.dumps(schedule, default=str)}")
+    return True
+
+
+# Gives an item created before init_lambda stored the team's metadata (see metadata_utils.py) the looked up attributes.
+# Attributes stored in the meantime are left as they are. Returns whether the item was updated
+def backfill_team_metadata(team_id, metadata, quest_status_table):
+    names = {}
+    values = {}
+    assignments = []
+    for index, (key, value) in enumerate(metadata.items()):
+        names[f"#m{index}"] = key
+        values[f":m{index}"] = value
+        assignments.append(f"#m{index} = if_not_exists(#m{index}, :m{index})")
     try:
-        print(f"Storing team data back to DynamoDb: {json.dumps(team_data, default=str)}")
-        dynamodb_response = quest_status_table.put_item(
-            Item=team_data,
-            ConditionExpression=Attr("version").eq(current_version)
+        quest_status_table.update_item(
+            Key={'team-id': team_id},
+            UpdateExpression="SET " + ", ".join(assignments),
+            ConditionExpression="attribute_exists(#team_id)",
+            ExpressionAttributeNames=dict(names, **{'#team_id': 'team-id'}),
+            ExpressionAttributeValues=values
         )
     except ClientError as err:
         if err.response["Error"]["Code"] == 'ConditionalCheckFailedException':
-            raise ValueError("The item was updated by another function since this function started. Check with the developer whether it is safe to ignore this error (the quest is not left in an inconsistent state for the team)") from err
-        else:
-            raise err
-    print(f"Persisted team data back to the quest team status table: {json.dumps(dynamodb_response)}")
\ No newline at end of file
+            return False
+        raise err
+    print(f"Backfilled the metadata of team {team_id}: {json.dumps(metadata, default=str)}")
+    return True
+
+
+# Takes a task completed by update_team_data back out of the 'completed-tasks' set, when its points could not be
+# awarded. The team is put back in the pending checks index, the next check finds the task complete again and awards it
+def release_completed_task(team_id, quest_id, task_flag, quest_status_table):
+    quest_status_table.update_item(
+        Key={'team-id': team_id},
+        UpdateExpression="SET #pending_quest_id = :quest_id DELETE #completed_tasks :task",
+        ExpressionAttributeNames={
+            '#completed_tasks': COMPLETED_TASKS_KEY,
+            '#pending_quest_id': 'pending-quest-id'
+        },
+        ExpressionAttributeValues={':task': {task_flag}, ':quest_id': quest_id}
+    )
+    print(f"Released task {task_flag} of team {team_id}")
+
+
+# Reverts claim_quest_completion when completing the quest failed, and puts the team back in the pending checks index
+# so that the next check completes it
+def release_quest_completion(team_id, quest_id, quest_status_table):
+    quest_status_table.update_item(
+        Key={'team-id': team_id},
+        UpdateExpression="SET #quest_completed = :false, #pending_quest_id = :quest_id",
+        ExpressionAttributeNames={
+            '#quest_completed': QUEST_COMPLETED_KEY,
+            '#pending_quest_id': 'pending-quest-id'
+        },
+        ExpressionAttributeValues={':false': False, ':quest_id': quest_id}
+    )
+    print(f"Released quest completion for team {team_id}")
+
+
+# Records a step of the quest completion (points, bonus, completion) as done in the 'quest-awards' set of the team item
+def record_quest_award(team_id, step, quest_status_table):
+    quest_status_table.update_item(
+        Key={'team-id': team_id},
+        UpdateExpression="ADD #quest_awards :step",
+        ExpressionAttributeNames={'#quest_awards': QUEST_AWARDS_KEY},
+        ExpressionAttributeValues={':step': {step}}
+    )
+
+
+# Records the dashboard entries published and deleted by dashboard_utils.sync_dashboard in the 'dashboard-state' map of
+# the team item, and in team_data. Entries are set and removed one by one, so concurrent syncs of the same team never
+# drop each other's entries
+def update_dashboard_state(team_data, published, deleted, quest_status_table):
+    if not published and not deleted:
+        return
+    names = {'#dashboard_state': DASHBOARD_STATE_KEY}
+    values = {}
+    if DASHBOARD_STATE_KEY not in team_data:
+        # Item created before the dashboard state existed, there is no map to set entries in yet
+        update_expression = "SET #dashboard_state = :dashboard_state"
+        values[':dashboard_state'] = published
+    else:
+        clauses = []
+        if published:
+            assignments = []
+            for index, (entry_id, digest) in enumerate(published.items()):
+                names[f"#p{index}"] = entry_id
+                values[f":p{index}"] = digest
+                assignments.append(f"#dashboard_state.#p{index} = :p{index}")
+            clauses.append("SET " + ", ".join(assignments))
+        if deleted:
+            for index, entry_id in enumerate(deleted):
+                names[f"#d{index}"] = entry_id
+            clauses.append("REMOVE " + ", ".join(f"#dashboard_state.#d{index}" for index in range(len(deleted))))
+        update_expression = " ".join(clauses)
+
+    update_args = {
+        'Key': {'team-id': team_data['team-id']},
+        'UpdateExpression': update_expression,
+        'ExpressionAttributeNames': names
+    }
+    if values:
+        update_args['ExpressionAttributeValues'] = values
+    quest_status_table.update_item(**update_args)
+
+    dashboard_state = dict(team_data.get(DASHBOARD_STATE_KEY, {}))
+    dashboard_state.update(published)
+    for entry_id in deleted:
+        dashboard_state.pop(entry_id, None)
+    team_data[DASHBOARD_STATE_KEY] = dashboard_state
+    print(f"Persisted dashboard state of team {team_data['team-id']}: published={sorted(published)}, deleted={deleted}")
@@ -0,0 +1,88 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import datetime
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+import dynamodb_utils
+import metrics_utils
+import trace_utils
+
+
+# Runs independent task evaluators concurrently in a bounded thread pool. Each evaluator gets its own copy of team_data,
+# so evaluators never see each other's in-flight changes, and the changes are merged back in the order of the
+# evaluators list once all of them are done. That keeps the outcome the same as running them one after another.
+# :param evaluators: functions with the signature evaluator(quests_api_client, team_data, *evaluator_args) -> team_data
+# :param max_workers: upper bound of evaluators running at the same time
+# :param evaluator_args: additional arguments shared by all evaluators, e.g. the team's distribution snapshot
+# :returns: the merged team_data and a list of (evaluator name, exception) for the evaluators that failed
+def run_evaluators(evaluators, quests_api_client, team_data, max_workers, *evaluator_args):
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(evaluators)))) as executor:
+        futures = [executor.submit(trace_utils.bind(evaluator), quests_api_client, team_data.copy(), *evaluator_args)
+                   for evaluator in evaluators]
+
+    merged_team_data = team_data.copy()
+    changed_by = {}
+    errors = []
+    for evaluator, future in zip(evaluators, futures):
+        try:
+            evaluated_team_data = future.result()
+        except Exception as err:
+            # Changes of a failed evaluator are discarded, the task is evaluated again on the next run
+            print(f"Evaluator {evaluator.__name__} failed for team {team_data['team-id']}: {err}")
+            errors.append((evaluator.__name__, err))
+            continue
+
+        for key, value in evaluated_team_data.items():
+            if key in team_data and team_data[key] == value:
+                continue
+            if key in changed_by and merged_team_data[key] != value:
+                print(f"Evaluators {changed_by[key]} and {evaluator.__name__} both changed '{key}', " +
+                      f"keeping the value of {evaluator.__name__}")
+            merged_team_data[key] = value
+            changed_by[key] = evaluator.__name__
+
+    return merged_team_data, errors
+
+
+# Short, stable digest of an inventory of resources, e.g. the (Id, LockToken) pairs of the WAF IP sets of a team.
+# Stored on the team item to detect whether anything changed since the last evaluation
+def compute_digest(values):
+    serialized = json.dumps(sorted(values), default=str, separators=(',', ':'))
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()[:32]
+
+
+# An evaluator stores the change marker (ETag or digest) it last evaluated in team_data[marker_key] when the task
+# was not complete. As evaluations are deterministic, an unchanged marker means the task is still not complete.
+def is_unchanged(team_data, marker_key, marker):
+    if team_data.get(marker_key) == marker:
+        print(f"No changes to '{marker_key}' since the last evaluation for team {team_data['team-id']}, skipping")
+        return True
+    return False
+
+
+# Records how long it took to detect the team's change that completed a task: stored in team_data as
+# '<task>-detection-seconds' and added to the '<task>.DetectionLatency' metric of the invocation. Called by the evaluator
+# that found the task complete, before the completion is persisted and awarded. update_team_data only writes the
+# attribute if it doesn't exist yet, so a concurrent check or a retry after a failed award keeps the first detection.
+# A failure to get the change time is only logged: failing the evaluator would discard the completion
+# :param get_change_time: returns when the team made the change, as a datetime or an epoch, None if unknown
+# :param change_source: where the change time comes from, for the log line
+# :param now: when the task was detected
+def record_detection_latency(team_data, task, get_change_time, change_source, now):
+    try:
+        change_time = get_change_time()
+    except Exception as err:
+        print(f"Could not get the change time of {task} for team {team_data['team-id']}: {err}")
+        return
+    if change_time is None:
+        print(f"Unknown change time of {task} for team {team_data['team-id']}, no detection latency recorded")
+        return
+    if isinstance(change_time, datetime.datetime):
+        change_time = change_time.timestamp()
+    # The change time comes from the clock of the service, which may be slightly ahead
+    detection_seconds = max(0, int(now - float(change_time)))
+    team_data[f"{task}{dynamodb_utils.DETECTION_SECONDS_SUFFIX}"] = detection_seconds
+    metrics_utils.record_value(f"{task}.DetectionLatency", detection_seconds, 'Seconds')
+    print(f"Task detected: team={team_data['team-id']}, task={task}, change_source={change_source}, " +
+          f"detection_s={detection_seconds}")
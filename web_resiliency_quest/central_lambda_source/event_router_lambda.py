@@ -0,0 +1,104 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import os
+import json
+import time
+from boto3.dynamodb.conditions import Key
+import client_utils
+import quest_const
+import metrics_utils
+import quests_api_utils
+import check_team_lambda
+import trace_utils
+
+# Standard AWS GameDay Quests Environment Variables
+QUEST_ID = os.environ['QUEST_ID']
+QUEST_API_BASE = os.environ['QUEST_API_BASE']
+QUEST_API_TOKEN = os.environ['QUEST_API_TOKEN']
+GAMEDAY_REGION = os.environ['GAMEDAY_REGION']
+
+# Quest Environment Variables
+QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
+
+# Evaluators of check_team_lambda affected by each CloudTrail management event forwarded by the team accounts.
+# Keep in sync with the ApiActivityForwardingRule event pattern of team_enable_cfn.yaml
+EVENT_EVALUATORS = {
+    # The distribution config holds the origin (Task 2), the logging config (Task 3) and the WebACL (Task 5)
+    'UpdateDistribution': [
+        check_team_lambda.attach_cloudfront_origin,
+        check_team_lambda.evaluate_cloudfront_logging,
+        check_team_lambda.evaluate_cloudfront_waf
+    ],
+    'CreateIPSet': [check_team_lambda.evaluate_cloudfront_waf],
+    'UpdateIPSet': [check_team_lambda.evaluate_cloudfront_waf],
+    'CreateWebACL': [check_team_lambda.evaluate_cloudfront_waf],
+    'UpdateWebACL': [check_team_lambda.evaluate_cloudfront_waf],
+    'PutMetricAlarm': [check_team_lambda.evaluate_cloudwatch_alarm]
+}
+
+
+# This function is triggered by the EventRuleApiActivity rule of the quest event bus, to which the team accounts forward
+# the CloudTrail management events of the resources the tasks are about. It runs only the evaluators affected by the
+# event, so that task completion is detected as soon as the team acts. CronLambda keeps reconciling every minute, in
+# case an event is lost or delayed.
+# Expected event payload: an "AWS API Call via CloudTrail" EventBridge event, see sample_events/
+@metrics_utils.account_api_calls('event_router_lambda')
+@trace_utils.trace_invocation('event_router_lambda')
+def lambda_handler(event, context):
+    print(f"event_router_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
+    route_start = time.time()
+
+    evaluators = get_event_evaluators(event)
+    if not evaluators:
+        print(f"No evaluator affected by event {event.get('detail', {}).get('eventName')}, ignoring it")
+        return
+
+    # A failed API call didn't change anything in the team account
+    if event['detail'].get('errorCode'):
+        print(f"Event {event['detail']['eventName']} failed with {event['detail']['errorCode']}, ignoring it")
+        return
+
+    team_id = get_team_id_for_account(event['account'])
+    if team_id is None:
+        print(f"No team found for AWS account {event['account']}, ignoring the event")
+        return
+
+    # The Quest API Client of this container: pooled connections and cached reads, see quests_api_utils.py
+    quests_api_client = quests_api_utils.get_quests_api_client(QUEST_API_BASE, QUEST_API_TOKEN)
+
+    # Check if event is running
+    event_status = quests_api_client.get_event_status()
+    if event_status['status'] != quest_const.EVENT_IN_PROGRESS:
+        print(f"Event Status: {event_status}, aborting EVENT_ROUTER_LAMBDA")
+        return
+
+    # Check if quest is active for the team
+    quest_status = quests_api_client.get_quest_for_team(team_id=team_id, quest_id=QUEST_ID)
+    if quest_status['quest-state'] != quest_const.TEAM_QUEST_IN_PROGRESS:
+        print(f"Quest Status: {quest_status['quest-state']}, aborting EVENT_ROUTER_LAMBDA")
+        return
+
+    check_team_lambda.check_team(
+        quests_api_client, {'team-id': team_id}, client_utils.get_table(QUEST_TEAM_STATUS_TABLE), evaluators)
+
+    # Time from the API call in the team account to the end of its evaluation
+    print(f"Routed event {event['detail']['eventName']} of team {team_id} to " +
+          f"{[evaluator.__name__ for evaluator in evaluators]}, route_ms={int((time.time() - route_start) * 1000)}, " +
+          f"event_time={event['detail'].get('eventTime')}")
+
+
+# Returns the evaluators affected by a forwarded CloudTrail event, or an empty list for any other event
+def get_event_evaluators(event):
+    if event.get('detail-type') != 'AWS API Call via CloudTrail':
+        return []
+    return EVENT_EVALUATORS.get(event['detail'].get('eventName'), [])
+
+
+# Looks the team up by the AWS account ID stored by init_lambda
+def get_team_id_for_account(aws_account_id):
+    dynamodb_response = client_utils.get_table(QUEST_TEAM_STATUS_TABLE).query(
+        IndexName=quest_const.TEAM_ACCOUNT_INDEX,
+        KeyConditionExpression=Key('aws-account-id').eq(aws_account_id)
+    )
+    items = dynamodb_response['Items']
+    return items[0]['team-id'] if items else None
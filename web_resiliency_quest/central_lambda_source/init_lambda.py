@@ -1,264 +1,116 @@
 # Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
 import os
-import boto3
+import time
+import client_utils
 import json
 import datetime
-import input_const
-import output_const
-import hint_const
 import cfn_utils
-import ui_utils
-from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+import dashboard_utils
+import dynamodb_utils
+import metadata_utils
+import schedule_utils
+from botocore.exceptions import ClientError
+import metrics_utils
+import quests_api_utils
+import trace_utils
 
 # Standard AWS GameDay Quests Environment Variables
 QUEST_ID = os.environ['QUEST_ID']
 QUEST_API_BASE = os.environ['QUEST_API_BASE']
 QUEST_API_TOKEN = os.environ['QUEST_API_TOKEN']
 GAMEDAY_REGION = os.environ['GAMEDAY_REGION']
-ASSETS_BUCKET = os.environ['ASSETS_BUCKET']
-ASSETS_BUCKET_PREFIX = os.environ['ASSETS_BUCKET_PREFIX']
 
 # Quest Environment Variables
 QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
 
-# Dynamo DB resource
-dynamodb = boto3.resource('dynamodb')
-quest_team_status_table = dynamodb.Table(QUEST_TEAM_STATUS_TABLE)
-
 # This function is triggered by sns_lambda.py. It performs Quest initialization actions for a given team, such as 
 # adding the team to a DynamoDB table tracking internal progress, or posting a welcome message to the team’s event UI.
-# Expected event parameters: {'team_id': team_id}
+# Expected event parameters: {'team_id': team_id, 'sns-publish-time': epoch, 'dispatch-mode': mode}
+# (the last two are set by sns_lambda.py, to report the time until the team sees the outcome)
+@metrics_utils.account_api_calls('init_lambda')
+@trace_utils.trace_invocation('init_lambda')
 def lambda_handler(event, context):
     print(f"Quest {QUEST_ID} INIT_LAMBDA invocation, event={json.dumps(event, default=str)}, context={str(context)}")
+    init_start = time.time()
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    # The Quest API Client of this container: pooled connections and cached reads, see quests_api_utils.py
+    quests_api_client = quests_api_utils.get_quests_api_client(QUEST_API_BASE, QUEST_API_TOKEN)
 
     # Get the team_id from the previous event sent by the Lambda that called this function (sns_lambda)
     team_id = event['team_id']
 
-    # Get team data for this quest
-    team_data = quests_api_client.get_team(team_id=team_id)
-
-    # Retrieve CloudFormation stack outputs
-    # ip_address = cfn_utils.retrieve_team_template_output_value(quests_api_client, QUEST_ID, team_data, "EC2IPAddress")
-    # security_group = cfn_utils.retrieve_team_template_output_value(quests_api_client, QUEST_ID, team_data, "SecurityGroup")
-    # accesskey_value = cfn_utils.retrieve_team_template_output_value(quests_api_client, QUEST_ID, team_data, "UserAccessKeyName")
-    cloudfront_distribution_id = cfn_utils.retrieve_team_template_output_value(quests_api_client, QUEST_ID, team_data, "CloudFrontID")
-    elb_dns_name = cfn_utils.retrieve_team_template_output_value(quests_api_client, QUEST_ID, team_data, "ElasticLoadBalancerDNSname")
-    waf_acl_id = cfn_utils.retrieve_team_template_output_value(quests_api_client, QUEST_ID, team_data, "WAFWebACLID")
-
-
-    # Populate the QUEST_TEAM_STATUS_TABLE for this team
-    dynamo_put_response = quest_team_status_table.put_item(
-        Item={
-            'team-id': str(team_id),
-            'quest-start-time': int(datetime.datetime.now().timestamp()),
-            'cloudfront-distribution-id': cloudfront_distribution_id,
-            'elb-dns-name': elb_dns_name,
-            'waf_acl_id': waf_acl_id,
-            'is-identified-origin': False,
-            'is-attach-cloudfront-origin-done': False,
-            'is-cloudfront-logs-enabled': False,
-            'is-answer-to-ip-address-correct': False,
-            'is-cloudfront-ip-set-created': False,
-            'is-cloudfront-waf-attached': False,
-            'is-cloudwatch-alarm-created': False,
-            'quest-completed': False,
-            'version': 0 # This is for optimistic locking
-        }
-    )
+    # A retried or repeated init finds the team already created, and only publishes what's missing from its dashboard.
+    # The table resource is the thread's own, sqs_lambda.py runs inits of several teams in worker threads
+    quest_team_status_table = client_utils.get_thread_table(QUEST_TEAM_STATUS_TABLE)
+    dynamodb_response = quest_team_status_table.get_item(Key={'team-id': str(team_id)})
+    if 'Item' in dynamodb_response:
+        print(f"Team {team_id} already exists in {QUEST_TEAM_STATUS_TABLE}, syncing its dashboard")
+        item = dynamodb_response['Item']
+    else:
+        item = create_team(quests_api_client, team_id, quest_team_status_table)
+
+    # Post welcome message and Tasks 1-6 to the team, see dashboard_utils.DASHBOARD_MANIFEST
+    team_data = dynamodb_utils.load_team_data(item)
+    dashboard_errors = dashboard_utils.sync_dashboard(quests_api_client, team_data, quest_team_status_table)
+    init_message = f"Initialized team {team_id}: init_ms={int((time.time() - init_start) * 1000)}"
+    if 'sns-publish-time' in event:
+        # Time from the SNS notification of the quest start to the dashboard being shown to the team
+        init_message += f", dispatch={event.get('dispatch-mode')}, " + \
+                        f"feedback_ms={int((time.time() - float(event['sns-publish-time'])) * 1000)}, " + \
+                        f"trace_id={trace_utils.get_trace_id()}"
+    print(init_message)
+    if dashboard_errors:
+        raise RuntimeError(f"Dashboard writes failed for team {team_id}: {dashboard_errors}")
+
+
+# Populates the QUEST_TEAM_STATUS_TABLE for the team, and returns the item
+def create_team(quests_api_client, team_id, quest_team_status_table):
+
+    # Retrieve CloudFormation stack outputs, all of them at once. They are stored in the team item, so later handlers
+    # never fetch them again
+    stack_outputs = cfn_utils.retrieve_team_template_outputs(quests_api_client, QUEST_ID, str(team_id))
+    cloudfront_distribution_id = stack_outputs.get("CloudFrontID", "ERROR")
+    elb_dns_name = stack_outputs.get("ElasticLoadBalancerDNSname", "ERROR")
+    waf_acl_id = stack_outputs.get("WAFWebACLID", "ERROR")
+
+    # The team's AWS account ID lets event_router_lambda map the API activity forwarded by the team account to the team.
+    # The CloudFront Distribution url is shown in the dashboard. Both are outputs of the team template, team stacks
+    # deployed before those outputs existed are looked up through the team's Ops role
+    aws_account_id = stack_outputs.get("AWSAccountId")
+    cfDomainName = stack_outputs.get("CloudFrontDomainName")
+    if aws_account_id is None or cfDomainName is None:
+        metadata = metadata_utils.lookup_team_metadata(quests_api_client, str(team_id), cloudfront_distribution_id,
+                                                       metadata_utils.TEAM_METADATA_KEYS)
+        aws_account_id = metadata[metadata_utils.AWS_ACCOUNT_ID_KEY]
+        cfDomainName = metadata[metadata_utils.CLOUDFRONT_DOMAIN_NAME_KEY]
+
+    item = {
+        'team-id': str(team_id),
+        'quest-start-time': int(datetime.datetime.now().timestamp()),
+        'aws-account-id': aws_account_id,
+        'cloudfront-distribution-id': cloudfront_distribution_id,
+        'cloudfront-domain-name': cfDomainName,
+        'elb-dns-name': elb_dns_name,
+        'waf_acl_id': waf_acl_id,
+        # Completed tasks are added to the 'completed-tasks' string set as they are verified, see dynamodb_utils.py
+        'quest-completed': False,
+        'next-check-at': int(datetime.datetime.now().timestamp()), # See schedule_utils.py
+        'activity-score': schedule_utils.ACTIVITY_SCORE_MAX,
+        'pending-quest-id': QUEST_ID,
+        'dashboard-state': {} # Digests of the published dashboard entries, see dashboard_utils.sync_dashboard
+    }
+    try:
+        # Two concurrent inits of the same team (e.g. a duplicate SNS delivery) create it only once
+        dynamo_put_response = quest_team_status_table.put_item(
+            Item=item,
+            ConditionExpression="attribute_not_exists(#team_id)",
+            ExpressionAttributeNames={'#team_id': 'team-id'}
+        )
+    except ClientError as err:
+        if err.response["Error"]["Code"] != 'ConditionalCheckFailedException':
+            raise err
+        print(f"Team {team_id} was created concurrently in {QUEST_TEAM_STATUS_TABLE}")
+        return quest_team_status_table.get_item(Key={'team-id': str(team_id)})['Item']
     print(f"Created team {team_id} in {QUEST_TEAM_STATUS_TABLE}. Response: {json.dumps(dynamo_put_response, default=str)}")
-
-    # Get CloudFront Distribution url
-    xa_session = quests_api_client.assume_team_ops_role(str(team_id))
-    cloudfront_client = xa_session.client('cloudfront')
-    cloudfront_response = cloudfront_client.get_distribution(Id=cloudfront_distribution_id)
-    cfDomainName = cloudfront_response['Distribution']['DomainName']
-
-    # Post welcome message to the team
-    image_url_welcome_1 = ui_utils.generate_signed_or_open_url(ASSETS_BUCKET, f"{ASSETS_BUCKET_PREFIX}robot_queue_image.png",signed_duration=86400)
-
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.WELCOME_1_KEY,
-        label=output_const.WELCOME_1_LABEL,
-        value=output_const.WELCOME_1_VALUE.format(image_url_welcome_1),
-        dashboard_index=output_const.WELCOME_1_INDEX,
-        markdown=output_const.WELCOME_1_MARKDOWN,
-    )
-
-    image_url_welcome_2 = ui_utils.generate_signed_or_open_url(ASSETS_BUCKET, f"{ASSETS_BUCKET_PREFIX}architecture_task0.png",signed_duration=86400)
-
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.WELCOME_2_KEY,
-        label=output_const.WELCOME_2_LABEL,
-        value=output_const.WELCOME_2_VALUE.format(image_url_welcome_2),
-        dashboard_index=output_const.WELCOME_2_INDEX,
-        markdown=output_const.WELCOME_2_MARKDOWN,
-    )
-
-    # TASK 1
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.TASK1_KEY,
-        label=output_const.TASK1_LABEL,
-        value=output_const.TASK1_VALUE.format(cfDomainName, cfDomainName),
-        dashboard_index=output_const.TASK1_INDEX,
-        markdown=output_const.TASK1_MARKDOWN,
-    )
-
-    quests_api_client.post_input(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        key=input_const.TASK1_ORIGIN_KEY,
-        label=input_const.TASK1_ORIGIN_LABEL,
-        description=input_const.TASK1_ORIGIN_DESCRIPTION,
-        dashboard_index=input_const.TASK1_ORIGIN_INDEX
-    )
-
-    quests_api_client.post_hint(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        hint_key=hint_const.TASK1_HINT1_KEY,
-        label=hint_const.TASK1_HINT1_LABEL,
-        description=hint_const.TASK1_HINT1_DESCRIPTION,
-        value=hint_const.TASK1_HINT1_VALUE,
-        dashboard_index=hint_const.TASK1_HINT1_INDEX,
-        cost=hint_const.TASK1_HINT1_COST,
-        status=hint_const.STATUS_OFFERED
-    )
-
-
-    # TASK 2
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.TASK2_KEY,
-        label=output_const.TASK2_LABEL,
-        value=output_const.TASK2_VALUE,
-        dashboard_index=output_const.TASK2_INDEX,
-        markdown=output_const.TASK2_MARKDOWN,
-    )
-
-    
-    quests_api_client.post_hint(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        hint_key=hint_const.TASK2_HINT1_KEY,
-        label=hint_const.TASK2_HINT1_LABEL,
-        description=hint_const.TASK2_HINT1_DESCRIPTION,
-        value=hint_const.TASK2_HINT1_VALUE,
-        dashboard_index=hint_const.TASK2_HINT1_INDEX,
-        cost=hint_const.TASK2_HINT1_COST,
-        status=hint_const.STATUS_OFFERED
-    )
-
-    # TASK 3
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.TASK3_KEY,
-        label=output_const.TASK3_LABEL,
-        value=output_const.TASK3_VALUE,
-        dashboard_index=output_const.TASK3_INDEX,
-        markdown=output_const.TASK3_MARKDOWN,
-    )
-    
-    quests_api_client.post_hint(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        hint_key=hint_const.TASK3_HINT1_KEY,
-        label=hint_const.TASK3_HINT1_LABEL,
-        description=hint_const.TASK3_HINT1_DESCRIPTION,
-        value=hint_const.TASK3_HINT1_VALUE,
-        dashboard_index=hint_const.TASK3_HINT1_INDEX,
-        cost=hint_const.TASK3_HINT1_COST,
-        status=hint_const.STATUS_OFFERED
-    )
-
-    # TASK 4
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.TASK4_KEY,
-        label=output_const.TASK4_LABEL,
-        value=output_const.TASK4_VALUE.format(cfDomainName, cfDomainName, cfDomainName, cfDomainName, cfDomainName, cfDomainName),
-        dashboard_index=output_const.TASK4_INDEX,
-        markdown=output_const.TASK4_MARKDOWN,
-    )
-    quests_api_client.post_input(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        key=input_const.TASK4_ENDPOINT_KEY,
-        label=input_const.TASK4_ENDPOINT_LABEL,
-        description=input_const.TASK4_ENDPOINT_DESCRIPTION,
-        dashboard_index=input_const.TASK4_ENDPOINT_INDEX
-    )
-
-    quests_api_client.post_hint(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        hint_key=hint_const.TASK4_HINT1_KEY,
-        label=hint_const.TASK4_HINT1_LABEL,
-        description=hint_const.TASK4_HINT1_DESCRIPTION,
-        value=hint_const.TASK4_HINT1_VALUE,
-        dashboard_index=hint_const.TASK4_HINT1_INDEX,
-        cost=hint_const.TASK4_HINT1_COST,
-        status=hint_const.STATUS_OFFERED
-    )
-
-    # TASK 5
-    image_url_task5 = ui_utils.generate_signed_or_open_url(ASSETS_BUCKET, f"{ASSETS_BUCKET_PREFIX}waf_console.png",signed_duration=86400)
-
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.TASK5_KEY,
-        label=output_const.TASK5_LABEL,
-        value=output_const.TASK5_VALUE.format(image_url_task5),
-        dashboard_index=output_const.TASK5_INDEX,
-        markdown=output_const.TASK5_MARKDOWN,
-    )
-    
-    quests_api_client.post_hint(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        hint_key=hint_const.TASK5_HINT1_KEY,
-        label=hint_const.TASK5_HINT1_LABEL,
-        description=hint_const.TASK5_HINT1_DESCRIPTION,
-        value=hint_const.TASK5_HINT1_VALUE,
-        dashboard_index=hint_const.TASK5_HINT1_INDEX,
-        cost=hint_const.TASK5_HINT1_COST,
-        status=hint_const.STATUS_OFFERED
-    )
-
-    # TASK 6
-    image_url_task6 = ui_utils.generate_signed_or_open_url(ASSETS_BUCKET, f"{ASSETS_BUCKET_PREFIX}cloudwatch_metrics.png",signed_duration=86400)
-
-    quests_api_client.post_output(
-        team_id=team_id,
-        quest_id=QUEST_ID,
-        key=output_const.TASK6_KEY,
-        label=output_const.TASK6_LABEL,
-        value=output_const.TASK6_VALUE.format(image_url_task6, cfDomainName, cfDomainName),
-        dashboard_index=output_const.TASK6_INDEX,
-        markdown=output_const.TASK6_MARKDOWN,
-    )
-
-    quests_api_client.post_hint(
-        team_id=team_data['team-id'],
-        quest_id=QUEST_ID,
-        hint_key=hint_const.TASK6_HINT1_KEY,
-        label=hint_const.TASK6_HINT1_LABEL,
-        description=hint_const.TASK6_HINT1_DESCRIPTION,
-        value=hint_const.TASK6_HINT1_VALUE,
-        dashboard_index=hint_const.TASK6_HINT1_INDEX,
-        cost=hint_const.TASK6_HINT1_COST,
-        status=hint_const.STATUS_OFFERED
-    )
+    return item
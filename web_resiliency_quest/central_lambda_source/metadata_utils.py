@@ -0,0 +1,39 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import dynamodb_utils
+import session_utils
+
+# Team item attributes stored by init_lambda.create_team since the team template outputs them. event_router_lambda maps
+# the team's API activity to the team by its AWS account ID, and the dashboard shows the CloudFront domain name
+AWS_ACCOUNT_ID_KEY = 'aws-account-id'
+CLOUDFRONT_DOMAIN_NAME_KEY = 'cloudfront-domain-name'
+TEAM_METADATA_KEYS = (AWS_ACCOUNT_ID_KEY, CLOUDFRONT_DOMAIN_NAME_KEY)
+
+
+# Looks the given team item attributes up in the team's AWS account, through the cached cross-account session. Also
+# used by init_lambda.create_team for team stacks deployed before the team template output them
+# :returns: {attribute: value}
+def lookup_team_metadata(quests_api_client, team_id, distribution_id, keys):
+    metadata = {}
+    if AWS_ACCOUNT_ID_KEY in keys:
+        sts_client = session_utils.get_team_client(quests_api_client, team_id, 'sts')
+        metadata[AWS_ACCOUNT_ID_KEY] = sts_client.get_caller_identity()['Account']
+    if CLOUDFRONT_DOMAIN_NAME_KEY in keys:
+        cloudfront_client = session_utils.get_team_client(quests_api_client, team_id, 'cloudfront')
+        cloudfront_response = cloudfront_client.get_distribution(Id=distribution_id)
+        metadata[CLOUDFRONT_DOMAIN_NAME_KEY] = cloudfront_response['Distribution']['DomainName']
+    return metadata
+
+
+# Items created before init_lambda stored the team's metadata lack it: it is looked up once and stored in the item
+# (and in team_data). Called by every dashboard sync, and for all the teams by the first cycle of every CronLambda
+# container. :returns: the attributes that were looked up
+def ensure_team_metadata(quests_api_client, team_data, quest_status_table, keys=TEAM_METADATA_KEYS):
+    missing_keys = [key for key in keys if key not in team_data]
+    if not missing_keys:
+        return []
+    metadata = lookup_team_metadata(quests_api_client, team_data['team-id'], team_data['cloudfront-distribution-id'],
+                                    missing_keys)
+    dynamodb_utils.backfill_team_metadata(team_data['team-id'], metadata, quest_status_table)
+    team_data.update(metadata)
+    return missing_keys
@@ -0,0 +1,183 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import functools
+import json
+import os
+import threading
+import time
+import trace_utils
+
+# CloudWatch namespace of the API call metrics
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'GameDayQuest/WebResiliency')
+# Error codes of the throttled calls, across the services the handlers call
+THROTTLING_ERROR_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException', 'RequestLimitExceeded',
+    'RequestThrottled', 'RequestThrottledException', 'ProvisionedThroughputExceededException', 'WAFLimitsExceededException'
+}
+# Name under which the Quests API calls are accounted, next to the AWS service names
+QUESTS_API_SERVICE = 'quests-api'
+# EMF limits: 100 values per metric and 100 metrics per metric directive
+EMF_MAX_VALUES = 100
+EMF_MAX_METRICS = 100
+
+# Calls and other measurements of the running invocation. A Lambda container runs one invocation at a time, the threads
+# of the invocation all account their calls here.
+# Format: {'handler': name, 'calls': {(service, operation): {stat: value}}, 'values': {metric: (unit, [value, ...])}}
+_invocation = None
+_invocation_lock = threading.Lock()
+
+
+# Decorator of the lambda_handler functions: accounts the API calls made during the invocation, and prints them as one
+# CloudWatch Embedded Metric Format record when it ends. A handler run by another one in the same invocation (e.g.
+# init_lambda by sns_lambda in IN_PROCESS dispatch mode) accounts its calls to the outer handler
+def account_api_calls(handler_name):
+    def decorator(lambda_handler):
+        @functools.wraps(lambda_handler)
+        def wrapper(event, context):
+            global _invocation
+            with _invocation_lock:
+                if _invocation is not None:
+                    outer_invocation = True
+                else:
+                    outer_invocation = False
+                    _invocation = {'handler': handler_name, 'calls': {}, 'values': {}}
+            if outer_invocation:
+                return lambda_handler(event, context)
+            try:
+                return lambda_handler(event, context)
+            finally:
+                with _invocation_lock:
+                    invocation, _invocation = _invocation, None
+                print(json.dumps(build_emf_record(invocation), separators=(',', ':')))
+        return wrapper
+    return decorator
+
+
+# Registers the accounting hooks on the events of a botocore client (or of a boto3 resource's client), returns it.
+# Hooks are per client, each client of the central or of a team account must be instrumented once it is created
+def instrument_client(client):
+    events = client.meta.events
+    events.register('before-call', _before_call, unique_id='metrics-utils-before-call')
+    events.register('response-received', _response_received, unique_id='metrics-utils-response-received')
+    events.register('after-call', _after_call, unique_id='metrics-utils-after-call')
+    events.register('after-call-error', _after_call_error, unique_id='metrics-utils-after-call-error')
+    return client
+
+
+# Accounts the calls of a GameDayQuestsApiClient. Methods keep the signature of the wrapped ones, which
+# quests_api_utils.CachingQuestsApiClient builds its cache keys from
+class AccountedQuestsApiClient:
+
+    def __init__(self, quests_api_client):
+        self.quests_api_client = quests_api_client
+
+    def __getattr__(self, name):
+        attribute = getattr(self.quests_api_client, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def accounted_call(*args, **kwargs):
+            start = time.perf_counter()
+            error = None
+            try:
+                return attribute(*args, **kwargs)
+            except Exception as err:
+                error = err
+                raise
+            finally:
+                status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+                record_call(QUESTS_API_SERVICE, name, (time.perf_counter() - start) * 1000,
+                            error=error is not None, throttles=int(status_code == 429))
+        return accounted_call
+
+
+# Accounts one API call of the running invocation, and records it as a span of the current trace. Calls made outside
+# of an accounted invocation are ignored
+def record_call(service, operation, latency_ms, error=False, throttles=0, retries=0):
+    trace_utils.record_span(f"{service}.{operation}", time.time() - latency_ms / 1000, latency_ms, error=error)
+    with _invocation_lock:
+        if _invocation is None:
+            return
+        stats = _invocation['calls'].setdefault((service, operation), {
+            'calls': 0, 'errors': 0, 'throttles': 0, 'retries': 0, 'latencies': []
+        })
+        stats['calls'] += 1
+        stats['errors'] += int(error)
+        stats['throttles'] += throttles
+        stats['retries'] += retries
+        if len(stats['latencies']) < EMF_MAX_VALUES:
+            stats['latencies'].append(round(latency_ms, 1))
+
+
+# Adds a value of a metric to the record of the running invocation, e.g. the detection latency of a task. The values of
+# the invocation are all exported, so that CloudWatch can compute percentiles over them
+def record_value(metric, value, unit):
+    with _invocation_lock:
+        if _invocation is None:
+            return
+        values = _invocation['values'].setdefault(metric, (unit, []))[1]
+        if len(values) < EMF_MAX_VALUES:
+            values.append(value)
+
+
+# The EMF record of an invocation: one metric per service, operation and statistic, e.g. 'wafv2.ListIPSets.Calls', and
+# the metrics of record_value, with the handler as dimension. Latency holds the latency of every call (up to EMF_MAX_VALUES), Errors, Throttles
+# and Retries are left out when they are 0 to keep the record small
+def build_emf_record(invocation):
+    record = {'Handler': invocation['handler']}
+    metrics = []
+    for (service, operation), stats in sorted(invocation['calls'].items()):
+        prefix = f"{service}.{operation}"
+        record[f"{prefix}.Calls"] = stats['calls']
+        metrics.append({'Name': f"{prefix}.Calls", 'Unit': 'Count'})
+        record[f"{prefix}.Latency"] = stats['latencies']
+        metrics.append({'Name': f"{prefix}.Latency", 'Unit': 'Milliseconds'})
+        for stat in ('errors', 'throttles', 'retries'):
+            if stats[stat]:
+                record[f"{prefix}.{stat.capitalize()}"] = stats[stat]
+                metrics.append({'Name': f"{prefix}.{stat.capitalize()}", 'Unit': 'Count'})
+    for metric, (unit, values) in sorted(invocation['values'].items()):
+        record[metric] = values
+        metrics.append({'Name': metric, 'Unit': unit})
+    record['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [
+            {'Namespace': METRICS_NAMESPACE, 'Dimensions': [['Handler']], 'Metrics': metrics[start:start + EMF_MAX_METRICS]}
+            for start in range(0, len(metrics), EMF_MAX_METRICS)
+        ]
+    }
+    return record
+
+
+# The botocore hooks share the context dict of the call: the attempts of a call all go to the same context
+def _before_call(model, context, **kwargs):
+    context['metrics-utils'] = {
+        'service': model.service_model.service_name,
+        'operation': model.name,
+        'start': time.perf_counter(),
+        'throttles': 0
+    }
+
+
+# Emitted for every attempt of the call, retries included
+def _response_received(context, parsed_response=None, **kwargs):
+    call = context.get('metrics-utils')
+    if call is not None and parsed_response and parsed_response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+        call['throttles'] += 1
+
+
+def _after_call(http_response, parsed, context, **kwargs):
+    call = context.get('metrics-utils')
+    if call is not None:
+        record_call(call['service'], call['operation'], (time.perf_counter() - call['start']) * 1000,
+                    error=http_response.status_code >= 300, throttles=call['throttles'],
+                    retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+
+# Emitted instead of after-call when no response was received, e.g. after a connection error
+def _after_call_error(context, **kwargs):
+    call = context.get('metrics-utils')
+    if call is not None:
+        record_call(call['service'], call['operation'], (time.perf_counter() - call['start']) * 1000,
+                    error=True, throttles=call['throttles'])
@@ -10,4 +10,32 @@ QUEST_DEPLOYING="gdQuests:QUEST_DEPLOYING"
 QUEST_INPUT_UPDATED="gdQuests:INPUT_UPDATED"
 
 # Team states
-TEAM_QUEST_IN_PROGRESS="IN_PROGRESS"
\ No newline at end of file
+TEAM_QUEST_IN_PROGRESS="IN_PROGRESS"
+
+# Task flags of the team data. Tasks 2, 3, 5 and 6 are verified by looking into the team's AWS account (see
+# check_team_lambda.py), tasks 1 and 4 are verified by update_lambda from the inputs
+AWS_TASK_FLAGS=[
+    'is-attach-cloudfront-origin-done',     # Task 2
+    'is-cloudfront-logs-enabled',           # Task 3
+    'is-cloudfront-ip-set-created',         # Task 5
+    'is-cloudfront-waf-attached',           # Task 5
+    'is-cloudwatch-alarm-created'           # Task 6
+]
+INPUT_TASK_FLAGS=[
+    'is-identified-origin',                 # Task 1
+    'is-answer-to-ip-address-correct'       # Task 4
+]
+
+# Check dispatch modes (see cron_lambda.py)
+CHECK_DISPATCH_TEAM="TEAM"
+CHECK_DISPATCH_BATCH="BATCH"
+
+# SNS dispatch modes (see sns_lambda.py)
+SNS_DISPATCH_INVOKE="INVOKE"
+SNS_DISPATCH_IN_PROCESS="IN_PROCESS"
+
+# Index of QUEST_TEAM_STATUS_TABLE by team AWS account (see event_router_lambda.py)
+TEAM_ACCOUNT_INDEX="aws-account-id-index"
+
+# Sparse index of QUEST_TEAM_STATUS_TABLE holding the teams with pending work, by next check time (see schedule_utils.py)
+PENDING_CHECKS_INDEX="pending-checks-index"
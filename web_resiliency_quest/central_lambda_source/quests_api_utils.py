@@ -0,0 +1,297 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import copy
+import inspect
+import os
+import sys
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+import metrics_utils
+
+# How long the result of each Quests API read is reused. The event status and quest state of a team change a few
+# times per event, so a handler may act on a status up to that many seconds old. get_team and the stack outputs of
+# get_quest_for_team don't change once the team started the quest
+QUESTS_API_CACHE_TTL_SECONDS = {
+    'get_event_status': int(os.environ.get('EVENT_STATUS_CACHE_TTL_SECONDS', '30')),
+    'get_quest_for_team': int(os.environ.get('QUEST_STATUS_CACHE_TTL_SECONDS', '30')),
+    'get_teams_for_quest': int(os.environ.get('QUEST_STATUS_CACHE_TTL_SECONDS', '30')),
+    'get_team': int(os.environ.get('TEAM_CACHE_TTL_SECONDS', '300'))
+}
+# Writes that only change the team's dashboard, which none of the cached reads return. Any other write of a team
+# (e.g. post_score_event) drops the cached reads of that team
+DASHBOARD_WRITES = ['post_output', 'post_input', 'post_hint', 'delete_output', 'delete_input', 'delete_hint']
+
+# Keep-alive connections to the Quests API kept open per container. Above PUBLISH_CONCURRENCY (dashboard_utils.py) and
+# CHECK_BATCH_CONCURRENCY (check_team_lambda.py) would only keep idle sockets open
+QUESTS_API_POOL_SIZE = int(os.environ.get('QUESTS_API_POOL_SIZE', '10'))
+# Connections idle for longer are dropped before the next call instead of being reused. Load balancers close idle
+# connections after 60 seconds by default, and a frozen Lambda container doesn't see it happen
+QUESTS_API_IDLE_TIMEOUT_SECONDS = float(os.environ.get('QUESTS_API_IDLE_TIMEOUT_SECONDS', '50'))
+# Retries of a call whose connection failed. urllib3 only retries calls that are safe to repeat (GET, PUT, DELETE, ...),
+# a POST such as post_score_event is never sent twice
+QUESTS_API_CONNECTION_RETRIES = int(os.environ.get('QUESTS_API_CONNECTION_RETRIES', '2'))
+
+# Cached reads, kept at module scope so that warm Lambda containers reuse them across invocations.
+# Format: {(method, ((argument, value), ...)): (result, expires-at epoch)}
+_cache = {}
+_cache_lock = threading.Lock()
+_cache_stats = {}
+
+
+# Quests API clients per (API base, token), see get_quests_api_client
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# Returns the Quests API client of this container: a CachingQuestsApiClient around a GameDayQuestsApiClient whose HTTP
+# calls go through the PooledTransport. Created on the first call and reused by every later invocation of the warm
+# container, so the TLS handshake with the Quests API is only paid when a connection is opened.
+# The client is shared by the handler's threads
+def get_quests_api_client(quest_api_base, quest_api_token):
+    with _clients_lock:
+        client = _clients.get((quest_api_base, quest_api_token))
+        if client is None:
+            _install_transport()
+            client = CachingQuestsApiClient(
+                metrics_utils.AccountedQuestsApiClient(GameDayQuestsApiClient(quest_api_base, quest_api_token)))
+            _clients[(quest_api_base, quest_api_token)] = client
+        return client
+
+
+# Stand-in for the requests module in the QDK: requests.get/post/... open a new connection, and a TLS handshake,
+# on every call, while this transport sends them over a pool of keep-alive connections. Everything else
+# (exceptions, status codes, ...) is the requests module's.
+# A connection the server closed while it sat in the pool is replaced: urllib3 checks pooled connections before using
+# them, calls that fail on a connection are retried on a new one when they are safe to repeat, and the pool is dropped
+# after a connection error or after QUESTS_API_IDLE_TIMEOUT_SECONDS without calls
+class PooledTransport:
+
+    def __init__(self, pool_size=QUESTS_API_POOL_SIZE, idle_timeout=QUESTS_API_IDLE_TIMEOUT_SECONDS,
+                 connection_retries=QUESTS_API_CONNECTION_RETRIES):
+        self.idle_timeout = idle_timeout
+        self.adapter = _CountingAdapter(self._count_connection, pool_connections=4, pool_maxsize=pool_size,
+                                        pool_block=False,
+                                        max_retries=Retry(total=connection_retries, connect=connection_retries,
+                                                          read=connection_retries, status=0, redirect=False,
+                                                          raise_on_status=False))
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.lock = threading.Lock()
+        self.last_used = None
+        self.stats = {'requests': 0, 'connections-opened': 0, 'idle-resets': 0, 'error-resets': 0}
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def request(self, method, url, **kwargs):
+        now = time.time()
+        with self.lock:
+            if self.last_used is not None and now - self.last_used > self.idle_timeout:
+                self.stats['idle-resets'] += 1
+                self._reset_pools()
+            self.last_used = now
+            self.stats['requests'] += 1
+        try:
+            return self.session.request(method, url, **kwargs)
+        except requests.exceptions.ConnectionError as err:
+            with self.lock:
+                self.stats['error-resets'] += 1
+                self._reset_pools()
+            raise err
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('PATCH', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    # Whether the calls go through the keep-alive pools of the adapter, whose pool classes are urllib3 internals
+    def is_pooled(self):
+        with self.lock:
+            adapter = self.session.get_adapter('https://localhost')
+            pool = adapter.poolmanager.connection_from_url('https://localhost')
+            pooled = adapter is self.adapter and pool.ConnectionCls.__name__ == 'CountingConnection'
+            self._reset_pools()
+        return pooled
+
+    # Calls sent, connections opened for them and the share of calls that reused an open connection
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['reuse-rate'] = round(1 - stats['connections-opened'] / stats['requests'], 3) if stats['requests'] else None
+        return stats
+
+    # Must be called while holding the lock
+    def _reset_pools(self):
+        self.adapter.poolmanager.clear()
+
+    def _count_connection(self):
+        with self.lock:
+            self.stats['connections-opened'] += 1
+
+
+# HTTPAdapter whose connection pools call on_connect for every connection they open, including the pooled connections
+# urllib3 reopens after finding them closed by the server
+class _CountingAdapter(HTTPAdapter):
+
+    def __init__(self, on_connect, **kwargs):
+        self.on_connect = on_connect
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self.on_connect),
+            'https': _counting_pool_class(HTTPSConnectionPool, self.on_connect)
+        }
+
+
+def _counting_pool_class(pool_class, on_connect):
+    class CountingConnection(pool_class.ConnectionCls):
+
+        def connect(self):
+            on_connect()
+            return super().connect()
+
+    return type(f"Counting{pool_class.__name__}", (pool_class,), {'ConnectionCls': CountingConnection})
+
+
+# The QDK falls back to the requests module functions, a new connection per call, whenever the pooled transport
+# can't be built or installed, see _install_transport
+try:
+    _transport = PooledTransport()
+except Exception as err:
+    print(f"Pooled Quests API transport unavailable, the QDK calls the requests module: {err}")
+    _transport = None
+_transport_installed = False
+
+
+# Connection reuse of the Quests API calls since the container started, see PooledTransport.get_stats. None when the
+# QDK calls the requests module
+def get_transport_stats():
+    return _transport.get_stats() if _transport_installed else None
+
+
+# The QDK sends its calls with the functions of the requests module it imported, they go through _transport instead.
+# Must be called while holding the clients lock. Checks that the swap took and that the transport pools its
+# connections, and otherwise leaves the QDK with the requests module
+def _install_transport():
+    global _transport_installed
+    if _transport_installed:
+        return
+    qdk_module = sys.modules[GameDayQuestsApiClient.__module__]
+    if _transport is None:
+        return
+    if getattr(qdk_module, 'requests', None) is requests:
+        qdk_module.requests = _transport
+    try:
+        _transport_installed = getattr(qdk_module, 'requests', None) is _transport and _transport.is_pooled()
+    except Exception as err:
+        print(f"Checking the pooled Quests API transport failed: {err}")
+    if not _transport_installed:
+        if getattr(qdk_module, 'requests', None) is _transport:
+            qdk_module.requests = requests
+        print(f"{GameDayQuestsApiClient.__module__} calls don't use the pooled transport, " +
+              "they open a connection each")
+
+
+# Read-through cache in front of a GameDayQuestsApiClient. Reads listed in QUESTS_API_CACHE_TTL_SECONDS are served
+# from the cache while fresh, everything else goes to the wrapped client.
+# Handlers get theirs from get_quests_api_client
+class CachingQuestsApiClient:
+
+    def __init__(self, quests_api_client):
+        self.quests_api_client = quests_api_client
+
+    def __getattr__(self, name):
+        attribute = getattr(self.quests_api_client, name)
+        if name in QUESTS_API_CACHE_TTL_SECONDS:
+            return lambda *args, **kwargs: self._read(name, attribute, args, kwargs)
+        if name.startswith(('post_', 'delete_', 'update_', 'put_')) and name not in DASHBOARD_WRITES:
+            return lambda *args, **kwargs: self._write(attribute, args, kwargs)
+        return attribute
+
+    def _read(self, name, method, args, kwargs):
+        key = (name, _get_arguments(method, args, kwargs))
+        now = time.time()
+        with _cache_lock:
+            cached = _cache.get(key)
+            if cached is not None and cached[1] > now:
+                _count(name, 'hits')
+                return copy.deepcopy(cached[0])
+            _count(name, 'misses')
+
+        result = method(*args, **kwargs)
+        with _cache_lock:
+            _cache[key] = (result, now + QUESTS_API_CACHE_TTL_SECONDS[name])
+        return copy.deepcopy(result)
+
+    def _write(self, method, args, kwargs):
+        result = method(*args, **kwargs)
+        team_id = dict(_get_arguments(method, args, kwargs)).get('team_id')
+        if team_id is not None:
+            invalidate(team_id=team_id)
+        return result
+
+
+# Drops cached reads: all of them, those of a method and/or those of a team
+def invalidate(method=None, team_id=None):
+    with _cache_lock:
+        for key in list(_cache):
+            name, arguments = key
+            if method is not None and name != method:
+                continue
+            if team_id is not None and str(dict(arguments).get('team_id')) != str(team_id):
+                continue
+            del _cache[key]
+
+
+# Hits, misses and hit rate per cached read since the container started
+def get_cache_stats():
+    with _cache_lock:
+        stats = {name: dict(counts) for name, counts in _cache_stats.items()}
+    for counts in stats.values():
+        counts['hit-rate'] = round(counts['hits'] / (counts['hits'] + counts['misses']), 3)
+    return stats
+
+
+# Must be called while holding the cache lock
+def _count(name, outcome):
+    counts = _cache_stats.setdefault(name, {'hits': 0, 'misses': 0})
+    counts[outcome] += 1
+
+
+# Cache key of a call: the arguments by name, whether they were passed positionally or as keywords
+def _get_arguments(method, args, kwargs):
+    try:
+        signature = inspect.signature(method)
+        bound_arguments = signature.bind(*args, **kwargs).arguments
+    except (TypeError, ValueError):
+        signature = None
+        bound_arguments = dict(kwargs, **{str(index): value for index, value in enumerate(args)})
+    arguments = {}
+    for name, value in bound_arguments.items():
+        if signature is not None and signature.parameters[name].kind == inspect.Parameter.VAR_KEYWORD:
+            arguments.update(value)
+        else:
+            arguments[name] = value
+    return tuple(sorted((name, str(value)) for name, value in arguments.items()))
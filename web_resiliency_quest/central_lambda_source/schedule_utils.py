@@ -0,0 +1,69 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import os
+import quest_const
+
+# Teams are checked every CHECK_MIN_INTERVAL_SECONDS while active. Every check that finds no change lowers the activity
+# score by one, doubling the interval up to CHECK_MAX_INTERVAL_SECONDS. A config change is therefore detected at worst
+# CHECK_MAX_INTERVAL_SECONDS + one cron period (60 seconds) + one check duration after it was made
+CHECK_MIN_INTERVAL_SECONDS = int(os.environ.get('CHECK_MIN_INTERVAL_SECONDS', '60'))
+CHECK_MAX_INTERVAL_SECONDS = int(os.environ.get('CHECK_MAX_INTERVAL_SECONDS', '180'))
+ACTIVITY_SCORE_MAX = 4
+# CronLambda runs every minute, a check due within the next half period is run now rather than one period late
+CHECK_DUE_SLACK_SECONDS = 30
+
+SCHEDULE_KEYS = ['next-check-at', 'activity-score', 'pending-quest-id']
+
+
+# Whether check_team_lambda has anything to do for the team: verify a pending AWS task, or complete the quest once
+# every task is done
+def needs_check(team_data):
+    if team_data['quest-completed']:
+        return False
+    if has_pending_aws_tasks(team_data):
+        return True
+    return all(team_data[flag] for flag in quest_const.INPUT_TASK_FLAGS)
+
+
+def has_pending_aws_tasks(team_data):
+    return not all(team_data[flag] for flag in quest_const.AWS_TASK_FLAGS)
+
+
+# Whether CronLambda must dispatch a check of the team. This is what its query on the pending checks index returns
+def is_check_due(team_data, now):
+    return needs_check(team_data) and int(team_data.get('next-check-at', 0)) <= now + CHECK_DUE_SLACK_SECONDS
+
+
+# Keeps the team in the sparse pending checks index (see quest_const.PENDING_CHECKS_INDEX) only while it needs checks.
+# Must be called whenever a task flag or quest-completed changes, before the item is saved
+def sync_pending_checks(team_data, quest_id):
+    if needs_check(team_data):
+        team_data['pending-quest-id'] = quest_id
+    else:
+        team_data.pop('pending-quest-id', None)
+
+
+def get_check_interval(activity_score):
+    return min(CHECK_MAX_INTERVAL_SECONDS, CHECK_MIN_INTERVAL_SECONDS * 2 ** (ACTIVITY_SCORE_MAX - activity_score))
+
+
+# The team just did something (submitted an input, changed its config): check it again as soon as possible
+def mark_active(team_data, now):
+    team_data['activity-score'] = ACTIVITY_SCORE_MAX
+    team_data['next-check-at'] = int(now)
+
+
+# Schedules the next check after a check of the team. Any change to the item (a task completed, or a change marker of
+# evaluation_utils.is_unchanged moved because the team changed its config) counts as activity, otherwise the team
+# is backed off
+def schedule_next_check(team_data, original_team_data, now):
+    if without_schedule(team_data) != without_schedule(original_team_data):
+        activity_score = ACTIVITY_SCORE_MAX
+    else:
+        activity_score = max(0, int(team_data.get('activity-score', ACTIVITY_SCORE_MAX)) - 1)
+    team_data['activity-score'] = activity_score
+    team_data['next-check-at'] = int(now + get_check_interval(activity_score))
+
+
+def without_schedule(team_data):
+    return {key: value for key, value in team_data.items() if key not in SCHEDULE_KEYS}
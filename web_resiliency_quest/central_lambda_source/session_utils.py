@@ -0,0 +1,130 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import collections
+import functools
+import os
+import threading
+import time
+import client_utils
+
+# Lifetime of the assumed-role credentials, counted from before the Ops role is assumed. The QDK returns a boto3 session
+# built from the AssumeRole response, without its Expiration, and AssumeRole issues credentials valid for an hour by
+# default. Rejected credentials are dropped right away whatever their lifetime, see CREDENTIAL_ERROR_CODES
+XA_SESSION_TTL_SECONDS = int(os.environ.get('XA_SESSION_TTL_SECONDS', '3600'))
+# Credentials are refreshed this long before they expire, so that no evaluation runs with credentials about to expire
+XA_SESSION_REFRESH_MARGIN_SECONDS = int(os.environ.get('XA_SESSION_REFRESH_MARGIN_SECONDS', '300'))
+# Team clients kept per container, least recently used first out. A team's check uses up to 3 clients (cloudfront,
+# wafv2, cloudwatch), so the default holds every team of a batch in flight (CHECK_BATCH_CONCURRENCY, default 10)
+XA_CLIENT_CACHE_SIZE = int(os.environ.get('XA_CLIENT_CACHE_SIZE', '30'))
+# Teams whose credentials are kept per container, least recently used first out. Credentials are a few hundred bytes
+XA_CREDENTIALS_CACHE_SIZE = int(os.environ.get('XA_CREDENTIALS_CACHE_SIZE', '500'))
+# Error codes of calls made with credentials that expired or that the team's account no longer accepts. The team's
+# credentials and clients are dropped, the next call assumes the Ops role again
+CREDENTIAL_ERROR_CODES = {
+    'ExpiredToken', 'ExpiredTokenException', 'InvalidClientTokenId', 'UnrecognizedClientException',
+    'AccessDenied', 'AccessDeniedException'
+}
+
+# Cross-account credentials and clients, kept at module scope so that warm Lambda containers reuse them across
+# invocations. Clients are all built on the default session of client_utils, a team only costs its credentials and
+# its clients. Format: {team_id: {'credentials': {client argument: value}, 'expires-at': epoch}} and
+# {(team_id, service): client}
+_team_credentials = collections.OrderedDict()
+_team_clients = collections.OrderedDict()
+_team_locks = {}
+_cache_lock = threading.Lock()
+_cache_stats = {'credentials-hits': 0, 'credentials-misses': 0, 'client-hits': 0, 'client-misses': 0, 'invalidations': 0}
+
+
+# Returns a boto3 client for the given service in the team's AWS account, assuming the team's Ops role only when
+# there are no cached credentials for the team or the cached credentials are about to expire
+def get_team_client(quests_api_client, team_id, service_name):
+    with _get_team_lock(team_id):
+        credentials = _get_team_credentials(quests_api_client, team_id)
+        with _cache_lock:
+            client = _team_clients.get((team_id, service_name))
+            if client is not None:
+                _team_clients.move_to_end((team_id, service_name))
+                _cache_stats['client-hits'] += 1
+                return client
+            _cache_stats['client-misses'] += 1
+
+        client = client_utils.build_client(service_name, **credentials)
+        client.meta.events.register('after-call', functools.partial(_check_credentials, team_id),
+                                    unique_id='session-utils-check-credentials')
+        with _cache_lock:
+            _team_clients[(team_id, service_name)] = client
+            while len(_team_clients) > XA_CLIENT_CACHE_SIZE:
+                _team_clients.popitem(last=False)
+        return client
+
+
+# Drops the cached credentials and clients of a team, e.g. after the credentials were rejected
+def invalidate_team(team_id):
+    with _cache_lock:
+        _cache_stats['invalidations'] += 1
+        _invalidate_team(team_id)
+
+
+def get_cache_stats():
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats['cached-teams'] = len(_team_credentials)
+        stats['cached-clients'] = len(_team_clients)
+    credentials_lookups = stats['credentials-hits'] + stats['credentials-misses']
+    client_lookups = stats['client-hits'] + stats['client-misses']
+    stats['credentials-hit-rate'] = round(stats['credentials-hits'] / credentials_lookups, 3) if credentials_lookups else None
+    stats['client-hit-rate'] = round(stats['client-hits'] / client_lookups, 3) if client_lookups else None
+    return stats
+
+
+# Must be called while holding the team lock. Returns the client arguments of the team's credentials
+def _get_team_credentials(quests_api_client, team_id):
+    with _cache_lock:
+        cached = _team_credentials.get(team_id)
+        if cached is not None and time.time() < cached['expires-at'] - XA_SESSION_REFRESH_MARGIN_SECONDS:
+            _team_credentials.move_to_end(team_id)
+            _cache_stats['credentials-hits'] += 1
+            return cached['credentials']
+        _cache_stats['credentials-misses'] += 1
+        # Clients of expired credentials must not be handed out anymore
+        _invalidate_team(team_id)
+
+    print(f"Assuming Ops role for team {team_id}")
+    assumed_at = time.time()
+    session = quests_api_client.assume_team_ops_role(team_id)
+    # Only the credentials are kept, the session and the botocore loader it holds are dropped
+    frozen_credentials = session.get_credentials().get_frozen_credentials()
+    credentials = {
+        'aws_access_key_id': frozen_credentials.access_key,
+        'aws_secret_access_key': frozen_credentials.secret_key,
+        'aws_session_token': frozen_credentials.token,
+        'region_name': session.region_name
+    }
+    with _cache_lock:
+        _team_credentials[team_id] = {'credentials': credentials, 'expires-at': assumed_at + XA_SESSION_TTL_SECONDS}
+        while len(_team_credentials) > XA_CREDENTIALS_CACHE_SIZE:
+            _invalidate_team(next(iter(_team_credentials)))
+    return credentials
+
+
+# Must be called while holding the cache lock
+def _invalidate_team(team_id):
+    _team_credentials.pop(team_id, None)
+    for key in [key for key in _team_clients if key[0] == team_id]:
+        del _team_clients[key]
+
+
+# after-call hook of the team clients, emitted for every call that got a response
+def _check_credentials(team_id, parsed, **kwargs):
+    error_code = parsed.get('Error', {}).get('Code')
+    if error_code in CREDENTIAL_ERROR_CODES:
+        print(f"Credentials of team {team_id} were rejected with {error_code}, dropping them")
+        invalidate_team(team_id)
+
+
+def _get_team_lock(team_id):
+    with _cache_lock:
+        if team_id not in _team_locks:
+            _team_locks[team_id] = threading.Lock()
+        return _team_locks[team_id]
@@ -1,10 +1,14 @@
 # Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
-import boto3
+import datetime
+import importlib
 import json
 import os
+import time
+import client_utils
 import quest_const
-from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+import metrics_utils
+import trace_utils
 
 # Standard AWS GameDay Quests Environment Variables
 QUEST_ID = os.environ['QUEST_ID']
@@ -16,21 +20,27 @@ GAMEDAY_REGION = os.environ['GAMEDAY_REGION']
 EVENT_RULE_CRON = os.environ['EVENT_RULE_CRON']
 INIT_LAMBDA = os.environ['INIT_LAMBDA']
 UPDATE_LAMBDA = os.environ['UPDATE_LAMBDA']
-
-lambda_client = boto3.client('lambda')
-events_client = boto3.client('events')
+# INVOKE hands QUEST_IN_PROGRESS and INPUT_UPDATED over to INIT_LAMBDA and UPDATE_LAMBDA with an async invocation,
+# IN_PROCESS runs init_lambda and update_lambda in this invocation, sparing the team a second Lambda hop, its
+# queueing delay and cold start before the outcome of its input shows
+SNS_DISPATCH_MODE = os.environ.get('SNS_DISPATCH_MODE', quest_const.SNS_DISPATCH_INVOKE)
 
 
+@metrics_utils.account_api_calls('sns_lambda')
+@trace_utils.trace_invocation('sns_lambda')
 def lambda_handler(event, context):
     print(f"sns_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
-
     # Pulling the message portion out of the SNS message.
     # Always a single message: https://aws.amazon.com/sns/faqs/#Reliability
+    process_notification(event['Records'][0]['Sns'], context)
+
+
+# Handles a notification of the QDK SNS topic: the 'Sns' part of an SNS Lambda event, or the body of a message the
+# topic delivered to the queue of sqs_lambda.py, which have the same Message, MessageAttributes and Timestamp fields
+def process_notification(sns_notification, context):
     # This is a json object pushed by the QDK SNS topic whenever something of note happens
-    message = event['Records'][0]['Sns']['Message']
+    message = sns_notification['Message']
     sns_values = json.loads(message)
     team_id = sns_values['team-id']
     quest_id = sns_values['quest-id']
@@ -40,52 +50,90 @@ def lambda_handler(event, context):
         print(f"Message for Quest: {quest_id}, this Quest is {QUEST_ID}, disregarding")
         return
 
-    sns_type = event['Records'][0]['Sns']['MessageAttributes']['event']['Value']
+    sns_type = sns_notification['MessageAttributes']['event']['Value']
 
     print(f"SNS Message for team {team_id}: {message}")
 
-    # Switch on SNS event type and delegate to the appropriate lambda
-    # If quest was enabled, initialize quest outputs
-    if sns_type == quest_const.QUEST_IN_PROGRESS:
-        print(f"Quest event: QUEST_IN_PROGRESS for team {team_id}... Invoking {INIT_LAMBDA}")
-
-        # providing payload for init_lambda
-        init_params = {'team_id': team_id}
-        lambda_invoke_response = lambda_client.invoke(
-            FunctionName=INIT_LAMBDA,
-            InvocationType='Event',
-            Payload=json.dumps(init_params, default=str)
-        )
-        print(lambda_invoke_response)
-
-    elif sns_type == quest_const.QUEST_INPUT_UPDATED:
-        key = sns_values['key']
-        value = sns_values['value']
-        print(f"Quest event: INPUT_UPDATED for team {team_id}, ({key}={value}), " +
-              f"triggering {UPDATE_LAMBDA}...")
-
-        # providing payload for update_lambda  
-        update_params = {
-            'team_id': team_id,
-            'key': key,
-            'value': value
-        }
-        lambda_invoke_response = lambda_client.invoke(
-            FunctionName=UPDATE_LAMBDA,
-            InvocationType='Event',
-            Payload=json.dumps(update_params, default=str))
-        print(lambda_invoke_response)
-
-    elif sns_type == quest_const.QUEST_DEPLOYING:
-        print(f"Quest SNS Lambda processing QUEST_DEPLOYING message, " +
-              f"ensuring EventBridge Cron Rule Enabled.")
-
-        # TODO Fix this in the immersion deck
-
-        # EventBridge cron should be enabled by default in the CFN template, but confirm at initialization just in case
-        response = events_client.enable_rule(Name=EVENT_RULE_CRON)
-        print("ENABLED " + EVENT_RULE_CRON, response)
-
-    else:
+    # Switch on SNS event type and delegate to the appropriate handler
+    handler = SNS_HANDLERS.get(sns_type)
+    if handler is None:
         # Unknown or unhandled message type. This is fine, just log.
         print(f"Unknown SNS message: {sns_values}")
+        return
+    # Every notification starts the trace of its team's action, from its publication by the Quests API
+    publish_time = get_publish_time(sns_notification)
+    with trace_utils.span('sns_notification', new_trace=True, start_time=publish_time, team_id=team_id, type=sns_type):
+        handler(team_id, sns_values, publish_time, context)
+
+
+# If quest was enabled, initialize quest outputs
+def handle_quest_in_progress(team_id, sns_values, publish_time, context):
+    print(f"Quest event: QUEST_IN_PROGRESS for team {team_id}... Dispatching to {INIT_LAMBDA} ({SNS_DISPATCH_MODE})")
+
+    # providing payload for init_lambda
+    init_params = {
+        'team_id': team_id,
+        'sns-publish-time': publish_time,
+        'dispatch-mode': SNS_DISPATCH_MODE
+    }
+    dispatch('init_lambda', INIT_LAMBDA, init_params, context)
+
+
+def handle_input_updated(team_id, sns_values, publish_time, context):
+    key = sns_values['key']
+    value = sns_values['value']
+    print(f"Quest event: INPUT_UPDATED for team {team_id}, ({key}={value}), " +
+          f"dispatching to {UPDATE_LAMBDA} ({SNS_DISPATCH_MODE})...")
+
+    # providing payload for update_lambda
+    update_params = {
+        'team_id': team_id,
+        'key': key,
+        'value': value,
+        'sns-publish-time': publish_time,
+        'dispatch-mode': SNS_DISPATCH_MODE
+    }
+    dispatch('update_lambda', UPDATE_LAMBDA, update_params, context)
+
+
+def handle_quest_deploying(team_id, sns_values, publish_time, context):
+    print("Quest SNS Lambda processing QUEST_DEPLOYING message, " +
+          "ensuring EventBridge Cron Rule Enabled.")
+
+    # TODO Fix this in the immersion deck
+
+    # EventBridge cron should be enabled by default in the CFN template, but confirm at initialization just in case
+    response = client_utils.get_client('events').enable_rule(Name=EVENT_RULE_CRON)
+    print("ENABLED " + EVENT_RULE_CRON, response)
+
+
+# Handlers of the Quests API SNS events, by event type: function(team_id, sns_values, publish_time, context)
+SNS_HANDLERS = {
+    quest_const.QUEST_IN_PROGRESS: handle_quest_in_progress,
+    quest_const.QUEST_INPUT_UPDATED: handle_input_updated,
+    quest_const.QUEST_DEPLOYING: handle_quest_deploying
+}
+
+
+# Runs the handler of the module handler_module_name in this invocation (IN_PROCESS), or invokes the Lambda
+# function_name asynchronously with the same payload (INVOKE). In process, an exception of the handler fails this
+# invocation, which Lambda retries like the async invocation of the handler's own function. The handler module is only
+# imported in process, so that with INVOKE the cold start of SnsLambda doesn't pay for init_lambda and update_lambda
+def dispatch(handler_module_name, function_name, params, context):
+    if SNS_DISPATCH_MODE == quest_const.SNS_DISPATCH_IN_PROCESS:
+        importlib.import_module(handler_module_name).lambda_handler(params, context)
+        return
+    lambda_invoke_response = client_utils.get_client('lambda').invoke(
+        FunctionName=function_name,
+        InvocationType='Event',
+        Payload=json.dumps(trace_utils.inject(params), default=str)
+    )
+    print(lambda_invoke_response)
+
+
+# Epoch time at which SNS published the message, the start of the submit to feedback time reported by the handlers
+def get_publish_time(sns_notification):
+    try:
+        return datetime.datetime.fromisoformat(sns_notification['Timestamp'].replace('Z', '+00:00')).timestamp()
+    except (KeyError, ValueError):
+        return time.time()
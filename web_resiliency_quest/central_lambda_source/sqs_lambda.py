@@ -0,0 +1,95 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import metrics_utils
+import quest_const
+import sns_lambda
+import trace_utils
+
+# Quest Environment Variables
+# Number of teams whose messages are handled concurrently by one invocation. The messages of a team are handled one
+# after the other, in the order SNS published them
+SQS_TEAM_CONCURRENCY = int(os.environ.get('SQS_TEAM_CONCURRENCY', '5'))
+
+
+# This function consumes the SQS queue the QDK SNS topic delivers to when SnsIngestionMode is QUEUE (see central_cfn.yaml).
+# A burst of messages, such as QUEST_IN_PROGRESS for every team at the start of the event, is drained by at most
+# SnsQueueMaxConcurrency invocations handling up to SnsQueueBatchSize messages each, instead of one SnsLambda
+# invocation per message. Every message is handled by sns_lambda.process_notification.
+# Failed messages are reported as batch item failures: only they are retried, not the whole batch
+@metrics_utils.account_api_calls('sqs_lambda')
+@trace_utils.trace_invocation('sqs_lambda')
+def lambda_handler(event, context):
+    print(f"sqs_lambda invocation, records={len(event['Records'])}, context: {str(context)}")
+    batch_start = time.time()
+
+    notifications_by_team, superseded, failed_message_ids = get_notifications_by_team(event['Records'])
+
+    with ThreadPoolExecutor(max_workers=max(1, min(SQS_TEAM_CONCURRENCY, len(notifications_by_team)))) as executor:
+        futures = [executor.submit(trace_utils.bind(process_team_notifications), notifications, context)
+                   for notifications in notifications_by_team.values()]
+    for future in futures:
+        failed_message_ids += future.result()
+
+    print(f"SQS batch: messages={len(event['Records'])}, teams={len(notifications_by_team)}, " +
+          f"coalesced={len(superseded)}, failed={len(failed_message_ids)}, " +
+          f"elapsed_ms={int((time.time() - batch_start) * 1000)}")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failed_message_ids]}
+
+
+# Groups the SNS notifications of the batch by team, in publication order, and coalesces duplicates: of several
+# INPUT_UPDATED messages for the same team and input only the last one is kept, since it holds the team's current answer
+# (the superseded answers are neither scored nor penalized), and a repeated QUEST_IN_PROGRESS or QUEST_DEPLOYING of a
+# team is handled once.
+# :returns: ({team_id: [(SQS message id, SNS notification), ...]}, [superseded SQS message ids],
+#           [SQS message ids of the messages that are not SNS notifications of the QDK topic])
+def get_notifications_by_team(records):
+    notifications = []
+    malformed = []
+    for record in records:
+        try:
+            sns_notification = json.loads(record['body'])
+            sns_values = json.loads(sns_notification['Message'])
+            sns_type = sns_notification['MessageAttributes']['event']['Value']
+        except (KeyError, TypeError, ValueError) as err:
+            # Retried until the queue moves it to its dead-letter queue
+            print(f"Malformed SQS message {record['messageId']}: {err}")
+            malformed.append(record['messageId'])
+            continue
+        coalesce_key = (sns_values.get('team-id'), sns_type)
+        if sns_type == quest_const.QUEST_INPUT_UPDATED:
+            coalesce_key += (sns_values.get('key'),)
+        notifications.append((sns_notification.get('Timestamp', ''), coalesce_key, record['messageId'], sns_notification))
+    # SQS standard queues don't keep the order the messages were sent in
+    notifications.sort(key=lambda notification: notification[0])
+
+    latest = {}
+    superseded = []
+    for _, coalesce_key, message_id, sns_notification in notifications:
+        if coalesce_key in latest:
+            superseded.append(latest[coalesce_key][0])
+        latest[coalesce_key] = (message_id, sns_notification)
+    if superseded:
+        print(f"Coalesced SQS messages superseded by a later message of the same team: {superseded}")
+
+    notifications_by_team = {}
+    for _, coalesce_key, message_id, sns_notification in notifications:
+        if latest[coalesce_key][0] == message_id:
+            notifications_by_team.setdefault(coalesce_key[0], []).append((message_id, sns_notification))
+    return notifications_by_team, superseded, malformed
+
+
+# Handles the notifications of one team in order. Once one fails, the later ones are not handled either, so that they
+# are retried after it rather than overtaking it
+# :returns: the SQS message ids of the failed and skipped notifications
+def process_team_notifications(notifications, context):
+    for index, (message_id, sns_notification) in enumerate(notifications):
+        try:
+            sns_lambda.process_notification(sns_notification, context)
+        except Exception as err:
+            print(f"Error while handling SQS message {message_id}: {err}")
+            return [failed_message_id for failed_message_id, _ in notifications[index:]]
+    return []
@@ -0,0 +1,165 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+import contextlib
+import functools
+import json
+import threading
+import time
+import uuid
+
+# Key of the trace context in the payload of the Lambda invocations, see inject
+TRACE_CONTEXT_KEY = 'trace-context'
+
+# Current span of the thread: {'trace-id', 'span-id', 'spans': list of the finished spans of the invocation}.
+# Worker threads of an invocation get the span of the thread submitting them through bind
+_thread_state = threading.local()
+
+
+# Prints the spans of an invocation as one 'Trace spans:' log line. The spans of a trace are spread over the log
+# groups of the functions it went through, and are put back together by their trace-id
+class LogExporter:
+
+    def export(self, spans):
+        print(f"Trace spans: {json.dumps(spans, separators=(',', ':'), default=str)}")
+
+
+# Keeps the spans in memory, to put the timeline of a trace back together in the benchmarks and tests
+class InMemoryExporter:
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def export(self, spans):
+        with self.lock:
+            self.spans += spans
+
+    # The spans of a trace (or of the subtree of one of its spans) in start order, with their depth in the tree and
+    # their offset from the start of the first one
+    def get_timeline(self, trace_id, root_span_id=None):
+        with self.lock:
+            spans = [span for span in self.spans if span['trace-id'] == trace_id]
+        spans_by_id = {span['span-id']: span for span in spans}
+
+        def get_depth(span):
+            depth = 0
+            while span['parent-span-id'] in spans_by_id and span['span-id'] != root_span_id:
+                span = spans_by_id[span['parent-span-id']]
+                depth += 1
+            return depth if root_span_id is None or span['span-id'] == root_span_id else None
+
+        timeline = []
+        for span in spans:
+            depth = get_depth(span)
+            if depth is not None:
+                timeline.append(dict(span, depth=depth))
+        timeline.sort(key=lambda span: span['start'])
+        for span in timeline:
+            span['offset-ms'] = int((span['start'] - timeline[0]['start']) * 1000)
+        return timeline
+
+
+_exporter = LogExporter()
+
+
+def set_exporter(exporter):
+    global _exporter
+    _exporter = exporter
+
+
+# Decorator of the lambda_handler functions: the invocation is a span of the trace whose context the payload carries
+# (see inject), or the root span of a new trace. Its spans are exported when it ends. A handler run by another one in
+# the same invocation (e.g. init_lambda by sns_lambda in IN_PROCESS dispatch mode) is a child span of the current one
+def trace_invocation(handler_name):
+    def decorator(lambda_handler):
+        @functools.wraps(lambda_handler)
+        def wrapper(event, context):
+            current = getattr(_thread_state, 'current', None)
+            if current is not None:
+                with span(handler_name):
+                    return lambda_handler(event, context)
+
+            trace_context = event.get(TRACE_CONTEXT_KEY, {}) if isinstance(event, dict) else {}
+            _thread_state.current = {'trace-id': trace_context.get('trace-id'),
+                                     'span-id': trace_context.get('parent-span-id'), 'spans': []}
+            try:
+                with span(handler_name, new_trace=_thread_state.current['trace-id'] is None):
+                    return lambda_handler(event, context)
+            finally:
+                spans = _thread_state.current['spans']
+                _thread_state.current = None
+                _exporter.export(spans)
+        return wrapper
+    return decorator
+
+
+# Span around a block of the invocation, child of the current span of the thread. With new_trace, the root span of a
+# new trace instead, e.g. for each message of a batch. Nothing is recorded outside of a traced invocation
+@contextlib.contextmanager
+def span(name, new_trace=False, start_time=None, **attributes):
+    parent = getattr(_thread_state, 'current', None)
+    if parent is None:
+        yield
+        return
+    current = {
+        'trace-id': uuid.uuid4().hex if new_trace else parent['trace-id'],
+        'span-id': uuid.uuid4().hex[:16],
+        'spans': parent['spans']
+    }
+    start = time.time() if start_time is None else start_time
+    _thread_state.current = current
+    try:
+        yield
+    finally:
+        _thread_state.current = parent
+        _add_span(current, None if new_trace else parent['span-id'], name, start, time.time() - start, attributes)
+
+
+# Records an external call that took duration_ms as a child span of the current span of the thread
+def record_span(name, start, duration_ms, **attributes):
+    parent = getattr(_thread_state, 'current', None)
+    if parent is not None:
+        _add_span({'trace-id': parent['trace-id'], 'span-id': uuid.uuid4().hex[:16], 'spans': parent['spans']},
+                  parent['span-id'], name, start, duration_ms / 1000, attributes)
+
+
+# Adds the trace context of the current span to the payload of a Lambda invocation. :returns: the payload
+def inject(payload):
+    current = getattr(_thread_state, 'current', None)
+    if current is not None:
+        payload[TRACE_CONTEXT_KEY] = {'trace-id': current['trace-id'], 'parent-span-id': current['span-id']}
+    return payload
+
+
+# The trace id of the current span of the thread, or None outside of a traced invocation
+def get_trace_id():
+    current = getattr(_thread_state, 'current', None)
+    return current['trace-id'] if current is not None else None
+
+
+# Returns function running with the current span of the calling thread, to be submitted to a worker thread
+def bind(function):
+    current = getattr(_thread_state, 'current', None)
+
+    @functools.wraps(function)
+    def bound_function(*args, **kwargs):
+        previous = getattr(_thread_state, 'current', None)
+        _thread_state.current = current
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _thread_state.current = previous
+    return bound_function
+
+
+def _add_span(current, parent_span_id, name, start, duration, attributes):
+    # list.append is atomic, the worker threads of the invocation share the list
+    current['spans'].append({
+        'trace-id': current['trace-id'],
+        'span-id': current['span-id'],
+        'parent-span-id': parent_span_id,
+        'name': name,
+        'start': round(start, 3),
+        'duration-ms': int(duration * 1000),
+        'attributes': attributes
+    })
@@ -1,9 +1,29 @@
 # Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
-import boto3
-from datetime import datetime 
-from boto3.dynamodb.conditions import Attr
-from botocore.exceptions import ClientError
+import os
+import time
+import threading
+import client_utils
+
+# How long a signed URL is served from the cache. Entries are evicted after at most half of their signed
+# duration as well, so a cached URL posted to the dashboard always stays valid for a good while
+SIGNED_URL_CACHE_TTL_SECONDS = int(os.environ.get('SIGNED_URL_CACHE_TTL_SECONDS', '3600'))
+
+# Images shipped in artifacts/images and uploaded under ASSETS_BUCKET_PREFIX by package_quest.sh
+ASSET_IMAGE_NAMES = [
+    "architecture_final.png",
+    "architecture_task0.png",
+    "architecture_task2.png",
+    "architecture_task3.png",
+    "architecture_task5.png",
+    "cloudwatch_metrics.png",
+    "robot_queue_image.png",
+    "waf_console.png"
+]
+
+# Signed URLs by (bucket, key, duration), each stored with the time it must be evicted at
+signed_url_cache = {}
+signed_url_cache_lock = threading.Lock()
 
 # In a development environment, we are likely dealing with a situation where SCPs or other organizational
 # mechanisms block public buckets/objects, so signed URL must be used.
@@ -12,20 +32,53 @@ from botocore.exceptions import ClientError
 # :param signed_duration: if signing, how long should the signed URL be valid
 # :returns: a URL compatible with unauthenticated requests.get()
 def generate_signed_or_open_url(bucket_name: str, object_key: str, signed_duration=60):
+    result = None
     try:
         if "ee-assets-prod" in bucket_name:
             print("Detected Event Engine bucket. Inferring the quest is running in EE")
             public_url = f"https://s3.amazonaws.com/{bucket_name}/{object_key}"
             result = public_url
         else:
-            signed_url = boto3.client("s3").generate_presigned_url('get_object',
-                                            Params={
-                                                'Bucket': bucket_name,
-                                                'Key': object_key
-                                            },
-                                            ExpiresIn=signed_duration)
-            result = signed_url
+            result = get_cached_signed_url(bucket_name, object_key, signed_duration)
+            if result is None:
+                signed_url = client_utils.get_client('s3').generate_presigned_url('get_object',
+                                                Params={
+                                                    'Bucket': bucket_name,
+                                                    'Key': object_key
+                                                },
+                                                ExpiresIn=signed_duration)
+                cache_signed_url(bucket_name, object_key, signed_duration, signed_url)
+                result = signed_url
     except Exception as e:
         print(f"Unable to sign content: {e}")
 
-    return result
\ No newline at end of file
+    return result
+
+
+# Signs the given artifacts/images assets (by default all of them) at once, warming the cache for the calls that follow
+# :returns: the URLs by image name
+def generate_asset_image_urls(bucket_name: str, key_prefix: str, signed_duration=60, image_names=ASSET_IMAGE_NAMES):
+    return {
+        image_name: generate_signed_or_open_url(bucket_name, f"{key_prefix}{image_name}", signed_duration)
+        for image_name in image_names
+    }
+
+
+# Returns the cached signed URL for the object, or None if there is none or it is due for eviction
+def get_cached_signed_url(bucket_name, object_key, signed_duration):
+    cache_key = (bucket_name, object_key, signed_duration)
+    with signed_url_cache_lock:
+        cached = signed_url_cache.get(cache_key)
+        if cached is None:
+            return None
+        signed_url, evict_at = cached
+        if time.time() >= evict_at:
+            del signed_url_cache[cache_key]
+            return None
+        return signed_url
+
+
+def cache_signed_url(bucket_name, object_key, signed_duration, signed_url):
+    evict_at = time.time() + min(SIGNED_URL_CACHE_TTL_SECONDS, signed_duration / 2)
+    with signed_url_cache_lock:
+        signed_url_cache[(bucket_name, object_key, signed_duration)] = (signed_url, evict_at)
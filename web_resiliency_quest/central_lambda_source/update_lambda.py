@@ -2,16 +2,17 @@
 # This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
 import json
 import os
-import boto3
-from datetime import datetime
+import time
+import client_utils
+import dashboard_utils
 import dynamodb_utils
 import quest_const
+import metrics_utils
+import quests_api_utils
 import input_const
-import output_const
 import scoring_const
-import hint_const
-import ui_utils
-from aws_gameday_quests.gdQuestsApi import GameDayQuestsApiClient
+import schedule_utils
+import trace_utils
 
 # Standard AWS GameDay Quests Environment Variables
 QUEST_ID = os.environ['QUEST_ID']
@@ -22,18 +23,17 @@ GAMEDAY_REGION = os.environ['GAMEDAY_REGION']
 # Quest Environment Variables
 QUEST_TEAM_STATUS_TABLE = os.environ['QUEST_TEAM_STATUS_TABLE']
 
-# Dynamo DB resource
-dynamodb = boto3.resource('dynamodb')
-quest_team_status_table = dynamodb.Table(QUEST_TEAM_STATUS_TABLE)
-
 # This function is triggered by sns_lambda.py whenever the team has provided input via the event UI. It validates
 # the input and performs related operations, such as updating the team's DynamoDB table record or posting a feedback message.
-# Expected event parameters: {'team_id': team_id,'key': key, 'value': value}
+# Expected event parameters: {'team_id': team_id,'key': key, 'value': value, 'sns-publish-time': epoch, 'dispatch-mode': mode}
+# (the last two are set by sns_lambda.py, to report the time until the team sees the outcome)
+@metrics_utils.account_api_calls('update_lambda')
+@trace_utils.trace_invocation('update_lambda')
 def lambda_handler(event, context):
     print(f"update_lambda invocation, event:{json.dumps(event, default=str)}, context: {str(context)}")
 
-    # Instantiate the Quest API Client.
-    quests_api_client = GameDayQuestsApiClient(QUEST_API_BASE, QUEST_API_TOKEN)
+    # The Quest API Client of this container: pooled connections and cached reads, see quests_api_utils.py
+    quests_api_client = quests_api_utils.get_quests_api_client(QUEST_API_BASE, QUEST_API_TOKEN)
 
     # Check if event is running
     event_status = quests_api_client.get_event_status()
@@ -45,10 +45,22 @@ def lambda_handler(event, context):
     quest_status = quests_api_client.get_quest_for_team(team_id=event['team_id'], quest_id=QUEST_ID)
     if quest_status['quest-state'] != quest_const.TEAM_QUEST_IN_PROGRESS:
         print(f"Quest Status: {quest_status['quest-state']}, aborting UPDATE_LAMBDA")
+        return
 
+    # The table resource is the thread's own, sqs_lambda.py runs updates of several teams in worker threads
+    quest_team_status_table = client_utils.get_thread_table(QUEST_TEAM_STATUS_TABLE)
     dynamodb_response = quest_team_status_table.get_item(Key={'team-id': event['team_id']})
     print(f"Retrieved team state for team {event['team_id']}: {json.dumps(dynamodb_response, default=str)}")
-    team_data = dynamodb_response['Item']
+    original_team_data = dynamodb_utils.load_team_data(dynamodb_response['Item'])
+    team_data = original_team_data.copy()
+
+    # An input means the team is active, make sure its next check comes soon. This is also what gets the quest completed
+    # by CHECK_TEAM_LAMBDA when the input was the last pending task
+    schedule_utils.mark_active(team_data, time.time())
+
+    # The penalty of a wrong answer, posted once its message is shown. Lambda retries a failed invocation as a whole,
+    # a failed dashboard sync therefore fails it before anything was scored
+    penalty = None
 
     task1_origin = "amazon.com"
     task4_ip_address = "52.23.186.156"
@@ -62,43 +74,15 @@ def lambda_handler(event, context):
 
             # Correct answer - switch flag to true
             team_data['is-identified-origin'] = True
+            team_data.pop('task1-wrong-answer', None)
 
             try:
-                # First update DynamoDB to avoid race conditions, then do the rest on success
-                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
-
-                # Delete previous error if present
-                quests_api_client.delete_output(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID, 
-                    key=output_const.TASK1_WRONG_ORIGIN_KEY
-                )
-                
-                # Delete input since cannot be updated as task can be started only once
-                quests_api_client.delete_input(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID, 
-                    key=input_const.TASK1_ORIGIN_KEY
-                )
-
-                # Delete hint
-                quests_api_client.delete_hint(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    hint_key=hint_const.TASK1_HINT1_KEY,
-                    detail=True
-                )
+                # First update DynamoDB to avoid race conditions, then do the rest on success. Only the first of
+                # several concurrent submissions of the correct answer completes the task
+                schedule_utils.sync_pending_checks(team_data, QUEST_ID)
+                if 'is-identified-origin' not in dynamodb_utils.update_team_data(original_team_data, team_data, quest_team_status_table):
+                    raise ValueError("The task was completed by a concurrent update of the team")
 
-                # Replace input with an output to leave a trace of what has been done
-                quests_api_client.post_output(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    key=output_const.TASK1_CORRECT_ORIGIN_KEY,
-                    label=output_const.TASK1_CORRECT_ORIGIN_LABEL,
-                    value=output_const.TASK1_CORRECT_ORIGIN_VALUE,
-                    dashboard_index=output_const.TASK1_CORRECT_ORIGIN_INDEX,
-                    markdown=output_const.TASK1_CORRECT_ORIGIN_MARKDOWN,
-                )
                 # Award points
                 quests_api_client.post_score_event(
                     team_id=team_data["team-id"],
@@ -110,23 +94,9 @@ def lambda_handler(event, context):
             except Exception as err:
                 print(f"Error while handling team update request: {err}")
         else:
-            # Post output
-            quests_api_client.post_output(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                key=output_const.TASK1_WRONG_ORIGIN_KEY,
-                label=output_const.TASK1_WRONG_ORIGIN_LABEL,
-                value=output_const.TASK1_WRONG_ORIGIN_VALUE,
-                dashboard_index=output_const.TASK1_WRONG_ORIGIN_INDEX,
-                markdown=output_const.TASK1_WRONG_ORIGIN_MARKDOWN,
-            )
-            # Detract points
-            quests_api_client.post_score_event(
-                team_id=team_data["team-id"],
-                quest_id=QUEST_ID,
-                description=scoring_const.TASK1_WRONG_ORIGIN_DESC,
-                points=scoring_const.TASK1_WRONG_ORIGIN_POINTS
-            )
+            # Remember the wrong answer, its message is shown until the correct one is given
+            team_data['task1-wrong-answer'] = True
+            penalty = (scoring_const.TASK1_WRONG_ORIGIN_DESC, scoring_const.TASK1_WRONG_ORIGIN_POINTS)
 
     # Task 4 - Needle in the ocean       
     elif (event['key'] == input_const.TASK4_ENDPOINT_KEY
@@ -138,43 +108,15 @@ def lambda_handler(event, context):
 
             # Correct answer - switch flag to true
             team_data['is-answer-to-ip-address-correct'] = True
+            team_data.pop('task4-wrong-answer', None)
 
             try:
-                # First update DynamoDB to avoid race conditions, then do the rest on success
-                dynamodb_utils.save_team_data(team_data, quest_team_status_table)
-
-                # Delete previous error if present
-                quests_api_client.delete_output(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID, 
-                    key=output_const.TASK4_IP_ADDRESS_WRONG_KEY
-                )
-                
-                # Delete input since cannot be updated as task can be started only once
-                quests_api_client.delete_input(
-                    team_id=team_data["team-id"],
-                    quest_id=QUEST_ID, 
-                    key=input_const.TASK4_ENDPOINT_KEY
-                )
-
-                # Delete hint
-                quests_api_client.delete_hint(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    hint_key=hint_const.TASK4_HINT1_KEY,
-                    detail=True
-                )
+                # First update DynamoDB to avoid race conditions, then do the rest on success. Only the first of
+                # several concurrent submissions of the correct answer completes the task
+                schedule_utils.sync_pending_checks(team_data, QUEST_ID)
+                if 'is-answer-to-ip-address-correct' not in dynamodb_utils.update_team_data(original_team_data, team_data, quest_team_status_table):
+                    raise ValueError("The task was completed by a concurrent update of the team")
 
-                # Replace input with an output to leave a trace of what has been done
-                quests_api_client.post_output(
-                    team_id=team_data['team-id'],
-                    quest_id=QUEST_ID,
-                    key=output_const.TASK4_IP_ADDRESS_CORRECT_KEY,
-                    label=output_const.TASK4_IP_ADDRESS_CORRECT_LABEL,
-                    value=output_const.TASK4_IP_ADDRESS_CORRECT_VALUE,
-                    dashboard_index=output_const.TASK4_IP_ADDRESS_CORRECT_INDEX,
-                    markdown=output_const.TASK4_IP_ADDRESS_CORRECT_MARKDOWN,
-                )
                 # Award points
                 quests_api_client.post_score_event(
                     team_id=team_data["team-id"],
@@ -186,23 +128,37 @@ def lambda_handler(event, context):
             except Exception as err:
                 print(f"Error while handling team update request: {err}")
         else:
-            # Post output
-            quests_api_client.post_output(
-                team_id=team_data['team-id'],
-                quest_id=QUEST_ID,
-                key=output_const.TASK4_IP_ADDRESS_WRONG_KEY,
-                label=output_const.TASK4_IP_ADDRESS_WRONG_LABEL,
-                value=output_const.TASK4_IP_ADDRESS_WRONG_VALUE,
-                dashboard_index=output_const.TASK4_IP_ADDRESS_WRONG_INDEX,
-                markdown=output_const.TASK4_IP_ADDRESS_WRONG_MARKDOWN,
-            )
-            # Detract points
-            quests_api_client.post_score_event(
-                team_id=team_data["team-id"],
-                quest_id=QUEST_ID,
-                description=scoring_const.TASK4_WRONG_IP_ADDRESS_DESC,
-                points=scoring_const.TASK4_WRONG_IP_ADDRESS_POINTS
-            )
+            # Remember the wrong answer, its message is shown until the correct one is given
+            team_data['task4-wrong-answer'] = True
+            penalty = (scoring_const.TASK4_WRONG_IP_ADDRESS_DESC, scoring_const.TASK4_WRONG_IP_ADDRESS_POINTS)
 
     else:
         print(f"Unknown input key {event['key']} encountered, ignoring.")
+        # Still an input of the team, its earlier check is kept
+        dynamodb_utils.update_team_data(original_team_data, team_data, quest_team_status_table)
+
+    # Show the outcome on the dashboard (correct answer message in place of the input and its hint, or wrong answer
+    # message), see dashboard_utils.DASHBOARD_MANIFEST. This also retries the dashboard writes that failed before
+    dashboard_errors = dashboard_utils.sync_dashboard(quests_api_client, team_data, quest_team_status_table)
+    report_feedback_time(event)
+    if dashboard_errors:
+        raise RuntimeError(f"Dashboard writes failed for team {team_data['team-id']}: {dashboard_errors}")
+
+    if penalty is not None:
+        # Remember the wrong answer, then detract points
+        dynamodb_utils.update_team_data(original_team_data, team_data, quest_team_status_table)
+        description, points = penalty
+        quests_api_client.post_score_event(
+            team_id=team_data["team-id"],
+            quest_id=QUEST_ID,
+            description=description,
+            points=points
+        )
+
+
+# Report the time from the SNS notification of the input to its outcome on the team's dashboard
+def report_feedback_time(event):
+    if 'sns-publish-time' in event:
+        print(f"Submit to feedback: team={event['team_id']}, key={event['key']}, dispatch={event.get('dispatch-mode')}, " +
+              f"feedback_ms={int((time.time() - float(event['sns-publish-time'])) * 1000)}, " +
+              f"trace_id={trace_utils.get_trace_id()}")
@@ -0,0 +1,72 @@
+# Copyright 2022 Amazon.com and its affiliates; all rights reserved. 
+# This file is Amazon Web Services Content and may not be duplicated or distributed without permission.
+
+# Web ACLs attached to CloudFront distributions live in the CLOUDFRONT scope
+WAF_SCOPE = "CLOUDFRONT"
+# Maximum page size accepted by the WAFv2 list APIs
+WAF_PAGE_LIMIT = 100
+
+
+# Lists all IP set summaries (Name, Id, ARN, LockToken) of the account, following NextMarker across pages
+def list_ip_sets(waf_client, scope=WAF_SCOPE):
+    return list(_paginate(waf_client.list_ip_sets, 'IPSets', scope))
+
+
+# Returns the summary of the web ACL with the given name, or None if there is none. Stops listing once found
+def find_web_acl(waf_client, web_acl_name, scope=WAF_SCOPE):
+    for web_acl in _paginate(waf_client.list_web_acls, 'WebACLs', scope):
+        if web_acl['Name'] == web_acl_name:
+            return web_acl
+    return None
+
+
+# Returns the ARNs of the IP sets referenced by the rules of a web ACL, in rule order and without duplicates
+# (a dict keeps the order, and its membership test doesn't grow with the number of referenced IP sets).
+# IP set references nested in logical (And/Or/Not) or rate-based statements are included
+def get_referenced_ip_set_arns(web_acl_rules):
+    referenced_arns = {}
+    for rule in web_acl_rules:
+        for arn in _get_statement_ip_set_arns(rule.get('Statement', {})):
+            referenced_arns.setdefault(arn)
+    return list(referenced_arns)
+
+
+# Fetches the referenced IP sets one at a time and returns the summary of the first one containing the address,
+# or None. Only the referenced IP sets are fetched, and fetching stops as soon as a match is found
+def find_ip_set_with_address(waf_client, ip_sets, referenced_arns, address, scope=WAF_SCOPE):
+    ip_sets_by_arn = {ip_set['ARN']: ip_set for ip_set in ip_sets}
+    for arn in referenced_arns:
+        ip_set = ip_sets_by_arn.get(arn)
+        if ip_set is None:
+            print(f"IP set {arn} referenced by the web ACL was not found in scope {scope}")
+            continue
+        waf_ip_set_response = waf_client.get_ip_set(Id=ip_set['Id'], Scope=scope, Name=ip_set['Name'])
+        if address in waf_ip_set_response['IPSet']['Addresses']:
+            return ip_set
+    return None
+
+
+def _paginate(list_operation, items_key, scope):
+    kwargs = {'Scope': scope, 'Limit': WAF_PAGE_LIMIT}
+    while True:
+        response = list_operation(**kwargs)
+        for item in response.get(items_key, []):
+            yield item
+        # The last page may still carry a marker, it is only known to be the last one once it comes back empty
+        next_marker = response.get('NextMarker')
+        if not next_marker or not response.get(items_key):
+            return
+        kwargs['NextMarker'] = next_marker
+
+
+def _get_statement_ip_set_arns(statement):
+    if 'IPSetReferenceStatement' in statement:
+        yield statement['IPSetReferenceStatement']['ARN']
+    for key in ('AndStatement', 'OrStatement'):
+        if key in statement:
+            for nested_statement in statement[key]['Statements']:
+                yield from _get_statement_ip_set_arns(nested_statement)
+    if 'NotStatement' in statement:
+        yield from _get_statement_ip_set_arns(statement['NotStatement']['Statement'])
+    if 'ScopeDownStatement' in statement.get('RateBasedStatement', {}):
+        yield from _get_statement_ip_set_arns(statement['RateBasedStatement']['ScopeDownStatement'])
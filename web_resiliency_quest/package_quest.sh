@@ -29,7 +29,11 @@ source .venv/bin/activate || exit 1
 pip install -r requirements.txt || exit 1
 deactivate || exit 1
 cd ${QUEST_ROOT_DIR}/central_lambda_source/.venv/lib/python3*/site-packages || exit 1
-zip -qr9 - . > ${QUEST_ROOT_DIR}/build/gdQuests-lambda-source.zip --exclude "boto*" "s3transfer*" "pip*" "jmespath*" || exit 1
+# Only ship what the Lambda runtime doesn't provide: boto3 and its dependencies are part of the runtime, and the
+# venv tooling, package metadata and bytecode caches are never used by the handlers
+zip -qr9 - . > ${QUEST_ROOT_DIR}/build/gdQuests-lambda-source.zip --exclude "boto*" "s3transfer*" "pip*" "jmespath*" \
+  "dateutil*" "python_dateutil*" "six.py" "six-*" "setuptools*" "pkg_resources*" "_distutils_hack*" "distutils-precedence.pth" \
+  "*.dist-info/*" "*__pycache__*" || exit 1
 
 cd ${QUEST_ROOT_DIR}/central_lambda_source || exit 1
 zip -g ${QUEST_ROOT_DIR}/build/gdQuests-lambda-source.zip *.py || exit 1